@@ -0,0 +1,362 @@
+"""
+Benchmark suite for the GillesPy solvers.
+
+Runs the example models (simple1, tyson_oscillator, Volume_test and the
+genetic toggle switch) and synthetic reaction networks of increasing size
+with every solver that is available, and writes the measurements as JSON
+so that runs before and after an upgrade can be compared:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+
+For each solver and model it records the wall time, trajectories/sec,
+reaction events/sec (native SSA) and peak memory growth of the run. It
+also measures the import time of gillespy, StochML serialization time and
+the time taken to parse StochKit trajectory output.
+"""
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import multiprocessing
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+import warnings
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+import numpy
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, '..'), os.path.join(HERE, '..', 'examples')]
+
+import gillespy
+
+SOLVERS = ['NumPySSASolver', 'SciPyODESolver', 'StochKitSolver',
+           'StochKitODESolver']
+
+# Seconds between checks that a measured child process is still running
+POLL_INTERVAL = 1.0
+
+
+class ToggleSwitch(gillespy.Model):
+    """ Gardner et al. Nature (1999), as in examples/GeneticToggleSwitch. """
+
+    def __init__(self, parameter_values=None):
+        gillespy.Model.__init__(self, name="toggle_switch")
+        alpha1 = gillespy.Parameter(name='alpha1', expression=1)
+        alpha2 = gillespy.Parameter(name='alpha2', expression=1)
+        beta = gillespy.Parameter(name='beta', expression="2.0")
+        gamma = gillespy.Parameter(name='gamma', expression="2.0")
+        mu = gillespy.Parameter(name='mu', expression=1.0)
+        self.add_parameter([alpha1, alpha2, beta, gamma, mu])
+        U = gillespy.Species(name='U', initial_value=10)
+        V = gillespy.Species(name='V', initial_value=10)
+        self.add_species([U, V])
+        cu = gillespy.Reaction(name="r1", reactants={}, products={U:1},
+                propensity_function="alpha1/(1+pow(V,beta))")
+        cv = gillespy.Reaction(name="r2", reactants={}, products={V:1},
+                propensity_function="alpha2/(1+pow(U,gamma))")
+        du = gillespy.Reaction(name="r3", reactants={U:1}, products={},
+                rate=mu)
+        dv = gillespy.Reaction(name="r4", reactants={V:1}, products={},
+                rate=mu)
+        self.add_reaction([cu, cv, du, dv])
+        self.timespan(numpy.linspace(0, 100, 101))
+
+
+def synthetic_network(n, seed=0):
+    """
+    A random mass-action network of n species with 3n reactions: production
+    and degradation of every species, a ring of conversions, and n/2
+    dimerizations. Populations settle around 100.
+    """
+    rng = numpy.random.RandomState(seed)
+    species = ['S{0}'.format(i) for i in range(n)]
+    columns, rates = [], []
+
+    def reaction(change, rate):
+        column = numpy.zeros(n, dtype=int)
+        for i, c in change:
+            column[i] += c
+        columns.append(column)
+        rates.append(rate)
+
+    for i in range(n):
+        reaction([(i, 1)], 10.0)
+        reaction([(i, -1)], 0.1)
+        reaction([(i, -1), ((i + 1) % n, 1)], 0.5)
+    for _ in range(n // 2):
+        a, b, c = rng.choice(n, 3, replace=False)
+        reaction([(a, -1), (b, -1), (c, 1)], 0.001)
+    return gillespy.Model.from_arrays(
+        species, [100] * n, numpy.array(columns).T, rates,
+        name='synthetic_{0}'.format(n), tspan=numpy.linspace(0, 10, 11))
+
+
+def example_models(sizes):
+    import simple1
+    import tyson_oscillator
+    import Volume_test
+    models = [simple1.Simple1(), tyson_oscillator.Tyson2StateOscillator(),
+              Volume_test.Simple1(), ToggleSwitch()]
+    return models + [synthetic_network(n) for n in sizes]
+
+
+def _child(queue, function, args):
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        start = timeit.default_timer()
+        result = function(*args)
+        elapsed = timeit.default_timer() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - usage
+        queue.put((elapsed, peak * 1024, result, None))
+    except Exception as e:
+        queue.put((None, None, None, str(e).split('\n')[0]))
+
+
+def _receive(queue, process, timeout):
+    """
+    The message of the child process, polling so that a child that dies
+    without one (e.g. killed for lack of memory) or runs for longer than
+    timeout seconds raises RuntimeError instead of blocking.
+    """
+    deadline = None if timeout is None else timeit.default_timer() + timeout
+    while True:
+        alive = process.is_alive()
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except Empty:
+            pass
+        if not alive:
+            raise RuntimeError("exited with code {0} without a "
+                               "result".format(process.exitcode))
+        if deadline is not None and timeit.default_timer() > deadline:
+            process.terminate()
+            process.join()
+            raise RuntimeError("timed out after {0:g} s".format(timeout))
+
+
+def measure(function, args=(), timeout=None):
+    """
+    Wall time (s), peak memory growth (bytes) and result of function(*args),
+    which is run in a child process so that its peak resident memory can
+    be read without the overhead of tracing allocations. function must be
+    a module-level function and args picklable, so that they can be sent
+    to the child with any start method (spawn on macOS and Windows).
+    Exceptions in function, a crash of the child, or a run longer than
+    timeout seconds are raised as RuntimeError.
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_child,
+                                      args=(queue, function, args))
+    process.start()
+    try:
+        elapsed, peak, result, error = _receive(queue, process, timeout)
+    finally:
+        process.join()
+    if error is not None:
+        raise RuntimeError(error)
+    return elapsed, peak, result
+
+
+def bench_import(repeat):
+    """ Time of import gillespy in a fresh interpreter. """
+    code = ('import timeit; t = timeit.default_timer(); import gillespy; '
+            'print(timeit.default_timer() - t)')
+    env = dict(os.environ, PYTHONPATH=os.path.join(HERE, '..'))
+    times = [float(subprocess.check_output([sys.executable, '-c', code],
+                                           env=env))
+             for _ in range(repeat)]
+    return {'best': min(times), 'mean': sum(times) / len(times)}
+
+
+def _run(model, solver, trajectories, seed):
+    """ The number of trajectories of a run of model with solver. """
+    return len(model.run(solver=solver, number_of_trajectories=trajectories,
+                         seed=seed, show_labels=False))
+
+
+def _count_events(model, solver, trajectories, seed):
+    """ The number of reaction events of a run recording event logs. """
+    return sum(len(log) for log in solver.run(
+        model, number_of_trajectories=trajectories, seed=seed,
+        tspan=model.tspan, record_events=True))
+
+
+def bench_solver(model, solver, trajectories, seed, timeout=None):
+    """ One run of model with solver. """
+    record = {'model': model.name, 'solver': solver.__name__,
+              'species': len(model.listOfSpecies),
+              'reactions': len(model.listOfReactions),
+              'trajectories': trajectories}
+    args = (model, solver, trajectories, seed)
+    try:
+        elapsed, peak, count = measure(_run, args, timeout)
+    except RuntimeError as e:
+        # Solvers that are not installed (StochKit), or runs that crash or
+        # time out, are reported, not fatal
+        record['skipped'] = str(e)
+        return record
+    record.update(wall_time=elapsed, peak_memory=peak,
+                  trajectories_per_second=count / elapsed)
+
+    if solver is gillespy.NumPySSASolver and not model.listOfEvents:
+        elapsed, _, events = measure(_count_events, args, timeout)
+        record.update(events=events, events_per_second=events / elapsed)
+    return record
+
+
+def bench_serialization(model, repeat):
+    """ Time to write the StochML document and to pickle the model. """
+    import pickle
+    document = model.serialize()
+    return {'model': model.name, 'stochml_bytes': len(document),
+            'stochml_time': min(timeit.repeat(model.serialize, number=1,
+                                              repeat=repeat)),
+            'pickle_time': min(timeit.repeat(lambda: pickle.dumps(model, -1),
+                                              number=1, repeat=repeat))}
+
+
+def bench_parsing(model, trajectories, seed, repeat):
+    """
+    Time for StochKitSolver.get_trajectories to parse StochKit output. The
+    output directory is written from a native run, so StochKit itself is
+    not needed.
+    """
+    results = model.run(solver=gillespy.NumPySSASolver, seed=seed,
+                        number_of_trajectories=trajectories,
+                        show_labels=False)
+    outdir = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(outdir, 'stats'))
+        os.mkdir(os.path.join(outdir, 'trajectories'))
+        header = ' '.join(['time'] + list(model.listOfSpecies))
+        size = 0
+        for i, trajectory in enumerate(results):
+            filename = os.path.join(outdir, 'trajectories',
+                                    'trajectory{0}.txt'.format(i))
+            numpy.savetxt(filename, trajectory, header=header, comments='',
+                          fmt='%g')
+            size += os.path.getsize(filename)
+        solver = gillespy.StochKitSolver()
+        elapsed = min(timeit.repeat(lambda: solver.get_trajectories(outdir),
+                                    number=1, repeat=repeat))
+    finally:
+        shutil.rmtree(outdir)
+    return {'model': model.name, 'trajectories': trajectories,
+            'bytes': size, 'parse_time': elapsed,
+            'bytes_per_second': size / elapsed}
+
+
+def compare(current, baseline, threshold, import_threshold=None):
+    """
+    Prints the solver runs that are more than threshold times slower, and
+    the import of gillespy if it is more than import_threshold (by default
+    threshold) times slower. Returns the number of regressions.
+    """
+    if import_threshold is None:
+        import_threshold = threshold
+    regressions = 0
+    if 'import' in current and 'import' in baseline:
+        ratio = current['import']['best'] / baseline['import']['best']
+        if ratio > import_threshold:
+            regressions += 1
+            print("import gillespy: {0:.2f}x slower".format(ratio))
+
+    def key(record):
+        return record['model'], record['solver'], record['trajectories']
+    before = dict((key(r), r) for r in baseline['solvers']
+                  if 'wall_time' in r)
+    for record in current['solvers']:
+        if 'wall_time' not in record or key(record) not in before:
+            continue
+        ratio = record['wall_time'] / before[key(record)]['wall_time']
+        if ratio > threshold:
+            regressions += 1
+            print("{0} {1}: {2:.2f}x slower".format(record['model'],
+                                                    record['solver'], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--output', help="JSON file to write (default: "
+                        "print to stdout)")
+    parser.add_argument('--trajectories', type=int, default=10)
+    parser.add_argument('--sizes', type=int, nargs='*', default=[10, 100],
+                        help="species counts of the synthetic networks")
+    parser.add_argument('--solvers', nargs='*', default=SOLVERS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=600.0,
+                        help="seconds after which a solver run is stopped "
+                        "and reported as skipped")
+    parser.add_argument('--compare', help="baseline JSON file; exits with "
+                        "status 1 if a run, or the import, is more than "
+                        "--threshold times slower")
+    parser.add_argument('--threshold', type=float, default=1.5)
+    parser.add_argument('--import-threshold', type=float, default=None,
+                        help="slowdown of import gillespy that is a "
+                        "regression (default: --threshold)")
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter('ignore')
+    models = example_models(args.sizes)
+    # Import the lazily loaded solver modules once, before any timing
+    for name in args.solvers:
+        try:
+            models[0].run(solver=getattr(gillespy, name), show_labels=False)
+        except Exception:
+            pass
+    report = {
+        'environment': {'python': platform.python_version(),
+                        'numpy': numpy.__version__,
+                        'platform': platform.platform(),
+                        'processor': platform.processor()},
+        'import': bench_import(args.repeat),
+        'solvers': [],
+        'serialization': [bench_serialization(m, args.repeat)
+                          for m in models],
+        'parsing': [bench_parsing(models[0], n, args.seed, args.repeat)
+                    for n in (10, 100)],
+    }
+    for model in models:
+        for name in args.solvers:
+            record = bench_solver(model, getattr(gillespy, name),
+                                  args.trajectories, args.seed,
+                                  args.timeout)
+            report['solvers'].append(record)
+            print("{model} {solver}: {0}".format(
+                record.get('skipped') or
+                "{0:.3f} s".format(record['wall_time']), **record),
+                file=sys.stderr)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold,
+                   args.import_threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
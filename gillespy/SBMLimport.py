@@ -2,10 +2,365 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import os
+import math
 from . import gillespy
 import numpy
-
-def convert(filename, modelName = None, gillespy_model=None):
+import hashlib
+import pickle
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+
+# Bump whenever the conversion changes, so that stale cached models are not
+# returned.
+CACHE_VERSION = 4
+
+
+class UntranslatableError(Exception):
+    pass
+
+
+class MathTranslator(object):
+    """
+    Translates libsbml MathML ASTs to gillespy expressions. The output uses
+    the C-compatible syntax of customized propensity functions (pow(),
+    exp(), ...), which the native solvers compile directly (see
+    gillespy.compiled). SBML time is written as 't'.
+
+    Attributes
+    ----------
+    libsbml : module
+        The libsbml module.
+    species : set of str
+        Ids of the model's species.
+    constants : set of str
+        Ids of parameters and compartments whose values do not change.
+    functions : dict
+        SBML function definitions, {id: lambda AST}. Calls to them are
+        inlined.
+    """
+
+    _binary = {}
+    _functions = {}
+    _relations = {}
+
+    def __init__(self, libsbml, species, constants, functions=None):
+        self.libsbml = libsbml
+        self.species = set(species)
+        self.constants = set(constants)
+        self.functions = functions or {}
+        # Arguments of the function definitions being inlined
+        self.bindings = [{}]
+        if not self._binary:
+            self._binary.update({
+                libsbml.AST_PLUS: (' + ', 1),
+                libsbml.AST_MINUS: (' - ', 1),
+                libsbml.AST_TIMES: ('*', 2),
+                libsbml.AST_DIVIDE: ('/', 2),
+                })
+            self._functions.update({
+                libsbml.AST_FUNCTION_EXP: 'exp',
+                libsbml.AST_FUNCTION_LN: 'log',
+                libsbml.AST_FUNCTION_ABS: 'fabs',
+                libsbml.AST_FUNCTION_FLOOR: 'floor',
+                libsbml.AST_FUNCTION_CEILING: 'ceil',
+                libsbml.AST_FUNCTION_SIN: 'sin',
+                libsbml.AST_FUNCTION_COS: 'cos',
+                libsbml.AST_FUNCTION_TAN: 'tan',
+                libsbml.AST_FUNCTION_ARCSIN: 'asin',
+                libsbml.AST_FUNCTION_ARCCOS: 'acos',
+                libsbml.AST_FUNCTION_ARCTAN: 'atan',
+                libsbml.AST_FUNCTION_SINH: 'sinh',
+                libsbml.AST_FUNCTION_COSH: 'cosh',
+                libsbml.AST_FUNCTION_TANH: 'tanh',
+                libsbml.AST_FUNCTION_MIN: 'min',
+                libsbml.AST_FUNCTION_MAX: 'max',
+                libsbml.AST_FUNCTION_PIECEWISE: 'piecewise',
+                })
+            self._relations.update({
+                libsbml.AST_RELATIONAL_EQ: ' == ',
+                libsbml.AST_RELATIONAL_NEQ: ' != ',
+                libsbml.AST_RELATIONAL_GT: ' > ',
+                libsbml.AST_RELATIONAL_GEQ: ' >= ',
+                libsbml.AST_RELATIONAL_LT: ' < ',
+                libsbml.AST_RELATIONAL_LEQ: ' <= ',
+                })
+
+    def expression(self, node):
+        """ Returns the expression for the AST node as a string. """
+        return self._translate(node)[0]
+
+    def _wrap(self, node, precedence):
+        text, p = self._translate(node)
+        return text if p >= precedence else '(' + text + ')'
+
+    def _translate(self, node):
+        """ Returns (text, precedence) for the AST node. """
+        libsbml = self.libsbml
+        ntype = node.getType()
+        children = [node.getChild(i) for i in range(node.getNumChildren())]
+
+        if ntype == libsbml.AST_INTEGER:
+            value = node.getInteger()
+            return (str(value), 4) if value >= 0 else (str(value), 3)
+        if ntype in (libsbml.AST_REAL, libsbml.AST_REAL_E,
+                     libsbml.AST_RATIONAL):
+            value = node.getReal()
+            return (repr(value), 4) if value >= 0 else (repr(value), 3)
+        if ntype == libsbml.AST_NAME:
+            if node.getName() in self.bindings[-1]:
+                return self.bindings[-1][node.getName()], 4
+            return node.getName(), 4
+        if ntype == libsbml.AST_NAME_TIME:
+            return 't', 4
+        if ntype == libsbml.AST_NAME_AVOGADRO:
+            return repr(6.02214179e23), 4
+        if ntype == libsbml.AST_CONSTANT_PI:
+            return repr(math.pi), 4
+        if ntype == libsbml.AST_CONSTANT_E:
+            return repr(math.e), 4
+        if ntype == libsbml.AST_CONSTANT_TRUE:
+            return '1', 4
+        if ntype == libsbml.AST_CONSTANT_FALSE:
+            return '0', 4
+
+        if ntype in self._binary:
+            op, p = self._binary[ntype]
+            if ntype == libsbml.AST_MINUS and len(children) == 1:
+                return '-' + self._wrap(children[0], 3), 3
+            if not children:
+                # Empty sum or product
+                return ('0' if ntype == libsbml.AST_PLUS else '1'), 4
+            # Left-associative: later operands of - and / bind tighter
+            parts = [self._wrap(children[0], p)]
+            strict = ntype in (libsbml.AST_MINUS, libsbml.AST_DIVIDE)
+            for child in children[1:]:
+                parts.append(self._wrap(child, p + 1 if strict else p))
+            return op.join(parts), p
+
+        if ntype in (libsbml.AST_POWER, libsbml.AST_FUNCTION_POWER):
+            return 'pow({0}, {1})'.format(*[self.expression(c)
+                                            for c in children]), 4
+        if ntype == libsbml.AST_FUNCTION_ROOT:
+            if len(children) == 1:
+                return 'sqrt({0})'.format(self.expression(children[0])), 4
+            return 'pow({1}, 1.0/{0})'.format(
+                self._wrap(children[0], 4), self.expression(children[1])), 4
+        if ntype == libsbml.AST_FUNCTION_LOG:
+            if len(children) == 1:
+                return 'log10({0})'.format(self.expression(children[0])), 4
+            base = self.expression(children[0])
+            if base in ('10', '10.0'):
+                return 'log10({0})'.format(self.expression(children[1])), 4
+            return 'log({0})/log({1})'.format(self.expression(children[1]),
+                                              base), 2
+        if ntype in self._functions:
+            return '{0}({1})'.format(self._functions[ntype], ', '.join(
+                self.expression(c) for c in children)), 4
+
+        if ntype in self._relations:
+            if len(children) != 2:
+                raise UntranslatableError("relation '{0}' with {1} "
+                    "arguments".format(node.getName(), len(children)))
+            return self._relations[ntype].join(
+                self._wrap(c, 1) for c in children), 0
+        # Logical operators are written with & and |, which work elementwise
+        # on arrays and also compile as C; operands are made 0/1 first
+        if ntype == libsbml.AST_LOGICAL_NOT:
+            return '({0} == 0)'.format(self._wrap(children[0], 4)), 4
+        if ntype in (libsbml.AST_LOGICAL_AND, libsbml.AST_LOGICAL_OR,
+                     libsbml.AST_LOGICAL_XOR):
+            op = {libsbml.AST_LOGICAL_AND: ' & ', libsbml.AST_LOGICAL_OR:
+                  ' | ', libsbml.AST_LOGICAL_XOR: ' ^ '}[ntype]
+            return '(' + op.join('({0} != 0)'.format(self._wrap(c, 4))
+                                 for c in children) + ')', 4
+
+        if ntype == libsbml.AST_FUNCTION and node.getName() in self.functions:
+            return self._inline(node.getName(), children), 4
+
+        raise UntranslatableError("unsupported MathML element '{0}'".format(
+            node.getName() or libsbml.formulaToString(node)))
+
+    def _inline(self, name, arguments):
+        """ Inlines a call of a function definition, in parentheses. """
+        definition = self.functions[name]
+        nargs = definition.getNumChildren() - 1
+        if nargs != len(arguments):
+            raise UntranslatableError("function '{0}' takes {1} arguments, "
+                                      "{2} given".format(name, nargs,
+                                                         len(arguments)))
+        if len(self.bindings) > len(self.functions) + 1:
+            raise UntranslatableError("recursive function definitions")
+        bindings = {}
+        for i, argument in enumerate(arguments):
+            bindings[definition.getChild(i).getName()] = \
+                '(' + self.expression(argument) + ')'
+        self.bindings.append(bindings)
+        try:
+            return '(' + self.expression(definition.getChild(nargs)) + ')'
+        finally:
+            self.bindings.pop()
+
+    def _factors(self, node):
+        """ Flattens a product into its factors. """
+        if node.getType() == self.libsbml.AST_TIMES:
+            factors = []
+            for i in range(node.getNumChildren()):
+                factors.extend(self._factors(node.getChild(i)))
+            return factors
+        return [node]
+
+    def _is_constant(self, node):
+        ntype = node.getType()
+        if ntype == self.libsbml.AST_NAME:
+            return node.getName() in self.constants
+        if ntype == self.libsbml.AST_NAME_TIME:
+            return False
+        return all(self._is_constant(node.getChild(i))
+                   for i in range(node.getNumChildren()))
+
+    def mass_action_rate(self, node, reactants):
+        """
+        If node is a mass-action rate law k*X*Y for the given reactants
+        ({species: stoichiometry}), returns the expression for the rate
+        constant k. Otherwise returns None.
+
+        Only laws that gillespy's mass-action propensities reproduce exactly
+        at unit volume are recognised: zeroth order, first order, and second
+        order in two different species.
+        """
+        libsbml = self.libsbml
+        if any(n != 1 for n in reactants.values()) or len(reactants) > 2:
+            return None
+        found = {}
+        constants = []
+        for factor in self._factors(node):
+            ntype = factor.getType()
+            if ntype == libsbml.AST_NAME and factor.getName() in self.species:
+                name = factor.getName()
+                found[name] = found.get(name, 0) + 1
+            elif self._is_constant(factor):
+                constants.append(factor)
+            else:
+                return None
+        if found != dict((s, 1) for s in reactants):
+            return None
+        if not constants:
+            return '1.0'
+        try:
+            return '*'.join(self._wrap(c, 2) for c in constants)
+        except UntranslatableError:
+            return None
+
+
+def _cache_format():
+    """
+    The layout of the pickled model classes (their names and __slots__),
+    part of the cache key, so that entries pickled by a gillespy with
+    other classes are not loaded.
+    """
+    classes = (gillespy.Model, gillespy.Species, gillespy.Parameter,
+               gillespy.Reaction, gillespy.Event, gillespy.AssignmentRule,
+               gillespy.RateRule)
+    return ';'.join('{0}{1}'.format(cls.__name__,
+                                    getattr(cls, '__slots__', ''))
+                    for cls in classes)
+
+
+def convert(filename, modelName = None, gillespy_model=None, cache_dir=None):
+    """
+    Converts an SBML file to a GillesPy model. Returns the model and a list
+    of [message, code] errors; a negative code means the conversion failed
+    or is incomplete.
+
+    The model is in population units if all species are given as amounts
+    (hasOnlySubstanceUnits, and no initial concentration), else in
+    concentration units, which only the ODE solvers simulate. Mass-action
+    kinetic laws become mass-action reactions, with the rate constant
+    scaled to the volume of gillespy_model if it is not 1.
+
+    If cache_dir is given, the converted model is stored there (pickled),
+    keyed on a hash of the SBML file content, and later conversions of the
+    same content are loaded from the cache instead of being re-parsed.
+    Caching is not used when adding to an existing gillespy_model.
+    """
+    if cache_dir is None or gillespy_model is not None:
+        return _convert(filename, modelName, gillespy_model)
+
+    with open(filename, 'rb') as f:
+        key = hashlib.sha256(f.read())
+    key.update('{0}:{1}:{2}'.format(CACHE_VERSION, _cache_format(),
+                                    modelName).encode('utf-8'))
+    cachefile = os.path.join(cache_dir, key.hexdigest() + '.pickle')
+
+    try:
+        with open(cachefile, 'rb') as f:
+            return pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, TypeError, ValueError):
+        # Missing, or stale: written by another version of gillespy
+        pass
+
+    result = _convert(filename, modelName, gillespy_model)
+
+    # Write to a temporary file and rename it, so that concurrent jobs never
+    # read a partially written cache entry. A conversion that succeeded is
+    # returned even if it can not be cached.
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            pass
+    try:
+        fd, tmpname = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    except OSError:
+        return result
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, cachefile)
+    except Exception:
+        os.remove(tmpname)
+    return result
+
+
+def _convert_one(args):
+    """ Worker for convert_batch. Failures are reported as errors. """
+    filename, cache_dir = args
+    try:
+        return convert(filename, cache_dir=cache_dir)
+    except Exception as e:
+        return None, [["Could not convert '{0}': {1}".format(filename, e), -10]]
+
+
+def convert_batch(filenames, processes=None, cache_dir=None):
+    """
+    Converts many SBML files in a pool of worker processes. Returns a list
+    of (model, errors) tuples in the order of filenames; a file that cannot
+    be converted gives (None, errors).
+
+    Attributes
+    ----------
+    filenames : list of str
+        Paths to the SBML files.
+    processes : int
+        Number of worker processes. Defaults to the number of CPUs.
+    cache_dir : str
+        Optional conversion cache directory, see convert.
+    """
+    jobs = [(filename, cache_dir) for filename in filenames]
+    if processes == 1 or len(jobs) <= 1:
+        return [_convert_one(job) for job in jobs]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_convert_one, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _convert(filename, modelName = None, gillespy_model=None):
     try: 
         import libsbml
     except ImportError:
@@ -37,7 +392,10 @@ def convert(filename, modelName = None, gillespy_model=None):
     if gillespy_model==None:
         gillespy_model = gillespy.Model(name = modelName)
 
-    gillespy_model.units = "concentration"
+    # Species given as amounts are populations, which the stochastic
+    # solvers simulate; a single species in concentration makes the model
+    # a concentration model
+    amounts = True
 
     for i in range(model.getNumSpecies()):
         species = model.getSpecies(i)
@@ -48,6 +406,9 @@ def convert(filename, modelName = None, gillespy_model=None):
 
         name = species.getId()
 
+        if species.isSetInitialConcentration() or not species.getHasOnlySubstanceUnits():
+            amounts = False
+
         if species.isSetInitialAmount():
             value = species.getInitialAmount()
         elif species.isSetInitialConcentration():
@@ -55,7 +416,10 @@ def convert(filename, modelName = None, gillespy_model=None):
         else:
             rule = model.getRule(species.getId())
 
-            if rule:
+            if rule and rule.isAssignment():
+                # The value is computed from the rule during simulation
+                pass
+            elif rule:
                 msg = ""
 
                 if rule.isAssignment():
@@ -67,7 +431,7 @@ def convert(filename, modelName = None, gillespy_model=None):
 
                 msg += "rule"
 
-                errors.append(["Species '{0}' does not have any initial conditions. Associated {1} '{2}' found, but {1}s are not supported in gillespy. Assuming initial condition 0".format(species.getId(), msg, rule.getId()), 0])
+                errors.append(["Species '{0}' does not have any initial conditions. Associated {1} '{2}' found, but {1}s do not define initial conditions in gillespy. Assuming initial condition 0".format(species.getId(), msg, rule.getId()), 0])
             else:
                 errors.append(["Species '{0}' does not have any initial conditions or rules. Assuming initial condition 0".format(species.getId()), 0])
 
@@ -80,6 +444,8 @@ def convert(filename, modelName = None, gillespy_model=None):
         gillespySpecies = gillespy.Species(name = name, initial_value = value)
         gillespy_model.add_species([gillespySpecies])
 
+    gillespy_model.units = "population" if amounts else "concentration"
+
     for i in range(model.getNumParameters()):
         parameter=model.getParameter(i)
         name=parameter.getId()
@@ -108,6 +474,17 @@ def convert(filename, modelName = None, gillespy_model=None):
             gillespyParameter = gillespy.Parameter(name = name, expression = value)
             gillespy_model.add_parameter([gillespyParameter])
 
+    constants = [model.getParameter(i).getId() for i in range(model.getNumParameters()) if model.getParameter(i).getConstant()]
+    constants += [model.getCompartment(i).getId() for i in range(model.getNumCompartments()) if model.getCompartment(i).getConstant()]
+    for i in range(model.getNumReactions()):
+        kineticLaw = model.getReaction(i).getKineticLaw()
+        constants += [kineticLaw.getParameter(j).getId() for j in range(kineticLaw.getNumParameters())]
+    functions = {}
+    for i in range(model.getNumFunctionDefinitions()):
+        function = model.getFunctionDefinition(i)
+        functions[function.getId()] = function.getMath()
+    translator = MathTranslator(libsbml, gillespy_model.listOfSpecies, constants, functions)
+
     #reactions
     for i in range(model.getNumReactions()):
         reaction = model.getReaction(i)
@@ -135,37 +512,59 @@ def convert(filename, modelName = None, gillespy_model=None):
 
         #propensity
         kineticLaw = reaction.getKineticLaw()
-        propensity = kineticLaw.getFormula()
-
-        gillespyReaction = gillespy.Reaction(name = name, reactants = reactants, products = products, propensity_function = propensity)
+        law = kineticLaw.getMath()
+
+        # Mass-action laws become native mass-action reactions. gillespy's
+        # mass-action propensities carry a factor vol^(1 - order), which
+        # the rate constant makes up for
+        rate = translator.mass_action_rate(law, reactants)
+        if rate is not None and gillespy_model.volume != 1.0:
+            rate = '({0})*{1!r}'.format(rate, float(gillespy_model.volume) ** (len(reactants) - 1))
+
+        if rate is not None:
+            if rate in gillespy_model.listOfParameters:
+                rateParameter = gillespy_model.listOfParameters[rate]
+            else:
+                rateName = name + '_rate'
+                while rateName in gillespy_model.listOfParameters:
+                    rateName += '_'
+                rateParameter = gillespy.Parameter(name = rateName, expression = rate)
+                gillespy_model.add_parameter([rateParameter])
+            gillespyReaction = gillespy.Reaction(name = name, reactants = reactants, products = products, rate = rateParameter)
+        else:
+            try:
+                propensity = translator.expression(law)
+            except UntranslatableError as e:
+                propensity = kineticLaw.getFormula()
+                errors.append(["Kinetic law of reaction '{0}' on line {1} could not be translated ({2}). Using the formula '{3}' as given, which the native solvers can not evaluate".format(name, reaction.getLine(), e, propensity), -5])
+            gillespyReaction = gillespy.Reaction(name = name, reactants = reactants, products = products, propensity_function = propensity)
 
         gillespy_model.add_reaction([gillespyReaction])
 
     for i in range(model.getNumRules()):
         rule = model.getRule(i)
 
-        t = []
+        if rule.isAssignment() or rule.isRate():
+            variable = rule.getVariable()
+            kind = "Assignment" if rule.isAssignment() else "Rate"
 
-        if rule.isCompartmentVolume():
-            t.append('compartment')
-        if rule.isParameter():
-            t.append('parameter')
-        elif rule.isAssignment():
-            t.append('assignment')
-        elif rule.isRate():
-            t.append('rate')
-        elif rule.isAlgebraic():
-            t.append('algebraic')
+            if variable not in gillespy_model.listOfSpecies and variable not in gillespy_model.listOfParameters:
+                errors.append(["{0} rule on line '{1}' assigns unknown variable '{2}'".format(kind, rule.getLine(), variable), -5])
+                continue
 
-        if len(t) > 0:
-            t[0] = t[0].capitalize()
+            try:
+                expression = translator.expression(rule.getMath())
+            except UntranslatableError as e:
+                errors.append(["{0} rule for '{1}' on line '{2}' with equation '{3}' could not be translated ({4})".format(kind, variable, rule.getLine(), libsbml.formulaToString(rule.getMath()), e), -5])
+                continue
 
-            msg = ", ".join(t)
-            msg += " rule"
-        else:
-            msg = "Rule"
+            if rule.isAssignment():
+                gillespy_model.add_rule(gillespy.AssignmentRule(variable, expression))
+            else:
+                gillespy_model.add_rule(gillespy.RateRule(variable, expression))
+            continue
 
-        errors.append(["{0} '{1}' found on line '{2}' with equation '{3}'. gillespy does not support SBML Rules".format(msg, rule.getId(), rule.getLine(), libsbml.formulaToString(rule.getMath())), -5])
+        errors.append(["Algebraic rule '{0}' found on line '{1}' with equation '{2}'. gillespy does not support SBML Algebraic Rules".format(rule.getId(), rule.getLine(), libsbml.formulaToString(rule.getMath())), -5])
 
     for i in range(model.getNumCompartments()):
         compartment = model.getCompartment(i)
@@ -179,13 +578,31 @@ def convert(filename, modelName = None, gillespy_model=None):
 
     for i in range(model.getNumEvents()):
         event = model.getEvent(i)
+        name = event.getId() or "event{0}".format(i)
+        trigger = event.getTrigger()
 
-        errors.append(["Event '{0}' found on line '{1}' with trigger equation '{2}'. gillespy does not support SBML Events".format(event.getId(), event.getLine(), libsbml.formulaToString(event.getTrigger().getMath())), -5])
+        if event.isSetDelay():
+            errors.append(["Event '{0}' found on line '{1}' has a delay. gillespy does not support delayed SBML Events".format(name, event.getLine()), -5])
+            continue
 
-    for i in range(model.getNumFunctionDefinitions()):
-        function = model.getFunctionDefinition(i)
+        if event.isSetPriority():
+            errors.append(["Event '{0}' found on line '{1}' has a priority. Priorities are ignored, simultaneous events are executed in document order".format(name, event.getLine()), 0])
+
+        try:
+            condition = translator.expression(trigger.getMath())
+            assignments = OrderedDict()
+            for j in range(event.getNumEventAssignments()):
+                assignment = event.getEventAssignment(j)
+                assignments[assignment.getVariable()] = translator.expression(assignment.getMath())
+        except UntranslatableError as e:
+            errors.append(["Event '{0}' found on line '{1}' with trigger equation '{2}' could not be translated ({3})".format(name, event.getLine(), libsbml.formulaToString(trigger.getMath()), e), -5])
+            continue
+
+        # Before SBML Level 3 triggers had no initial value and events
+        # could not fire at time 0
+        initial_value = trigger.getInitialValue() if trigger.isSetInitialValue() else True
 
-        errors.append(["Function '{0}' found on line '{1}' with equation '{2}'. gillespy does not support SBML Function Definitions".format(function.getId(), function.getLine(), libsbml.formulaToString(function.getMath())), -5])
+        gillespy_model.add_event(gillespy.Event(name = name, trigger = condition, assignments = assignments, initial_value = initial_value))
 
     return gillespy_model, errors
 
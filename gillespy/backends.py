@@ -0,0 +1,379 @@
+"""
+Registry of the simulation backends: the StochKit executables and the
+native in-process engines.
+
+StochKit executables are looked up once per process, in stochkit_home,
+STOCHKIT_HOME and PATH, and their command line options are probed once
+from their --help output, so runs do not scan the file system again. The
+registry knows which models each backend can simulate, and
+select_backend() picks the preferred one that is available for a model.
+
+choose_backend() picks the simulation method itself (solver='auto' in
+Model.run), from an analysis of the model: exact SSA while it is cheap,
+the reaction rate equations when the populations are large enough for
+them to be accurate or the model is stiff, and tau-leaping for large
+populations of models that are not stiff.
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import subprocess
+from collections import OrderedDict
+
+import numpy
+
+from .gillespy import (SimulationError, StochKitSolver, StochKitODESolver,
+                       NumPySSASolver, SciPyODESolver, MomentSolver)
+
+_executables = {}
+_options = {}
+
+
+def find_executable(name, stochkit_home=None):
+    """
+    The path of the StochKit executable name: in stochkit_home if given,
+    else in STOCHKIT_HOME or on the PATH. None if it is not found. The
+    result is cached for the current STOCHKIT_HOME and PATH.
+    """
+    if stochkit_home is not None:
+        directories = [stochkit_home]
+    else:
+        directories = [os.environ.get('STOCHKIT_HOME')]
+        directories += os.environ.get('PATH', '').split(os.pathsep)
+    key = (name,) + tuple(directories)
+    path = _executables.get(key)
+    # A cached executable costs one stat to check, a miss nothing
+    if path is not None and os.path.isfile(path):
+        return path
+    if path is None and key in _executables:
+        return None
+    path = None
+    for directory in directories:
+        if directory and os.path.isfile(os.path.join(directory, name)):
+            path = os.path.join(directory, name)
+            break
+    _executables[key] = path
+    return path
+
+
+def executable_options(path):
+    """
+    The command line options (such as '--method', new in StochKit 2.1)
+    listed in the --help output of the executable at path, a set. The
+    result is cached until the executable changes.
+    """
+    key = (path, os.path.getmtime(path))
+    if key not in _options:
+        try:
+            result = subprocess.run([path, '--help'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, timeout=30)
+            text = result.stdout.decode('utf-8', 'replace')
+        except (OSError, subprocess.TimeoutExpired):
+            text = ''
+        _options[key] = frozenset(re.findall(r'(?<![\w-])--[\w-]+', text))
+    return _options[key]
+
+
+def clear_cache():
+    """ Forgets the executables found and their options. """
+    _executables.clear()
+    _options.clear()
+
+
+class Backend(object):
+    """
+    A simulation engine: a solver class, and for StochKit the executable
+    it runs.
+
+    Attributes
+    ----------
+    name : str
+        Name of the backend in the registry.
+    solver : gillespy.GillesPySolver
+        The solver class.
+    algorithm : str
+        The algorithm passed to solver.run: the StochKit executable, or
+        None for the native solvers.
+    stochastic : bool
+        Whether the backend samples trajectories (or else computes a
+        deterministic solution or moments).
+    exact : bool
+        Whether the trajectories are exact samples of the chemical master
+        equation (SSA) rather than approximate (tau-leaping).
+    events : bool
+        Whether models with events and rules are supported.
+    concentration : bool
+        Whether models in concentration units are supported.
+    uniform_tspan : bool
+        Whether the output times must be evenly spaced.
+    """
+
+    def __init__(self, name, solver, algorithm=None, stochastic=True,
+                 exact=True, events=True, concentration=False,
+                 uniform_tspan=False):
+        self.name = name
+        self.solver = solver
+        self.algorithm = algorithm
+        self.stochastic = stochastic
+        self.exact = exact
+        self.events = events
+        self.concentration = concentration
+        self.uniform_tspan = uniform_tspan
+
+    @property
+    def external(self):
+        """ Whether the backend runs an executable. """
+        return self.algorithm is not None
+
+    def executable(self, stochkit_home=None):
+        """ Path of the executable, or None if it is not installed. """
+        if not self.external:
+            return None
+        return find_executable(self.algorithm, stochkit_home)
+
+    def available(self, stochkit_home=None):
+        return not self.external or \
+            self.executable(stochkit_home) is not None
+
+    def options(self, stochkit_home=None):
+        """
+        Command line options the executable supports, see
+        executable_options. Empty for native backends.
+        """
+        path = self.executable(stochkit_home)
+        if path is None:
+            return frozenset()
+        return executable_options(path)
+
+    def unsupported(self, model):
+        """ Why the backend can not simulate model, or None if it can. """
+        if not self.events and (model.listOfEvents or
+                                model.listOfAssignmentRules or
+                                model.listOfRateRules):
+            return "{0} does not support events or rules".format(self.name)
+        if not self.concentration and model.units == "concentration":
+            return "{0} only simulates population models".format(self.name)
+        if self.uniform_tspan and not _uniform(model.tspan):
+            return "{0} requires evenly spaced output times".format(self.name)
+        return None
+
+    def run(self, model, **kwargs):
+        """
+        Runs model with the solver, recording the backend name in
+        results.metadata['backend'].
+        """
+        if self.algorithm is not None:
+            kwargs['algorithm'] = self.algorithm
+        results = self.solver.run(model, **kwargs)
+        results.metadata['backend'] = self.name
+        return results
+
+    def __repr__(self):
+        return "Backend({0!r})".format(self.name)
+
+
+def _uniform(tspan):
+    """ Whether the times in tspan are evenly spaced, as StochKit needs. """
+    return len(set(numpy.round(numpy.diff(tspan), 10))) <= 1
+
+
+BACKENDS = OrderedDict()
+
+
+def register(backend):
+    """
+    Adds a backend to the registry. Backends registered first are
+    preferred by select_backend.
+    """
+    BACKENDS[backend.name] = backend
+    return backend
+
+
+def get_backend(name):
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise SimulationError("Unknown backend '{0}', registered backends: "
+                              "{1}".format(name, ', '.join(BACKENDS)))
+
+
+def available_backends(stochkit_home=None):
+    """ The registered backends that can run here, in order of preference. """
+    return [b for b in BACKENDS.values() if b.available(stochkit_home)]
+
+
+def select_backend(model, stochastic=True, exact=True, stochkit_home=None,
+                   external=True, timeouts=False):
+    """
+    The preferred available backend that can simulate model: stochastic
+    (and exact) or deterministic, only a native one unless external, and
+    only one that enforces a timeout if timeouts. The compiled StochKit
+    engines are preferred for stochastic runs, the native engines run
+    anything else.
+    """
+    reasons = []
+    for backend in BACKENDS.values():
+        if backend.stochastic != stochastic or \
+                (stochastic and exact and not backend.exact) or \
+                (backend.external and not external):
+            continue
+        if timeouts and not getattr(backend.solver, 'timeouts', False):
+            reasons.append("{0} does not take a timeout".format(
+                backend.name))
+            continue
+        if not backend.available(stochkit_home):
+            reasons.append("{0} is not installed".format(backend.name))
+            continue
+        reason = backend.unsupported(model)
+        if reason is None:
+            return backend
+        reasons.append(reason)
+    raise SimulationError("No backend can simulate the model: " +
+                          "; ".join(reasons))
+
+
+# Thresholds of choose_backend: reaction events per trajectory below which
+# exact SSA is cheap enough, the smallest reactant population at which the
+# reaction rate equations (relative noise ~1%) or tau-leaping (many
+# firings per leap) are accurate, and the spread of reaction time scales
+# above which a model is stiff: tau-leaping then takes leaps bounded by the
+# fastest reactions, no cheaper than exact SSA.
+SSA_EVENTS = 1e5
+ODE_POPULATION = 1e4
+TAU_POPULATION = 100
+STIFF_SPREAD = 1e3
+
+
+def analyze_model(model, t=None):
+    """
+    Population scale and reaction time scales of model over [0, t], from
+    its reaction rate equations solved on a coarse grid. Returns a dict:
+    events (expected reaction events per trajectory), min_population and
+    max_population (typical populations of the species that are reactants)
+    and timescale_spread (ratio of the fastest to the slowest typical
+    reaction rate).
+    """
+    from .compiled import compile_model
+    from .native import ode
+    compiled = compile_model(model)
+    if t is None:
+        t = model.tspan[-1]
+    tspan = numpy.linspace(0, t, 21)
+    try:
+        states = ode(compiled, tspan, rtol=1e-3, atol=1e-6)[0]
+    except SimulationError:
+        # Fall back to the initial state, e.g. for models that blow up
+        states = compiled.initial_values[None, :]
+        tspan = tspan[:1]
+    a = compiled.propensities(states, tspan)
+    if len(tspan) > 1:
+        # numpy.trapz is deprecated in NumPy 2, trapezoid new in it
+        trapezoid = getattr(numpy, 'trapezoid', None) or numpy.trapz
+        events = trapezoid(a.sum(axis=1), tspan)
+    else:
+        events = a.sum() * t
+    ns = len(compiled.species_names)
+    reactants = compiled.reactants.any(axis=0)
+    populations = numpy.median(states[:, :ns], axis=0)[reactants]
+    rates = numpy.median(a, axis=0)
+    rates = rates[rates > 0]
+    return {'events': float(events),
+            'min_population': float(populations.min()) if len(populations)
+            else numpy.inf,
+            'max_population': float(populations.max()) if len(populations)
+            else numpy.inf,
+            'timescale_spread': float(rates.max() / rates.min())
+            if len(rates) else 1.0}
+
+
+def choose_backend(model, stochastic_only=False, stochkit_home=None,
+                   external=True, timeouts=False):
+    """
+    Picks the simulation method for model, 'ssa', 'tau_leaping' or 'ode',
+    and the backend to run it (see analyze_model and the thresholds
+    above):
+
+    - exact SSA while the expected number of reaction events is small;
+    - the reaction rate equations if all reactant populations are large,
+      or if the model is stiff and the largest populations are, so that
+      exact SSA would spend its time on the fast reactions among them;
+    - tau-leaping if the model is not stiff and all reactant populations
+      are large enough for it;
+    - else exact SSA.
+
+    Only stochastic methods if stochastic_only; only native backends
+    unless external; only backends that enforce a timeout if timeouts.
+    Tau-leaping needs the StochKit executable, else exact SSA is used.
+
+    Returns the backend and a dict recording the decision: method,
+    backend, reason and the analysis.
+    """
+    if model.units == "concentration":
+        if stochastic_only:
+            raise SimulationError("Concentration models can not be "
+                                  "simulated stochastically")
+        analysis = {}
+        method, reason = 'ode', "the model is in concentration units"
+    else:
+        analysis = analyze_model(model)
+        events, low = analysis['events'], analysis['min_population']
+        high, spread = analysis['max_population'], \
+            analysis['timescale_spread']
+        stiff = spread >= STIFF_SPREAD
+        if events <= SSA_EVENTS:
+            method, reason = 'ssa', ("about {0:.3g} reaction events per "
+                "trajectory, exact SSA is cheap".format(events))
+        elif low >= ODE_POPULATION and not stochastic_only:
+            method, reason = 'ode', ("about {0:.3g} events per trajectory "
+                "and all reactant populations above {1:.3g}, noise is "
+                "negligible".format(events, low))
+        elif stiff and high >= ODE_POPULATION and not stochastic_only:
+            method, reason = 'ode', ("about {0:.3g} events per trajectory, "
+                "reaction time scales spanning a factor {1:.3g} and reactant "
+                "populations up to {2:.3g}, the model is stiff".format(
+                    events, spread, high))
+        elif low >= TAU_POPULATION and not stiff:
+            method, reason = 'tau_leaping', ("about {0:.3g} events per "
+                "trajectory, all reactant populations above {1:.3g} and "
+                "reaction time scales within a factor {2:.3g}".format(
+                    events, low, spread))
+        elif stiff:
+            method, reason = 'ssa', ("about {0:.3g} events per trajectory "
+                "and reaction time scales spanning a factor {1:.3g}, too "
+                "stiff for tau-leaping".format(events, spread))
+        else:
+            method, reason = 'ssa', ("about {0:.3g} events per trajectory "
+                "and reactant populations down to {1:.3g}, too small for "
+                "tau-leaping".format(events, low))
+
+    backend = None
+    if method == 'ode':
+        backend = select_backend(model, stochastic=False,
+                                 stochkit_home=stochkit_home,
+                                 external=external, timeouts=timeouts)
+    elif method == 'tau_leaping':
+        tau = BACKENDS['stochkit_tau_leaping']
+        if external and tau.available(stochkit_home) and \
+                tau.unsupported(model) is None:
+            backend = tau
+        else:
+            reason += "; no tau-leaping backend can run it, using exact SSA"
+    if backend is None:
+        backend = select_backend(model, stochkit_home=stochkit_home,
+                                 external=external, timeouts=timeouts)
+    return backend, {'method': method, 'backend': backend.name,
+                     'reason': reason, 'analysis': analysis}
+
+
+register(Backend('stochkit_ssa', StochKitSolver, 'ssa', events=False,
+                 uniform_tspan=True))
+register(Backend('stochkit_tau_leaping', StochKitSolver, 'tau_leaping',
+                 exact=False, events=False, uniform_tspan=True))
+register(Backend('numpy_ssa', NumPySSASolver))
+register(Backend('scipy_ode', SciPyODESolver, stochastic=False,
+                 concentration=True))
+register(Backend('stochkit_ode', StochKitODESolver, 'stochkit_ode.py',
+                 stochastic=False, events=False, concentration=True,
+                 uniform_tspan=True))
+register(Backend('moments', MomentSolver, stochastic=False, events=False))
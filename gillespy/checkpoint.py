@@ -0,0 +1,190 @@
+"""
+Checkpoints of native SSA runs: the state, time and random stream position
+of every trajectory, and the output recorded so far, saved to a compact
+binary (.npz) file. A run resumed from a checkpoint continues exactly where
+it left off, and the end state of a run can be the initial state of another.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import os
+import tempfile
+import timeit
+
+import numpy
+
+from .gillespy import SimulationError
+
+FORMAT_VERSION = 1
+
+
+class Checkpoint(object):
+    """
+    The state of an ensemble run of NumPySSASolver.
+
+    Attributes
+    ----------
+    state_names : list of str
+        The columns of the state: the species, then any parameters changed
+        by events or rate rules.
+    tspan : numpy ndarray
+        The output times of the run.
+    seed : int
+        The root seed of the random streams.
+    trajectories : list of int
+        The numbers of the trajectories (their random streams).
+    X : numpy ndarray
+        Current state of each trajectory, shape (trajectories, state).
+    t : numpy ndarray
+        Current time of each trajectory.
+    k : numpy ndarray
+        Next output point of each trajectory.
+    out : numpy ndarray
+        State at the output times, shape (trajectories, times, state); only
+        the first k[i] points of trajectory i are filled.
+    previous : numpy ndarray
+        Event trigger values of each trajectory, or None.
+    end : int
+        End of the chunk of output points being simulated.
+    refills, position : numpy ndarray
+        Position of the random stream of each trajectory, see
+        RandomStreams.get_state.
+    """
+
+    def __init__(self, state_names, tspan, seed, trajectories, X, t, k, out,
+                 previous, end, refills, position):
+        self.state_names = list(state_names)
+        self.tspan = tspan
+        self.seed = seed
+        self.trajectories = list(trajectories)
+        self.X = X
+        self.t = t
+        self.k = k
+        self.out = out
+        self.previous = previous
+        self.end = end
+        self.refills = refills
+        self.position = position
+
+    @property
+    def complete(self):
+        """ Whether every trajectory has reached the end of tspan. """
+        return bool(numpy.all(self.k == len(self.tspan)))
+
+    def end_state(self):
+        """
+        The state of each trajectory at its last output time reached, shape
+        (trajectories, state), to start another run from.
+        """
+        rows = numpy.arange(len(self.k))
+        return self.out[rows, numpy.maximum(self.k - 1, 0)]
+
+    def save(self, filename):
+        """
+        Writes the checkpoint to filename. The file is replaced atomically,
+        so a run pre-empted while saving leaves the previous checkpoint.
+        """
+        arrays = dict(version=FORMAT_VERSION,
+                      state_names=numpy.array(self.state_names),
+                      tspan=self.tspan, seed=str(self.seed),
+                      trajectories=numpy.array(self.trajectories,
+                                               dtype=numpy.int64),
+                      X=self.X, t=self.t, k=self.k, out=self.out,
+                      end=self.end, refills=self.refills,
+                      position=self.position)
+        if self.previous is not None:
+            arrays['previous'] = self.previous
+        directory = os.path.dirname(os.path.abspath(filename))
+        handle, path = tempfile.mkstemp(dir=directory, suffix='.npz')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                numpy.savez(f, **arrays)
+            os.replace(path, filename)
+        except Exception:
+            os.remove(path)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        """ Reads a checkpoint written by save. """
+        with numpy.load(filename) as data:
+            if int(data['version']) != FORMAT_VERSION:
+                raise SimulationError("Checkpoint '{0}' has an unsupported "
+                                      "format".format(filename))
+            previous = data['previous'] if 'previous' in data else None
+            return cls(data['state_names'].tolist(), data['tspan'],
+                       int(str(data['seed'])), data['trajectories'].tolist(),
+                       data['X'], data['t'], data['k'], data['out'],
+                       previous, int(data['end']), data['refills'],
+                       data['position'])
+
+
+class Checkpointer(object):
+    """
+    Saves a checkpoint of a running ensemble at most every interval
+    seconds. Called once per step of the simulation loop, like a
+    ProgressMonitor; snapshot() returns the Checkpoint to save.
+    """
+
+    def __init__(self, filename, interval, snapshot=None):
+        self.filename = filename
+        self.interval = interval
+        self.snapshot = snapshot
+        self._steps = 0
+        self._last = timeit.default_timer()
+
+    def __call__(self, events):
+        self._steps += 1
+        if self._steps % 16:
+            return True
+        now = timeit.default_timer()
+        if now - self._last >= self.interval:
+            self.save()
+            self._last = now
+        return True
+
+    def save(self):
+        self.snapshot().save(self.filename)
+
+
+def initial_states(initial_state, compiled, number_of_trajectories=None):
+    """
+    The initial state of each trajectory, shape (trajectories, state), from
+    a warm start: a Checkpoint (its end states), results of a native run
+    (the state at their last output time) or an array of species
+    populations, for one or for every trajectory. Without
+    number_of_trajectories the states are returned as given.
+    """
+    if isinstance(initial_state, str):
+        initial_state = Checkpoint.load(initial_state)
+    if isinstance(initial_state, Checkpoint):
+        if initial_state.state_names != compiled.state_names:
+            raise SimulationError("The checkpoint is of a different model")
+        states = initial_state.end_state()
+    else:
+        ns = len(compiled.species_names)
+        if isinstance(initial_state, list) and initial_state and \
+                isinstance(initial_state[0], dict):
+            species = numpy.array([[r[name][-1] for name in
+                                    compiled.species_names]
+                                   for r in initial_state])
+        elif isinstance(initial_state, list) and initial_state and \
+                numpy.ndim(initial_state[0]) == 2:
+            species = numpy.array([r[-1, 1:] for r in initial_state])
+        else:
+            species = numpy.atleast_2d(numpy.asarray(initial_state,
+                                                     dtype=float))
+        if species.shape[1] != ns:
+            raise SimulationError("The initial state must have one value per "
+                                  "species")
+        states = numpy.tile(compiled.initial_values, (len(species), 1))
+        states[:, :ns] = species
+    if number_of_trajectories is None:
+        return states
+    if len(states) == 1:
+        states = numpy.repeat(states, number_of_trajectories, axis=0)
+    if len(states) != number_of_trajectories:
+        raise SimulationError("The initial state has {0} trajectories, the "
+                              "run {1}".format(len(states),
+                                               number_of_trajectories))
+    return states
@@ -0,0 +1,633 @@
+"""
+Compiled, array-based form of a gillespy Model, used by the native
+(in-process) solvers.
+
+Mass-action reactions are reduced to rate constants and reactant index
+arrays, and customized propensity functions are compiled once to Python
+code objects that are evaluated with NumPy over a whole ensemble of
+states. No C code is generated or compiled.
+
+A compiled model can be frozen (Model.freeze) into an immutable snapshot
+that many threads can simulate at the same time, and that can be pickled
+to other processes.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+from collections import OrderedDict
+from types import MappingProxyType
+import ast
+import numpy
+
+from .gillespy import ModelError, ReactionError, _TableDict
+
+
+def _piecewise(*args):
+    """ piecewise(value1, condition1, ..., [otherwise]) as in SBML. """
+    otherwise = args[-1] if len(args) % 2 else 0.0
+    result = otherwise
+    for i in range(len(args) - 2 - len(args) % 2, -1, -2):
+        result = numpy.where(args[i+1], args[i], result)
+    return result
+
+
+# Functions that may be called in propensity functions and other compiled
+# expressions. The names follow C (math.h), so the same expression is valid
+# for StochKit's customized propensities.
+FUNCTIONS = {
+    'pow': numpy.power,
+    'exp': numpy.exp,
+    'log': numpy.log,
+    'log10': numpy.log10,
+    'sqrt': numpy.sqrt,
+    'sin': numpy.sin,
+    'cos': numpy.cos,
+    'tan': numpy.tan,
+    'asin': numpy.arcsin,
+    'acos': numpy.arccos,
+    'atan': numpy.arctan,
+    'sinh': numpy.sinh,
+    'cosh': numpy.cosh,
+    'tanh': numpy.tanh,
+    'fabs': numpy.abs,
+    'abs': numpy.abs,
+    'floor': numpy.floor,
+    'ceil': numpy.ceil,
+    'min': numpy.minimum,
+    'max': numpy.maximum,
+    'where': numpy.where,
+    'logical_and': numpy.logical_and,
+    'logical_or': numpy.logical_or,
+    'logical_not': numpy.logical_not,
+    'piecewise': _piecewise,
+}
+
+_ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare,
+                  ast.Call, ast.Name, ast.Load, ast.IfExp, ast.BoolOp,
+                  ast.operator, ast.unaryop, ast.cmpop, ast.boolop)
+if hasattr(ast, 'Constant'):
+    _ALLOWED_NODES += (ast.Constant,)
+if hasattr(ast, 'Num'):
+    _ALLOWED_NODES += (ast.Num,)
+
+
+class _Vectorize(ast.NodeTransformer):
+    """
+    Rewrites the parts of an expression that do not work elementwise on
+    arrays: conditional expressions, and/or/not and chained comparisons.
+    """
+
+    @staticmethod
+    def _call(name, args):
+        return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args,
+                        keywords=[])
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return self._call('where', [node.test, node.body, node.orelse])
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        name = 'logical_and' if isinstance(node.op, ast.And) else 'logical_or'
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = self._call(name, [result, value])
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return self._call('logical_not', [node.operand])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        terms = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            terms.append(ast.Compare(left=left, ops=[op], comparators=[right]))
+            left = right
+        result = terms[0]
+        for term in terms[1:]:
+            result = self._call('logical_and', [result, term])
+        return result
+
+
+class _Inline(ast.NodeTransformer):
+    """ Substitutes assignment rule variables by their expressions. """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.stack = []
+
+    def visit_Name(self, node):
+        if node.id not in self.rules:
+            return node
+        if node.id in self.stack:
+            raise ModelError("Assignment rules for {0} depend on each "
+                             "other".format(', '.join(self.stack)))
+        self.stack.append(node.id)
+        try:
+            body = ast.parse(self.rules[node.id], mode='eval').body
+        except SyntaxError as e:
+            raise ModelError("Could not parse assignment rule for '{0}': "
+                             "{1}".format(node.id, e))
+        body = self.visit(body)
+        self.stack.pop()
+        return body
+
+
+_code_cache = {}
+
+
+def parse_expression(expression, rules=None):
+    """
+    Parses a model expression to a syntax tree that evaluates elementwise
+    over NumPy arrays. Returns the tree (an ast expression node) and the
+    set of names the expression refers to.
+
+    Only arithmetic, comparisons, conditionals and the functions in
+    FUNCTIONS are allowed. If rules ({variable: expression}) is given,
+    those assignment rules are substituted into the expression.
+    """
+    expression = str(expression).strip()
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ReactionError("Could not parse expression '{0}': {1}".format(
+                            expression, e))
+    if rules:
+        tree = _Inline(rules).visit(tree)
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ReactionError("Unsupported construct '{0}' in expression "
+                    "'{1}'".format(type(node).__name__, expression))
+        if isinstance(node, ast.Call) and (
+                not isinstance(node.func, ast.Name) or
+                node.func.id not in FUNCTIONS or node.keywords):
+            raise ReactionError("Unsupported function call in expression "
+                                "'{0}'".format(expression))
+    tree = _Vectorize().visit(tree)
+    names = set(node.id for node in ast.walk(tree)
+                if isinstance(node, ast.Name)) - set(FUNCTIONS)
+    return tree.body, names
+
+
+def compile_expression(expression, rules=None):
+    """
+    Compiles a propensity function (or other model expression) to a code
+    object that evaluates elementwise over NumPy arrays. Returns the code
+    object and the set of names the expression refers to.
+
+    See parse_expression for the expressions allowed. Compiled expressions
+    are cached.
+    """
+    expression = str(expression).strip()
+    key = (expression, tuple(sorted(rules.items())) if rules else ())
+    if key in _code_cache:
+        return _code_cache[key]
+    body, names = parse_expression(expression, rules)
+    tree = ast.fix_missing_locations(ast.Expression(body=body))
+    code = compile(tree, '<{0}>'.format(expression), 'eval')
+    _code_cache[key] = (code, names)
+    return code, names
+
+
+def evaluate_parameters(model):
+    """
+    Evaluates all parameter expressions of model to floats, in dependency
+    order, without modifying the Parameter objects. Returns an OrderedDict
+    in model order. See gillespy.parameters.
+    """
+    from .parameters import compile_parameters
+    return compile_parameters(model)()
+
+
+class CompiledEvent(object):
+    """
+    An Event of a CompiledModel: compiled trigger, and (state column,
+    compiled expression) pairs for its assignments.
+    """
+
+    def __init__(self, name, trigger, assignments, initial_value):
+        self.name = name
+        self.trigger = trigger
+        self.assignments = assignments
+        self.initial_value = initial_value
+
+
+class CompiledModel(object):
+    """
+    Array representation of a Model for the native solvers.
+
+    The state of a simulation is a vector of the species populations,
+    followed by the parameters that change during a simulation (targets of
+    events or rate rules). Assignment rules are substituted into every
+    compiled expression.
+
+    Attributes
+    ----------
+    species_names : list of str
+        Species, the first columns of the state.
+    variables : list of str
+        Parameters that are part of the state, after the species.
+    state_names : list of str
+        species_names + variables.
+    initial_values : numpy ndarray
+        Initial state, as floats.
+    parameters : OrderedDict
+        Resolved parameter values, plus 'vol'.
+    volume : float
+        System volume.
+    reaction_names : list of str
+        Reactions in propensity column order.
+    stoichiometry : numpy ndarray
+        Net change of the species by each reaction, shape (reactions,
+        species).
+    reactants : numpy ndarray
+        Reactant stoichiometry, shape (reactions, species).
+    events : list of CompiledEvent
+    tspan : numpy ndarray
+        The output times of the model.
+    frozen : bool
+        Whether the model is immutable, see freeze.
+    """
+
+    frozen = False
+
+    def __init__(self, model):
+        if model.units != "population" and model.units != "concentration":
+            raise ModelError("Unknown units '{0}'".format(model.units))
+        # Expressions of the compiled code objects, to pickle them
+        self._sources = {}
+        self.name = model.name
+        self.units = model.units
+        self.tspan = numpy.array(model.tspan, dtype=float)
+        self.volume = float(model.volume)
+        self.species_names = list(model.listOfSpecies)
+        self.parameters = evaluate_parameters(model)
+        self.parameters['vol'] = self.volume
+        self.reaction_names = list(model.listOfReactions)
+
+        self.rules = OrderedDict((v, r.expression) for v, r in
+                                 model.listOfAssignmentRules.items())
+        targets = list(model.listOfRateRules)
+        for event in model.listOfEvents.values():
+            targets.extend(event.assignments)
+        self.variables = []
+        for v in targets:
+            if v in self.rules:
+                raise ModelError("'{0}' is the target of an assignment rule "
+                                 "and cannot be changed otherwise".format(v))
+            if v in model.listOfSpecies or v in self.variables:
+                continue
+            if v not in self.parameters or v == 'vol':
+                raise ModelError("Unknown variable '{0}' in event or rate "
+                                 "rule".format(v))
+            self.variables.append(v)
+        self.state_names = self.species_names + self.variables
+        self.state_index = dict((s, i) for i, s in
+                                enumerate(self.state_names))
+        self.initial_values = numpy.array(
+            [float(model.listOfSpecies[s].initial_value)
+             for s in self.species_names] +
+            [self.parameters[v] for v in self.variables])
+        # Rate constants that are not constant make a reaction customized
+        changing = set(self.variables) | set(self.rules)
+
+        nr, ns = len(self.reaction_names), len(self.species_names)
+        self.reactants = numpy.zeros((nr, ns))
+        self.products = numpy.zeros((nr, ns))
+
+        # Mass-action propensities are k * vol**(1-order) * prod(binom(X, n))
+        # with at most two reactant species (see Reaction.create_mass_action)
+        ma_index, ma_rate, ma_species, ma_count = [], [], [], []
+        self.custom = []
+
+        reactions = model.listOfReactions
+        table = reactions._table if isinstance(reactions, _TableDict) \
+            else None
+        for j, rname in enumerate(self.reaction_names):
+            k = None
+            if table is not None and not reactions.is_built(rname):
+                k = reactions.table_index(rname)
+            if k is not None and table.parameter_name(k) not in changing:
+                reactants = table._column(table.reactants, k)
+                products = table._column(table.products, k)
+                rate = table.parameter_name(k)
+                massaction = True
+            else:
+                R = model.listOfReactions[rname]
+                reactants, products = R.reactants, R.products
+                massaction = R.massaction and R.marate.name not in changing
+                if massaction:
+                    rate = R.marate.name
+                propensity = R.propensity_function
+
+            for s, n in reactants.items():
+                self.reactants[j, self._species(s, rname)] = n
+            for s, n in products.items():
+                self.products[j, self._species(s, rname)] = n
+
+            if massaction:
+                order = int(sum(reactants.values()))
+                if order > 2:
+                    raise ReactionError("Reaction {0}: A mass-action reaction "
+                        "cannot involve more than two of one species or one "
+                        "of two species.".format(rname))
+                if rate not in self.parameters:
+                    raise ReactionError("Reaction {0}: rate parameter '{1}' "
+                        "is not in the model".format(rname, rate))
+                slots = [(self.state_index[s], int(n))
+                         for s, n in reactants.items()] + [(ns, 0), (ns, 0)]
+                ma_index.append(j)
+                ma_rate.append(self.parameters[rate] *
+                               self.volume ** (1 - order))
+                ma_species.append([slots[0][0], slots[1][0]])
+                ma_count.append([slots[0][1], slots[1][1]])
+            else:
+                self.custom.append((j, self.compile(
+                    propensity, "propensity function of reaction " + rname)))
+
+        self.stoichiometry = self.products - self.reactants
+        self.ma_index = numpy.array(ma_index, dtype=int)
+        self.ma_rate = numpy.array(ma_rate, dtype=float)
+        self.ma_species = numpy.array(ma_species, dtype=int).reshape(-1, 2)
+        self.ma_count = numpy.array(ma_count, dtype=int).reshape(-1, 2)
+        self._group_mass_action()
+        self._namespace = dict(FUNCTIONS)
+        self._namespace.update(self.parameters)
+        self._namespace['__builtins__'] = {}
+
+        # Species defined by assignment rules, recomputed for the output
+        self.species_rules = [
+            (self.species_names.index(v), self.compile(e, "rule for " + v))
+            for v, e in self.rules.items() if v in model.listOfSpecies]
+        self.rate_rules = [
+            (self.state_index[v], self.compile(r.expression,
+                                               "rate rule for " + v))
+            for v, r in model.listOfRateRules.items()]
+        self.events = []
+        for e in model.listOfEvents.values():
+            self.events.append(CompiledEvent(
+                e.name, self.compile(e.trigger, "trigger of event " + e.name),
+                [(self.state_index[v], self.compile(
+                    x, "assignment to {0} in event {1}".format(v, e.name)))
+                 for v, x in e.assignments.items()],
+                e.initial_value))
+
+    def compile(self, expression, what):
+        """
+        Compiles an expression in the namespace of the model, with the
+        assignment rules substituted. what describes the expression for
+        error messages.
+        """
+        code, names = compile_expression(expression, self.rules)
+        unknown = names - set(self.parameters) - set(self.state_index) \
+            - set(['t'])
+        if unknown:
+            raise ModelError("Unknown names {0} in {1}: '{2}'".format(
+                ', '.join(sorted(unknown)), what, expression))
+        self._sources[code] = expression
+        return code
+
+    def freeze(self):
+        """
+        Makes the model immutable, so that threads can simulate it at the
+        same time: its arrays are made read-only, its parameters a
+        read-only mapping, and its attributes can no longer be set. The
+        simulation functions only read a compiled model. Returns the model.
+        """
+        for value in self.__dict__.values():
+            if isinstance(value, numpy.ndarray):
+                value.setflags(write=False)
+        for group in self._ma_groups:
+            for value in group[1:]:
+                value.setflags(write=False)
+        self.__dict__['parameters'] = MappingProxyType(self.parameters)
+        self.__dict__['frozen'] = True
+        return self
+
+    def __setattr__(self, name, value):
+        if self.frozen:
+            raise AttributeError("Can't set attribute '{0}' of a frozen "
+                                 "model".format(name))
+        object.__setattr__(self, name, value)
+
+    def _map_code(self, state, function):
+        """ Applies function to the code objects in state, a __dict__. """
+        state['custom'] = [(j, function(code))
+                           for j, code in state['custom']]
+        state['species_rules'] = [(i, function(code))
+                                  for i, code in state['species_rules']]
+        state['rate_rules'] = [(i, function(code))
+                               for i, code in state['rate_rules']]
+        state['events'] = [CompiledEvent(e.name, function(e.trigger),
+                                         [(i, function(code)) for i, code
+                                          in e.assignments], e.initial_value)
+                           for e in state['events']]
+
+    def __getstate__(self):
+        # Code objects can not be pickled; they are compiled again from
+        # their expressions
+        state = dict(self.__dict__)
+        state['parameters'] = OrderedDict(self.parameters)
+        self._map_code(state, self._sources.__getitem__)
+        del state['_sources']
+        return state
+
+    def __setstate__(self, state):
+        sources = {}
+
+        def recompile(expression):
+            code = compile_expression(expression, state['rules'])[0]
+            sources[code] = expression
+            return code
+        self._map_code(state, recompile)
+        state['_sources'] = sources
+        frozen = state.pop('frozen', False)
+        self.__dict__.update(state)
+        if frozen:
+            self.freeze()
+
+    def _species(self, sname, rname):
+        i = self.state_index.get(sname)
+        if i is None or i >= len(self.species_names):
+            raise ReactionError("Reaction {0} refers to unknown species "
+                                "'{1}'".format(rname, sname))
+        return i
+
+    def _group_mass_action(self):
+        """
+        Splits the mass-action reactions by the form of their propensity,
+        so each form is evaluated with a few whole-array operations.
+        """
+        count = self.ma_count
+        groups = [
+            # k
+            (count[:, 0] == 0),
+            # k*X
+            (count[:, 0] == 1) & (count[:, 1] == 0),
+            # k*X*Y
+            (count[:, 0] == 1) & (count[:, 1] == 1),
+            # 0.5*k*X*(X-1)
+            (count[:, 0] == 2),
+        ]
+        self._ma_groups = []
+        for form, mask in enumerate(groups):
+            if mask.any():
+                self._ma_groups.append((form, self.ma_index[mask],
+                                        self.ma_rate[mask],
+                                        self.ma_species[mask, 0],
+                                        self.ma_species[mask, 1]))
+
+    @property
+    def is_mass_action(self):
+        """ True if all reactions are mass-action. """
+        return not self.custom
+
+    @property
+    def has_events(self):
+        """ True if the model has events or rate rules. """
+        return bool(self.events or self.rate_rules)
+
+    def namespace(self, X, t):
+        """
+        Namespace for evaluating compiled expressions: parameters, and one
+        column of X per state variable. X has shape (states, state size)
+        and t is the time of each state.
+        """
+        ns = dict(self._namespace)
+        for i, s in enumerate(self.state_names):
+            ns[s] = X[:, i]
+        ns['t'] = t
+        return ns
+
+    def evaluate(self, code, X, t):
+        """ Evaluates compiled code for each state in X, as a float array. """
+        value = eval(code, self.namespace(X, t))
+        return numpy.broadcast_to(numpy.asarray(value, dtype=float),
+                                  (X.shape[0],))
+
+    def propensities(self, X, t=0.0):
+        """
+        Propensities of all reactions for each state in X (shape (states,
+        state size)), returned as an array of shape (states, reactions).
+        """
+        a = numpy.empty((X.shape[0], len(self.reaction_names)))
+        for form, index, rate, s1, s2 in self._ma_groups:
+            if form == 0:
+                a[:, index] = rate
+            elif form == 1:
+                a[:, index] = rate * X[:, s1]
+            elif form == 2:
+                a[:, index] = rate * X[:, s1] * X[:, s2]
+            else:
+                x = X[:, s1]
+                a[:, index] = (0.5 * rate) * x * (x - 1)
+        if self.custom:
+            ns = self.namespace(X, t)
+            for j, code in self.custom:
+                a[:, j] = eval(code, ns)
+        return a
+
+    def propensity_derivatives(self, x, t=0.0, second=True):
+        """
+        Propensities of all reactions at the single state x and their first
+        (and second) derivatives with respect to the species: arrays a
+        (reactions,), jacobian (reactions, species) and hessian (reactions,
+        species, species), or None if not second. Mass-action terms are
+        differentiated exactly; customized propensity functions by central
+        differences, all perturbed states being evaluated in one call.
+        """
+        ns = len(self.species_names)
+        nr = len(self.reaction_names)
+        a = self.propensities(x[None, :], t)[0]
+        jacobian = numpy.zeros((nr, ns))
+        hessian = numpy.zeros((nr, ns, ns)) if second else None
+        for form, index, rate, s1, s2 in self._ma_groups:
+            if form == 1:
+                jacobian[index, s1] = rate
+            elif form == 2:
+                jacobian[index, s1] = rate * x[s2]
+                jacobian[index, s2] = rate * x[s1]
+                if second:
+                    hessian[index, s1, s2] = rate
+                    hessian[index, s2, s1] = rate
+            elif form == 3:
+                jacobian[index, s1] = rate * (x[s1] - 0.5)
+                if second:
+                    hessian[index, s1, s1] = rate
+        if not self.custom:
+            return a, jacobian, hessian
+
+        custom = [j for j, _ in self.custom]
+        h = 1e-4 * numpy.maximum(1.0, numpy.abs(x[:ns]))
+        steps = numpy.zeros((ns, len(x)))
+        steps[:, :ns] = numpy.diag(h)
+        points = [x + steps, x - steps]
+        if second:
+            # x +- h_i e_i +- h_j e_j, for all pairs (i, j)
+            pairs = steps[:, None, :] + steps[None, :, :]
+            cross = steps[:, None, :] - steps[None, :, :]
+            points += [(x + pairs).reshape(-1, len(x)),
+                       (x + cross).reshape(-1, len(x)),
+                       (x - cross).reshape(-1, len(x)),
+                       (x - pairs).reshape(-1, len(x))]
+        values = self.propensities(numpy.concatenate(points), t)[:, custom]
+        jacobian[custom] = ((values[:ns] - values[ns:2*ns]) /
+                            (2 * h)[:, None]).T
+        if second:
+            pp, pm, mp, mm = values[2*ns:].reshape(4, ns, ns, -1)
+            hessian[custom] = ((pp - pm - mp + mm) /
+                               (4 * numpy.outer(h, h))[:, :, None]
+                               ).transpose(2, 0, 1)
+        return a, jacobian, hessian
+
+    def rates(self, X, t):
+        """
+        Values of the rate rules for each state in X, as an array of shape
+        (states, rate rules); see rate_rules for the state columns.
+        """
+        return numpy.column_stack([self.evaluate(code, X, t)
+                                   for _, code in self.rate_rules])
+
+    def triggers(self, X, t):
+        """ Trigger values of all events, a bool array (states, events). """
+        return numpy.column_stack([self.evaluate(e.trigger, X, t) != 0
+                                   for e in self.events])
+
+    def fire_events(self, X, t, fired):
+        """
+        Executes the events marked in fired (bool array (states, events)),
+        in order, changing X in place.
+        """
+        for e, event in enumerate(self.events):
+            rows = numpy.flatnonzero(fired[:, e])
+            if not len(rows):
+                continue
+            Xr = X[rows]
+            values = [self.evaluate(code, Xr, t[rows])
+                      for _, code in event.assignments]
+            for (column, _), value in zip(event.assignments, values):
+                X[rows, column] = value
+
+    def apply_rules(self, X, t):
+        """
+        Sets species defined by assignment rules to their values, for
+        states X (changed in place).
+        """
+        for column, code in self.species_rules:
+            X[:, column] = self.evaluate(code, X, t)
+
+
+def compile_model(model):
+    """
+    Returns the CompiledModel of a gillespy Model; a frozen CompiledModel
+    is returned as it is.
+    """
+    if isinstance(model, CompiledModel) and model.frozen:
+        return model
+    return CompiledModel(model)
@@ -0,0 +1,189 @@
+"""
+Conservation laws of a reaction network: weighted sums of species, such as
+the total enzyme E + ES, that no reaction changes. They span the left null
+space of the stoichiometry matrix, the vectors l with l' N = 0 for the
+(species, reactions) matrix N.
+
+Each law makes one species dependent on the others. The deterministic
+solvers (the reaction rate equations and the moment equations) integrate
+only the independent species and reconstruct the dependent ones in the
+output, which makes the system smaller and removes the singular directions
+of its Jacobian:
+
+    laws = conservation_laws(model)
+    laws.dependent_names    # e.g. ['ES'], given by E + ES = constant
+
+Species that are changed other than by reactions (by events or rules) are
+never part of a law.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy
+
+from .compiled import CompiledModel, compile_model
+
+# Relative size below which a diagonal entry of the (pivoted) triangular
+# factor of the stoichiometry is taken as zero
+RANK_TOLERANCE = 1e-9
+
+
+class ConservationLaws(object):
+    """
+    The conservation laws of a compiled model, see conservation_laws. The
+    populations x of every trajectory satisfy
+
+        x[dependent] = x0[dependent] + coefficients (x - x0)[independent]
+
+    for the initial state x0, or any other state of the trajectory.
+
+    Attributes
+    ----------
+    species_names : list of str
+        All species of the model.
+    independent : numpy ndarray
+        Indices of the species that are integrated, in model order.
+    dependent : numpy ndarray
+        Indices of the species that are eliminated, one per law.
+    coefficients : numpy ndarray
+        Change of each dependent species per change of each independent
+        species, shape (dependent, independent).
+    """
+
+    def __init__(self, species_names, independent, dependent, coefficients):
+        self.species_names = list(species_names)
+        self.independent = numpy.asarray(independent, dtype=int)
+        self.dependent = numpy.asarray(dependent, dtype=int)
+        self.coefficients = numpy.asarray(coefficients, dtype=float).reshape(
+            len(self.dependent), len(self.independent))
+
+    def __len__(self):
+        """ The number of laws. """
+        return len(self.dependent)
+
+    @property
+    def dependent_names(self):
+        return [self.species_names[i] for i in self.dependent]
+
+    @property
+    def matrix(self):
+        """
+        The laws as rows of weights of the species, shape (laws, species):
+        matrix.dot(x) is the same for all states x of a trajectory.
+        """
+        L = numpy.zeros((len(self), len(self.species_names)))
+        L[numpy.arange(len(self)), self.dependent] = 1.0
+        L[:, self.independent] -= self.coefficients
+        return L
+
+    def totals(self, x):
+        """ The conserved totals of the states x, shape (..., laws). """
+        x = numpy.asarray(x, dtype=float)[..., :len(self.species_names)]
+        return x.dot(self.matrix.T)
+
+    @property
+    def transform(self):
+        """
+        The change of all species per change of the independent ones,
+        shape (species, independent).
+        """
+        T = numpy.zeros((len(self.species_names), len(self.independent)))
+        T[self.independent, numpy.arange(len(self.independent))] = 1.0
+        T[self.dependent] = self.coefficients
+        return T
+
+    def columns(self, size):
+        """
+        The columns of a state of size entries (the species, then any
+        parameters in the state) that are integrated: the independent
+        species and the parameters.
+        """
+        return numpy.concatenate([self.independent,
+                                  numpy.arange(len(self.species_names),
+                                               size)]).astype(int)
+
+    def expand(self, Z, base):
+        """
+        The full states of the reduced states Z, shape (..., columns), of a
+        trajectory that passes through the full state base.
+        """
+        Z = numpy.asarray(Z, dtype=float)
+        X = numpy.empty(Z.shape[:-1] + base.shape)
+        X[...] = base
+        X[..., self.columns(len(base))] = Z
+        change = Z[..., :len(self.independent)] - base[self.independent]
+        X[..., self.dependent] = base[self.dependent] + \
+            change.dot(self.coefficients.T)
+        return X
+
+    def __repr__(self):
+        return "ConservationLaws({0})".format(', '.join(self.dependent_names))
+
+
+def _changed_species(compiled):
+    """ Species that events or rules change, besides the reactions. """
+    ns = len(compiled.species_names)
+    columns = set(c for c, _ in compiled.rate_rules)
+    columns.update(c for c, _ in compiled.species_rules)
+    for event in compiled.events:
+        columns.update(c for c, _ in event.assignments)
+    return set(c for c in columns if c < ns)
+
+
+def conservation_laws(model, exclude=None):
+    """
+    The conservation laws of a Model (or CompiledModel), from the left null
+    space of its stoichiometry matrix. A maximal set of species whose
+    columns of the stoichiometry are linearly independent is chosen by a
+    QR factorization with column pivoting; each of the other species is a
+    fixed combination of them.
+
+    Attributes
+    ----------
+    model : gillespy.Model or gillespy.compiled.CompiledModel
+        The model to analyze.
+    exclude : set of int (optional)
+        Indices of species to keep out of the laws. By default the species
+        changed by events or rules.
+    """
+    from scipy.linalg import qr, lstsq
+
+    compiled = model
+    if not isinstance(model, CompiledModel):
+        compiled = compile_model(model)
+    S = compiled.stoichiometry
+    ns = S.shape[1]
+    if exclude is None:
+        exclude = _changed_species(compiled)
+    candidates = numpy.array([i for i in range(ns) if i not in exclude],
+                             dtype=int)
+    N = S[:, candidates]
+    if N.shape[0] > N.shape[1] > 0:
+        # The triangular factor has the same column dependencies, and is
+        # only (species, species)
+        N = qr(N, mode='r', check_finite=False)[0][:N.shape[1]]
+    if N.size:
+        R, pivots = qr(N, mode='r', pivoting=True, check_finite=False)
+        diagonal = numpy.abs(numpy.diagonal(R))
+        rank = int(numpy.sum(diagonal > RANK_TOLERANCE *
+                             max(diagonal.max(initial=0.0), 1.0)))
+    else:
+        pivots, rank = numpy.arange(len(candidates)), 0
+    basis = numpy.sort(pivots[:rank])
+    eliminated = numpy.sort(pivots[rank:])
+
+    independent = numpy.sort(numpy.concatenate(
+        [candidates[basis], numpy.array(sorted(exclude), dtype=int)]))
+    dependent = candidates[eliminated]
+    coefficients = numpy.zeros((len(dependent), len(independent)))
+    if len(dependent) and rank:
+        solution = lstsq(N[:, basis], N[:, eliminated],
+                         check_finite=False)[0]
+        # Stoichiometries are integers, so are most coefficients
+        rounded = numpy.round(solution)
+        solution = numpy.where(numpy.abs(solution - rounded) < 1e-9, rounded,
+                               solution)
+        position = numpy.searchsorted(independent, candidates[basis])
+        coefficients[:, position] = solution.T
+    return ConservationLaws(compiled.species_names, independent, dependent,
+                            coefficients)
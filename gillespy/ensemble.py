@@ -0,0 +1,363 @@
+"""
+Ensemble statistics and progress of ensemble runs, and ensembles whose size
+is chosen by the run rather than by the user: the trajectories are simulated
+in batches, in parallel worker processes, until the ensemble mean reaches a
+target precision (see gillespy.Precision).
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import math
+import multiprocessing
+import timeit
+from collections import OrderedDict
+
+import numpy
+
+from .gillespy import Results, SimulationError
+from .streams import root_seed, trajectory_seed
+
+
+class EnsembleStatistics(object):
+    """
+    The mean and variance of each species over an ensemble of trajectories,
+    at each output time.
+
+    Attributes
+    ----------
+    time : numpy ndarray
+        The output times.
+    species_names : list of str
+        The species, in column order of mean and variance.
+    mean : numpy ndarray
+        Ensemble mean, shape (times, species).
+    variance : numpy ndarray
+        Ensemble (sample) variance, shape (times, species).
+    number_of_trajectories : int
+        Size of the ensemble; infinite for statistics computed from the
+        moment equations (see moments.py), whose mean has no sampling error.
+    covariance : numpy ndarray
+        Covariance of the species, shape (times, species, species), if
+        known.
+    """
+
+    def __init__(self, time, species_names, mean, variance,
+                 number_of_trajectories, covariance=None):
+        self.time = numpy.asarray(time)
+        self.species_names = list(species_names)
+        self.mean = numpy.asarray(mean)
+        self.variance = numpy.asarray(variance)
+        self.number_of_trajectories = number_of_trajectories
+        self.covariance = covariance
+
+    @classmethod
+    def from_trajectories(cls, trajectories, species_names):
+        """
+        Statistics of trajectories in the solver result format without
+        labels, a list of arrays (or an array) with time in column 0.
+        """
+        data = numpy.asarray(trajectories, dtype=float)
+        n = data.shape[0]
+        variance = numpy.zeros(data.shape[1:])[:, 1:]
+        if n > 1:
+            variance = data[:, :, 1:].var(axis=0, ddof=1)
+        return cls(data[0, :, 0], species_names, data[:, :, 1:].mean(axis=0),
+                   variance, n)
+
+    def __getitem__(self, species):
+        """ (mean, variance) of the named species at each output time. """
+        i = self.species_names.index(species)
+        return self.mean[:, i], self.variance[:, i]
+
+    def confidence_interval(self, confidence=0.95):
+        """
+        Normal-approximation confidence interval of the mean, a tuple of
+        arrays (low, high) of shape (times, species).
+        """
+        from scipy.special import ndtri
+        z = ndtri(0.5 + confidence / 2)
+        half = z * numpy.sqrt(self.variance /
+                              max(self.number_of_trajectories, 1))
+        return self.mean - half, self.mean + half
+
+
+class Progress(object):
+    """
+    Progress of a running ensemble, passed to the progress callback of a
+    solver. If the callback returns False the run is aborted and the
+    results up to the time reached by every trajectory are returned, with
+    results.metadata['aborted'] set.
+
+    Attributes
+    ----------
+    number_of_trajectories : int
+        Size of the ensemble.
+    trajectories_completed : int
+        Trajectories that have reached the end time.
+    time : float
+        Simulated time reached by every trajectory.
+    end_time : float
+        End time of the simulation.
+    events : int
+        Reaction events simulated so far, or None if the solver can not
+        tell.
+    elapsed : float
+        Wall time of the run so far, in seconds.
+    """
+
+    def __init__(self, number_of_trajectories, trajectories_completed, time,
+                 end_time, events, elapsed, statistics=None):
+        self.number_of_trajectories = number_of_trajectories
+        self.trajectories_completed = trajectories_completed
+        self.time = time
+        self.end_time = end_time
+        self.events = events
+        self.elapsed = elapsed
+        self._statistics = statistics
+
+    @property
+    def events_per_second(self):
+        if self.events is None or not self.elapsed:
+            return None
+        return self.events / self.elapsed
+
+    @property
+    def fraction(self):
+        """ Fraction of the simulation done, between 0 and 1. """
+        if self.end_time <= 0:
+            return 1.0
+        return min(1.0, self.time / self.end_time)
+
+    def statistics(self):
+        """
+        EnsembleStatistics of the results so far: of all trajectories up
+        to the time every trajectory has reached, or of the trajectories
+        completed so far, depending on the solver. None if there are none
+        yet.
+        """
+        if self._statistics is None:
+            return None
+        return self._statistics()
+
+    def __repr__(self):
+        return ("Progress({0}/{1} trajectories, t={2:g}/{3:g}, {4:.1f} "
+                "s)".format(self.trajectories_completed,
+                            self.number_of_trajectories, self.time,
+                            self.end_time, self.elapsed))
+
+
+class ProgressMonitor(object):
+    """
+    Calls a progress callback at most every interval seconds from a
+    solver's simulation loop. Call it once per step with the number of
+    events of the step; it returns False when the run is to be aborted.
+
+    Attributes
+    ----------
+    callback : callable
+        Called as callback(progress) with a Progress, or None to only
+        enforce the timeout.
+    interval : float
+        Minimum wall time in seconds between two calls.
+    report : callable
+        Called as report(events, elapsed) to build the Progress. Usually
+        set by the simulation loop, which knows the state of the ensemble.
+    timeout : float
+        Wall time in seconds after which a SimulationError is raised from
+        the simulation loop. Defaults to no limit.
+    """
+
+    def __init__(self, callback, interval=1.0, report=None, timeout=None):
+        self.callback = callback
+        self.interval = interval
+        self.report = report
+        self.timeout = timeout
+        self.events = 0
+        self.aborted = False
+        self._steps = 0
+        self._start = self._last = timeit.default_timer()
+
+    def __call__(self, events):
+        self.events += events
+        self._steps += 1
+        # Reading the clock on every step would slow down short steps
+        if self._steps % 16:
+            return True
+        now = timeit.default_timer()
+        if self.timeout is not None and now - self._start >= self.timeout:
+            raise SimulationError("The run timed out after {0:g} "
+                                  "s".format(self.timeout))
+        if self.callback is None or now - self._last < self.interval:
+            return True
+        self._last = now
+        return self.notify()
+
+    def notify(self):
+        """ Calls the callback now. Returns False if it aborts the run. """
+        if self.callback is None:
+            return True
+        progress = self.report(self.events,
+                               timeit.default_timer() - self._start)
+        result = self.callback(progress)
+        if result is not None and not result:
+            self.aborted = True
+        return not self.aborted
+
+
+def _batch(solver, model, entropy, start, size, options):
+    """
+    The job that runs trajectories start to start + size. Solvers with
+    independent streams run exactly those trajectories of the root seed, so
+    the ensemble does not depend on the batching; others get a seed derived
+    from the batch number.
+    """
+    options = dict(options, number_of_trajectories=size)
+    if solver.independent_streams:
+        options.update(seed=entropy, trajectories=range(start, start + size))
+    else:
+        sequence = trajectory_seed(entropy, start)
+        options.update(seed=int(sequence.generate_state(1)[0]))
+    return solver, model, options
+
+
+def _run_batch(args):
+    """
+    Worker for run_to_precision. Returns the trajectories and the phases
+    of the run, as (name, seconds, nbytes) in the order they ended.
+    """
+    solver, model, options = args
+    phases = []
+    results = solver.run(model, show_labels=False,
+                         phase_callback=lambda *phase: phases.append(phase),
+                         **options)
+    return list(results), phases
+
+
+def run_to_precision(model, solver, precision, seed=None, show_labels=False,
+                     progress=None, phase_callback=None, **options):
+    """
+    Runs batches of trajectories of model with solver until the confidence
+    interval of the ensemble mean is narrower than precision.width at every
+    checked species and time, or precision.max_trajectories is reached.
+    After each round the number of trajectories still needed is estimated
+    from the current interval width (which shrinks as 1/sqrt(n)), so few
+    rounds are needed.
+
+    Returns Results whose metadata records the number of trajectories, the
+    achieved interval width and whether the target was met.
+
+    Attributes
+    ----------
+    model : gillespy.Model
+        The model to simulate.
+    solver : gillespy.GillesPySolver
+        The solver class; each batch is a call to solver.run.
+    precision : gillespy.Precision
+        The target precision.
+    seed : int
+        Root seed, recorded in the results metadata. With independent
+        streams (see streams.py) trajectory i of the ensemble is the same
+        whatever the batching and number of processes.
+    show_labels : bool (False)
+        Use names of species as index of result object rather than position
+        numbers.
+    progress : callable
+        Called as progress(p) with a Progress after each round of batches;
+        number_of_trajectories is the current estimate of the ensemble size
+        needed. Returning False stops the run.
+    phase_callback : callable
+        Called as phase_callback(name, seconds, nbytes) for each phase of
+        each batch, as the solver reports it (see timing.PhaseTimer), in
+        this process as the batches complete. The phases summed over the
+        batches are recorded in results.metadata['phases'].
+    options
+        Further keyword arguments to solver.run, such as t and tspan.
+    """
+    tspan = numpy.asarray(options.get('tspan', model.tspan), dtype=float)
+    species = list(model.listOfSpecies)
+    try:
+        columns = [1 + species.index(name)
+                   for name in (precision.species or species)]
+    except ValueError as e:
+        raise SimulationError("Unknown species in precision target: "
+                              "{0}".format(e))
+    if precision.times is None:
+        rows = numpy.arange(len(tspan))
+    else:
+        rows = numpy.array([numpy.abs(tspan - time).argmin()
+                            for time in precision.times])
+
+    processes = precision.processes or multiprocessing.cpu_count()
+    start_time = timeit.default_timer()
+    aborted = False
+    entropy = root_seed(seed)
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+
+    trajectories, selected = [], []
+    phases = OrderedDict()
+    batches = processes
+    try:
+        while True:
+            start = len(trajectories)
+            jobs = []
+            while len(jobs) < batches and start < precision.max_trajectories:
+                size = min(precision.batch_size,
+                           precision.max_trajectories - start)
+                jobs.append(_batch(solver, model, entropy, start, size,
+                                   options))
+                start += size
+            if pool is None:
+                results = [_run_batch(job) for job in jobs]
+            else:
+                results = pool.map(_run_batch, jobs, chunksize=1)
+            for batch, batch_phases in results:
+                for name, seconds, nbytes in batch_phases:
+                    total = phases.setdefault(name, {'time': 0.0, 'bytes': 0})
+                    total['time'] += seconds
+                    total['bytes'] += nbytes
+                    if phase_callback is not None:
+                        phase_callback(name, seconds, nbytes)
+                trajectories.extend(batch)
+                selected.append(numpy.array(batch)[:, rows][:, :, columns])
+
+            data = numpy.concatenate(selected)
+            width = precision.interval_width(data)
+            n = len(trajectories)
+            if width <= precision.width or \
+                    n >= precision.max_trajectories:
+                break
+            if numpy.isfinite(width):
+                needed = n * (width / precision.width) ** 2
+            else:
+                needed = 2 * n
+            if progress is not None:
+                report = Progress(
+                    int(min(math.ceil(needed), precision.max_trajectories)),
+                    n, tspan[-1], tspan[-1], None,
+                    timeit.default_timer() - start_time,
+                    lambda: EnsembleStatistics.from_trajectories(
+                        trajectories, species))
+                result = progress(report)
+                if result is not None and not result:
+                    aborted = True
+                    break
+            batches = max(1, int(math.ceil(
+                (min(needed, precision.max_trajectories) - n) /
+                precision.batch_size)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if show_labels:
+        labels = ['time'] + species
+        trajectories = [dict((l, r[:, i]) for i, l in enumerate(labels))
+                        for r in trajectories]
+    return Results(trajectories, stop_time=tspan[-1], seed=entropy,
+                   number_of_trajectories=n, interval_width=width,
+                   target_width=precision.width,
+                   confidence=precision.confidence,
+                   converged=bool(width <= precision.width), aborted=aborted,
+                   phases=phases)
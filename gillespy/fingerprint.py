@@ -0,0 +1,299 @@
+"""
+Canonical fingerprints of models, stable identities for result and compile
+caches and for finding duplicate models.
+
+A fingerprint covers the species, parameters, reactions, events and rules
+of a model, its volume and its units, but not its name, annotation or
+output times. It does not depend on the order of the dicts of the model or
+on how expressions are written ("k1*A" and "k1 * A" are the same). It has
+two parts: the structure (the names of the species and parameters, the
+stoichiometry, rate laws, events and rules, and the units), which is all a
+compiled model's code depends on, and the parameters (the parameter
+expressions, initial values and volume). Models whose fingerprints differ
+only in their parameters can share compiled artifacts:
+
+    if model.fingerprint().compare(other.fingerprint()) == 'parameters':
+        ...
+
+The digests of each component are kept on it, with the attributes they
+were computed from, and only computed again once these change, so
+fingerprinting a model again, or a clone of it (Model.clone), only hashes
+what changed. The digests of the components are combined by addition,
+independent of their order; those of the reactions of a model built by
+Model.from_arrays are summed once per reaction table.
+"""
+from __future__ import absolute_import
+
+import ast
+import hashlib
+
+from .gillespy import _TableDict, _variable_name
+
+# Component digests are 128 bit integers, summed modulo 2**128
+_BITS = 128
+_MASK = (1 << _BITS) - 1
+
+
+def _digest(record):
+    """ The digest of a record (a tuple of str and numbers), an int. """
+    data = hashlib.blake2b(repr(record).encode('utf-8'),
+                           digest_size=_BITS // 8).digest()
+    return int.from_bytes(data, 'big')
+
+
+def canonical_expression(expression):
+    """
+    A canonical form of an expression: the repr of its float value if it
+    is a number, else a dump of its syntax tree, which does not depend on
+    spacing or redundant parentheses.
+    """
+    try:
+        return repr(float(expression))
+    except (TypeError, ValueError):
+        pass
+    text = str(expression).strip()
+    try:
+        return ast.dump(ast.parse(text, mode='eval').body)
+    except SyntaxError:
+        return text
+
+
+def _stoichiometry(species):
+    return tuple(sorted((str(s), float(n)) for s, n in species.items()))
+
+
+def _species_records(name, initial_value):
+    return ('species', name), ('species', name, float(initial_value))
+
+
+def _parameter_records(name, expression):
+    return ('parameter', name), \
+        ('parameter', name, canonical_expression(expression))
+
+
+def _reaction_records(name, reactants, products, massaction, law):
+    """ law is the rate parameter name, or the propensity function. """
+    if massaction:
+        law = ('mass-action', law)
+    else:
+        law = ('customized', canonical_expression(law))
+    return ('reaction', name, _stoichiometry(reactants),
+            _stoichiometry(products)) + law, None
+
+
+def _state(kind, obj):
+    """
+    The attributes of a component of a model that its fingerprint depends
+    on, as a tuple that is cheap to build and compare.
+    """
+    if kind == 'species':
+        return obj.name, obj.initial_value
+    if kind == 'parameter':
+        return obj.name, obj.expression
+    if kind == 'reaction':
+        law = _variable_name(obj.marate) if obj.massaction \
+            else obj.propensity_function
+        return (obj.name, tuple(obj.reactants.items()),
+                tuple(obj.products.items()), bool(obj.massaction), law)
+    if kind == 'event':
+        return obj.name, obj.trigger, tuple(obj.assignments.items()), \
+            bool(obj.initial_value)
+    # Assignment and rate rules
+    return obj.variable, obj.expression
+
+
+def _records(kind, state):
+    """ The (structure, parameters) records of a component of a model. """
+    if kind == 'species':
+        return _species_records(*state)
+    if kind == 'parameter':
+        return _parameter_records(*state)
+    if kind == 'reaction':
+        name, reactants, products, massaction, law = state
+        return _reaction_records(name, dict(reactants), dict(products),
+                                 massaction, law)
+    if kind == 'event':
+        name, trigger, assignments, initial_value = state
+        assignments = tuple(sorted((v, canonical_expression(x))
+                                   for v, x in assignments))
+        return ('event', name, canonical_expression(trigger), assignments,
+                initial_value), None
+    variable, expression = state
+    return (kind, variable, canonical_expression(expression)), None
+
+
+def _pair(records):
+    structure, parameters = records
+    return _digest(structure), \
+        _digest(parameters) if parameters is not None else 0
+
+
+def _digests(kind, obj):
+    """
+    The (structure, parameters) digests of a component, cached on it with
+    the state they were computed from.
+    """
+    state = _state(kind, obj)
+    cached = getattr(obj, '_fingerprint', None)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+    digests = _pair(_records(kind, state))
+    try:
+        obj._fingerprint = (state, digests)
+    except AttributeError:
+        pass  # e.g. a subclass with other __slots__
+    return digests
+
+
+def _table_row(table, j, parameters):
+    """ The digests of the reaction (or rate parameter) j of a table. """
+    if parameters:
+        return _pair(_parameter_records(table.parameter_name(j),
+                                        repr(float(table.rates[j]))))
+    return _pair(_reaction_records(table.reaction_name(j),
+                                   table._column(table.reactants, j),
+                                   table._column(table.products, j), True,
+                                   table.parameter_name(j)))
+
+
+def _table_sums(table, parameters):
+    """ The sums of the digests of all rows of a table, computed once. """
+    sums = getattr(table, '_fingerprint', None)
+    if sums is None:
+        sums = table._fingerprint = {}
+    if parameters not in sums:
+        structure = values = 0
+        for j in range(table.size):
+            s, v = _table_row(table, j, parameters)
+            structure += s
+            values += v
+        sums[parameters] = (structure & _MASK, values & _MASK)
+    return sums[parameters]
+
+
+def _sums(kind, mapping):
+    """ The sums of the digests of the components in mapping. """
+    structure = values = 0
+    if isinstance(mapping, _TableDict):
+        table, parameters = mapping._table, mapping._parameters
+        if mapping._size:
+            structure, values = _table_sums(table, parameters)
+            # Rows deleted, or replaced by stored objects
+            rows = set(mapping._deleted)
+            rows.update(mapping.table_index(key) for key in mapping._stored)
+            rows.discard(None)
+            for j in rows:
+                s, v = _table_row(table, j, parameters)
+                structure -= s
+                values -= v
+        objects = mapping._stored.values()
+    else:
+        objects = mapping.values()
+    for obj in objects:
+        s, v = _digests(kind, obj)
+        structure += s
+        values += v
+    return structure & _MASK, values & _MASK
+
+
+# The dicts of a model and the kind of their components
+_COMPONENTS = (('species', 'listOfSpecies'),
+               ('parameter', 'listOfParameters'),
+               ('reaction', 'listOfReactions'),
+               ('event', 'listOfEvents'),
+               ('assignment_rule', 'listOfAssignmentRules'),
+               ('rate_rule', 'listOfRateRules'))
+
+
+class Fingerprint(object):
+    """
+    The canonical identity of a model, see fingerprint. Fingerprints are
+    equal if the models are the same, and can be used as dict keys.
+
+    Attributes
+    ----------
+    structure : str
+        Hex digest of the structure of the model.
+    parameters : str
+        Hex digest of the parameter expressions, initial values and volume.
+    digest : str
+        Hex digest of both.
+    """
+
+    __slots__ = ('structure', 'parameters', 'digest')
+
+    def __init__(self, structure, parameters):
+        self.structure = structure
+        self.parameters = parameters
+        self.digest = hashlib.blake2b(
+            (structure + parameters).encode('ascii'),
+            digest_size=_BITS // 8).hexdigest()
+
+    def compare(self, other):
+        """
+        How the model differs from that of the Fingerprint other:
+        'identical', 'parameters' (only numbers differ, the structure is
+        the same) or 'structure'.
+        """
+        if self.structure != other.structure:
+            return 'structure'
+        if self.parameters != other.parameters:
+            return 'parameters'
+        return 'identical'
+
+    def __eq__(self, other):
+        return isinstance(other, Fingerprint) and self.digest == other.digest
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return "Fingerprint('{0}')".format(self.digest)
+
+
+def fingerprint(model):
+    """ The canonical Fingerprint of a Model. """
+    structure, values = _digest(('units', model.units)), \
+        _digest(('volume', float(model.volume)))
+    for kind, attribute in _COMPONENTS:
+        s, v = _sums(kind, getattr(model, attribute))
+        structure += s
+        values += v
+
+    def hexdigest(total):
+        return '{0:032x}'.format(total & _MASK)
+    return Fingerprint(hexdigest(structure), hexdigest(values))
+
+
+def _component_digests(model):
+    """ {(kind, name): digests} of the components of model. """
+    components = {('units', ''): (_digest(('units', model.units)), 0),
+                  ('volume', ''): (0, _digest(('volume',
+                                                float(model.volume))))}
+    for kind, attribute in _COMPONENTS:
+        for name, obj in getattr(model, attribute).items():
+            components[(kind, name)] = _digests(kind, obj)
+    return components
+
+
+def differences(model, other):
+    """
+    The components in which two models differ, as a dict: 'structure', the
+    components (e.g. 'reaction R1', 'species A') added, removed or changed
+    in structure, and 'parameters', those whose numbers changed (e.g.
+    'parameter k1', 'species A' for its initial value, 'volume'). Both are
+    sorted lists, empty if the models are the same.
+    """
+    mine, theirs = _component_digests(model), _component_digests(other)
+    structure, parameters = [], []
+    for key in set(mine) | set(theirs):
+        label = ' '.join(part for part in key if part)
+        if key not in mine or key not in theirs or \
+                mine[key][0] != theirs[key][0]:
+            structure.append(label)
+        elif mine[key][1] != theirs[key][1]:
+            parameters.append(label)
+    return {'structure': sorted(structure), 'parameters': sorted(parameters)}
@@ -16,42 +16,58 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 from collections import OrderedDict
-import scipy as sp
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 import numpy as np
-import matplotlib.pyplot as plt
+import copy
 import tempfile
 import uuid
 import subprocess
+import shlex
 import types
-import random
+import re
+import os
+import sys
+import shutil
+import numpy
+import importlib
 
-try:
-    import lxml.etree as etree
-    no_pretty_print = False
-except:
-    import xml.etree.ElementTree as etree
-    import xml.dom.minidom
-    import re
-    no_pretty_print = True
 
-try:
-    import scipy.io as spio
-    isSCIPY = True
-except:
-    pass
+class _LazyModule(object):
+    """
+    Stand-in for a module that is only imported the first time one of its
+    attributes is used. Keeps heavy dependencies (XML backends, plotting)
+    out of the cost of "import gillespy".
+    """
 
-import os
-import sys
-try:
-    import shutil
-    import numpy
-except:
-    pass
+    def __init__(self, *names):
+        # Candidate module names, the first importable one is used
+        self._names = names
+        self._module = None
 
-import pdb
+    def _load(self):
+        if self._module is None:
+            for name in self._names[:-1]:
+                try:
+                    self._module = importlib.import_module(name)
+                    break
+                except ImportError:
+                    pass
+            else:
+                self._module = importlib.import_module(self._names[-1])
+        return self._module
 
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
 
-def import_SBML(filename, name=None, gillespy_model=None):
+
+# StochML (de)serialization prefers lxml, which can pretty print, and falls
+# back to the standard library ElementTree.
+etree = _LazyModule('lxml.etree', 'xml.etree.ElementTree')
+
+def import_SBML(filename, name=None, gillespy_model=None, cache_dir=None):
     """
     SBML to GillesPy model converter. NOTE: non-mass-action rates
     in terms of concentrations may not be converted for population 
@@ -65,6 +81,9 @@ def import_SBML(filename, name=None, gillespy_model=None):
         Name of the resulting model.
     gillespy_model : gillespy.Model
         If desired, the SBML model may be added to an existing GillesPy model.
+    cache_dir : str
+        If given, converted models are cached in this directory, keyed on
+        the content of the SBML file, so repeated imports are not re-parsed.
     """
     
     try:
@@ -72,7 +91,32 @@ def import_SBML(filename, name=None, gillespy_model=None):
     except ImportError:
         raise ImportError('SBML conversion not imported successfully')
         
-    return convert(filename, modelName = name, gillespy_model = gillespy_model)
+    return convert(filename, modelName = name, gillespy_model = gillespy_model,
+                   cache_dir = cache_dir)
+
+
+def import_SBML_batch(filenames, processes=None, cache_dir=None):
+    """
+    Converts many SBML files in parallel worker processes. Returns a list of
+    (model, errors) tuples, one per file, in the order given.
+    
+    Attributes
+    ----------
+    filenames : list of str
+        Paths to the SBML files for conversion.
+    processes : int
+        Number of worker processes. Defaults to the number of CPUs.
+    cache_dir : str
+        Optional conversion cache directory, see import_SBML.
+    """
+    
+    try:
+        from .SBMLimport import convert_batch
+    except ImportError:
+        raise ImportError('SBML conversion not imported successfully')
+        
+    return convert_batch(filenames, processes = processes,
+                         cache_dir = cache_dir)
 
 
 class Model(object):
@@ -113,6 +157,12 @@ class Model(object):
         self.listOfSpecies    = OrderedDict()
         self.listOfReactions  = OrderedDict()
 
+        # Events and rules, keyed by name. These are only supported by the
+        # native solvers (StochML has no representation for them).
+        self.listOfEvents = OrderedDict()
+        self.listOfAssignmentRules = OrderedDict()
+        self.listOfRateRules = OrderedDict()
+
         # This defines the unit system at work for all numbers in the model
         # It should be a logical error to leave this undefined, subclasses 
         # should set it
@@ -132,8 +182,118 @@ class Model(object):
         if tspan is None:
             self.timespan(numpy.linspace(0,20,401))
         else: self.timespan(tspan)
-        
-    
+
+    @classmethod
+    def from_arrays(cls, species_names, initial_values, stoichiometry, rates,
+                    orders=None, reactants=None, reaction_names=None,
+                    name="", volume=1.0, tspan=None, annotation="model"):
+        """
+        Builds a mass-action model directly from arrays. The reactions and
+        their rate parameters are kept in the arrays rather than as Reaction
+        and Parameter objects: listOfReactions and listOfParameters return
+        lightweight views of them, so very large networks are constructed
+        quickly and take little memory.
+
+        Attributes
+        ----------
+        species_names : list of str
+            Names of the species, in row order of the stoichiometry matrix.
+        initial_values : array_like of int
+            Initial population of each species.
+        stoichiometry : array_like or scipy.sparse matrix
+            Net stoichiometry matrix of shape (species, reactions).
+        rates : array_like of float
+            Mass-action rate constant of each reaction. A parameter named
+            "k_<index>" is created for each reaction.
+        orders : array_like of int (optional)
+            Order of each reaction. If given, it is checked against the
+            reactant stoichiometry.
+        reactants : array_like or scipy.sparse matrix (optional)
+            Reactant stoichiometry of shape (species, reactions). Defaults to
+            the negative part of the stoichiometry matrix; it must be given
+            for reactions with catalysts (species that are both consumed and
+            produced).
+        reaction_names : list of str (optional)
+            Names of the reactions. Defaults to "R<index>".
+        name, volume, tspan, annotation :
+            Passed on to the Model constructor.
+        """
+        model = cls(name=name, volume=volume, tspan=tspan,
+                    annotation=annotation)
+        table = _ReactionTable(species_names, stoichiometry, rates,
+                               orders=orders, reactants=reactants,
+                               reaction_names=reaction_names)
+
+        initial_values = numpy.asarray(initial_values)
+        if len(initial_values) != len(table.species_names):
+            raise ModelError("initial_values must have one entry per species")
+        model.add_species([Species(name=s, initial_value=x) for s, x in
+                           zip(table.species_names, initial_values.tolist())])
+
+        model.listOfParameters = _TableDict(table, parameters=True)
+        model.listOfReactions = _TableDict(table, model=model)
+        return model
+
+    def clone(self, overrides=None, volume=None, tspan=None, name=None):
+        """
+        Returns a variant of the model, e.g. for a parameter sweep. The
+        clone shares the species, parameters, reactions, events and rules
+        of the model; they are copied on write, only when the model or the
+        clone replaces them or changes them through the Model methods
+        (such as set_parameter). A thousand variants of a model thus cost
+        little more memory than the model itself. The model's own dicts
+        are left as they are. Objects taken from the dicts are shared and
+        should not be changed directly.
+
+        Attributes
+        ----------
+        overrides : dict (optional)
+            New initial values of species and expressions (or values) of
+            parameters, {name: value}.
+        volume : float (optional)
+            New system volume.
+        tspan : numpy ndarray (optional)
+            New output times.
+        name : str (optional)
+            Name of the clone, by default that of the model.
+        """
+        clone = copy.copy(self)
+        for attribute in ('listOfSpecies', 'listOfParameters',
+                          'listOfReactions', 'listOfEvents',
+                          'listOfAssignmentRules', 'listOfRateRules'):
+            setattr(clone, attribute, _share(self, attribute, clone))
+        if name is not None:
+            clone.name = name
+        if volume is not None:
+            clone.volume = volume
+        if tspan is not None:
+            clone.timespan(tspan)
+        parameters = False
+        for key, value in (overrides or {}).items():
+            if key in clone.listOfSpecies:
+                clone.listOfSpecies[key] = Species(name=key,
+                                                   initial_value=value)
+            elif key in clone.listOfParameters:
+                clone.listOfParameters[key] = Parameter(name=key,
+                                                        expression=value)
+                parameters = True
+            else:
+                raise ModelError("No species or parameter named {0}".format(
+                                 key))
+        if parameters:
+            clone._set_parameter_values(clone.evaluate_parameters())
+        return clone
+
+    def __getstate__(self):
+        # The snapshots clones read the model's dicts through (see _share)
+        # belong to this process only, and code objects can not be pickled:
+        # the parameter evaluator (see gillespy.parameters) is made again
+        # when it is needed
+        state = self.__dict__.copy()
+        state.pop('_clone_bases', None)
+        state.pop('_parameter_evaluator', None)
+        return state
+
     def serialize(self):
         """ Serializes the Model object to valid StochML. """
         self.resolve_parameters()
@@ -263,6 +423,7 @@ class Model(object):
                 self.listOfParameters[params.name] = params
             else:
                 raise Exception("params should be of type `Parameter` and is instead of type {}".format(type(params)))
+        self.__dict__.pop('_parameter_evaluator', None)
         return params
 
     def delete_parameter(self, obj):
@@ -275,6 +436,7 @@ class Model(object):
             Name of the parameter object to be removed.
         """
         self.listOfParameters.pop(obj)
+        self.__dict__.pop('_parameter_evaluator', None)
 
     def set_parameter(self, pname, expression):
         """ 
@@ -287,27 +449,90 @@ class Model(object):
         expression : str
             *String* that may be executed in C, describing the value of the 
             parameter. May reference other parameters by name. (e.g. "k1*4")
+            The expressions allowed are listed in gillespy.parameters.
+
+        Only pname and the parameters whose expressions depend on it are
+        evaluated again. Parameters changed directly, rather than with the
+        Model methods, are resolved by resolve_parameters.
         """
         
-        p = self.listOfParameters[pname]
-        p.expression = expression
-        p.evaluate()
+        p = _own(self, 'listOfParameters', pname)
+        p.set_expression(expression)
+        from .parameters import update_parameter
+        values = update_parameter(self, pname)
+        if values is None:
+            self.resolve_parameters()
+            return
+        self._set_parameter_values(values)
+        for param, value in values.items():
+            if param in self.namespace:
+                self.namespace[param] = value
         
     def resolve_parameters(self):
         """ Internal function: 
         attempt to resolve all parameter expressions to scalar floats. 
-        This methods must be called before exporting the model. """
+        This methods must be called before exporting the model. Parameters
+        are resolved in dependency order, so an expression may refer to
+        parameters defined after it, see gillespy.parameters for the
+        expressions allowed. """
+        self._set_parameter_values(self.evaluate_parameters())
         self.update_namespace()
-        for param in self.listOfParameters:
-            try:
-                self.listOfParameters[param].evaluate(self.namespace)
-            except:
-                raise ParameterError("Could not resolve Parameter expression "
-                                        + param + "to a scalar value.")
+
+    def _set_parameter_values(self, values):
+        """ Sets the value of each Parameter object, {name: value}. """
+        params = self.listOfParameters
+        for param, value in values.items():
+            if isinstance(params, _TableDict) and not params.is_built(param):
+                continue
+            # Parameters shared with clones are only copied if they change
+            if params[param].value != value:
+                _own(self, 'listOfParameters', param).value = value
+
+    def freeze(self):
+        """
+        Returns an immutable snapshot of the model, compiled to arrays
+        (species indices, stoichiometry, rate constants and compiled
+        propensity functions; see gillespy.compiled.CompiledModel). The
+        native solvers simulate a snapshot in place of the model, and
+        threads can simulate the same snapshot at the same time, or send it
+        to other processes. Later changes to the model do not affect it.
+        """
+        from .compiled import compile_model
+        return compile_model(self).freeze()
+
+    def fingerprint(self):
+        """
+        Returns the canonical Fingerprint of the model: a digest of its
+        structure and of its parameters, initial values and volume, which
+        does not depend on the order of its dicts or the formatting of its
+        expressions (see gillespy.fingerprint). Only the species,
+        parameters and reactions changed since the last call are hashed
+        again.
+        """
+        from .fingerprint import fingerprint
+        return fingerprint(self)
+
+    def evaluate_parameters(self, values=None):
+        """
+        Returns the values of all parameters as an OrderedDict, without
+        modifying the Parameter objects. The expressions are compiled once
+        (see gillespy.parameters) and evaluated elementwise, so a batch of
+        parameter sets is resolved in one call.
+
+        Attributes
+        ----------
+        values : dict (optional)
+            Overrides the values of parameters, {name: value}. A value may
+            be an array, giving every parameter for each of its entries, 
+            e.g. {'k1': numpy.linspace(0.1, 1, 100)}.
+        """
+        from .parameters import compile_parameters
+        return compile_parameters(self)(values)
     
     def delete_all_parameters(self):
         """ Deletes all parameters from model. """
         self.listOfParameters.clear()
+        self.__dict__.pop('_parameter_evaluator', None)
 
     def add_reaction(self,reacs):
         """ 
@@ -334,22 +559,22 @@ class Model(object):
 
     def timespan(self, tspan):
         """ 
-        Set the time span of simulation. StochKit does not support non-uniform 
-        timespans.
+        Set the time span of simulation. The native solvers record the state
+        at any increasing, non-negative list of times; StochKit does not 
+        support non-uniform timespans.
         
         tspan : numpy ndarray
-            Evenly-spaced list of times at which to sample the species 
+            Increasing list of times at which to sample the species 
             populations during the simulation.
         """
         
-        items = numpy.diff(tspan)
-        items = [round(x, 10) for x in items]
-        isuniform = (len(set(items)) == 1)
-        
-        if isuniform:
-            self.tspan = tspan
-        else:
-            raise InvalidModelError("StochKit only supports uniform timespans")
+        times = numpy.asarray(tspan, dtype=float)
+        if times.ndim != 1 or len(times) == 0:
+            raise InvalidModelError("tspan must be a non-empty list of times")
+        if times[0] < 0 or numpy.any(numpy.diff(times) <= 0):
+            raise InvalidModelError("tspan must be increasing and "
+                                    "non-negative")
+        self.tspan = tspan
 
     def get_reaction(self, rname):
         return self.listOfReactions[rname]
@@ -363,8 +588,64 @@ class Model(object):
     def delete_all_reactions(self):
         self.listOfReactions.clear()
 
+    def add_event(self, obj):
+        """
+        Adds an event, or list of events to the model.
+        
+        Attributes
+        ----------
+        obj : Event, or list of Events
+            The event or list of events to be added to the model object.
+        """
+        for e in (obj if isinstance(obj, list) else [obj]):
+            if not isinstance(e, Event):
+                raise ModelError("obj should be of type `Event` and is "
+                                 "instead of type {}".format(type(e)))
+            self.listOfEvents[e.name] = e
+        return obj
+
+    def delete_event(self, obj):
+        """ Removes an event object by name. """
+        self.listOfEvents.pop(obj)
+
+    def add_rule(self, obj):
+        """
+        Adds an assignment or rate rule, or list of rules, to the model. A
+        variable may only be the target of one rule.
+        
+        Attributes
+        ----------
+        obj : AssignmentRule or RateRule, or list of rules
+            The rule or list of rules to be added to the model object.
+        """
+        for r in (obj if isinstance(obj, list) else [obj]):
+            if isinstance(r, AssignmentRule):
+                rules = self.listOfAssignmentRules
+            elif isinstance(r, RateRule):
+                rules = self.listOfRateRules
+            else:
+                raise ModelError("obj should be of type `AssignmentRule` or "
+                        "`RateRule` and is instead of type {}".format(type(r)))
+            if (r.variable in self.listOfAssignmentRules or
+                    r.variable in self.listOfRateRules):
+                raise ModelError("Can't add rule. '{0}' is already the "
+                                 "target of a rule.".format(r.variable))
+            rules[r.variable] = r
+        return obj
+
+    def delete_rule(self, variable):
+        """ Removes the rule for the named variable. """
+        if variable in self.listOfAssignmentRules:
+            self.listOfAssignmentRules.pop(variable)
+        else:
+            self.listOfRateRules.pop(variable)
+
     def run(self, number_of_trajectories=1, seed=None, 
-                  solver=None, stochkit_home=None, debug=False, show_labels=True):
+                  solver=None, stochkit_home=None, debug=False, show_labels=True,
+                  steady_state=None, precision=None, phase_callback=None,
+                  profile=False, progress=None, progress_interval=1.0,
+                  checkpoint=None, checkpoint_interval=60.0, resume_from=None,
+                  initial_state=None, timeout=None):
         """
         Function calling simulation of the model. There are a number of       
         parameters to be set here.
@@ -379,8 +660,15 @@ class Model(object):
             The random seed for the simulation. Optional, defaults to None.
         solver : gillespy.GillesPySolver
             The solver by which to simulate the model. This solver object may
-            be initialized separately to specify an algorithm. Optional, 
-            defulats to StochKitSolver SSA.
+            be initialized separately to specify an algorithm. Optional,
+            defaults to the preferred available exact stochastic backend
+            for the model (see backends.py): StochKit SSA if it is installed
+            and supports the model, else NumPySSASolver. The backend is
+            recorded in results.metadata['backend']. With 'auto' the method
+            (SSA, tau-leaping or ODE) is chosen from an analysis of the
+            model's population sizes and reaction time scales, and the
+            decision and its reason are recorded in
+            results.metadata['solver_selection'].
         stochkit_home : str
             Path to stochkit. This is set automatically upon installation, but 
             may be overwritten if desired.
@@ -389,25 +677,162 @@ class Model(object):
             simulation.
         show_labels : bool (True)
             Use names of species as index of result object rather than position numbers.
+        steady_state : gillespy.SteadyState
+            If given, the simulation stops once the criterion is met and the
+            results are truncated there; the stop time is recorded in
+            results.metadata. Only supported by the native solvers.
+        precision : gillespy.Precision
+            If given, number_of_trajectories is ignored and trajectories are
+            run in parallel batches until the ensemble mean reaches the target
+            precision. The number of trajectories used and the precision
+            achieved are recorded in results.metadata.
+        phase_callback : callable
+            Called as phase_callback(name, seconds, nbytes) at the end of each
+            phase of the run (serialize, launch, simulate, parse, ...). The
+            phases are also recorded in results.metadata['phases']. With
+            precision it is called for the phases of every batch.
+        profile : bool or str
+            If set, the Python side of the run is profiled with cProfile and
+            the statistics are written to this file (a temporary file if
+            True), whose path is recorded in results.metadata['profile'].
+        progress : callable
+            Called as progress(p) with a gillespy.ensemble.Progress at most
+            every progress_interval seconds: trajectories completed,
+            simulated time reached and event rate, and p.statistics() for
+            the ensemble statistics so far. Returning False aborts the run,
+            which returns the partial results with
+            results.metadata['aborted'] set.
+        progress_interval : float
+            Minimum time in seconds between progress calls.
+        checkpoint : str
+            File to save a checkpoint of the run to, at most every
+            checkpoint_interval seconds and at the end. Only supported by
+            NumPySSASolver.
+        checkpoint_interval : float
+            Minimum time in seconds between checkpoints.
+        resume_from : str or gillespy.checkpoint.Checkpoint
+            Continue the run saved in a checkpoint, with its output times,
+            seed and trajectories. The results are the same as if the run
+            had not stopped.
+        initial_state : Results, Checkpoint or array
+            Start from the end state of an earlier run of the model (warm
+            start), with time restarting at 0. Only supported by the native
+            solvers, and not with precision.
+        timeout : float
+            Wall time in seconds after which the run is stopped (the
+            solver executable killed) and a SimulationError raised. Only
+            supported by the StochKit solvers, NumPySSASolver and
+            SciPyODESolver, so the default and 'auto' solvers are chosen
+            among them. With precision, each batch of trajectories is
+            limited.
         """
-        if solver is not None:
-            if issubclass(solver, GillesPySolver):
-                return solver.run(self, t=self.tspan[-1], 
-                            increment=self.tspan[-1]-self.tspan[-2],
-                            seed=seed, 
-                            number_of_trajectories=number_of_trajectories,
-                            stochkit_home=stochkit_home, debug=debug,
-                            show_labels=show_labels)
-            else:
-                raise SimulationError(
-                        "argument 'solver' to run() must be"+
-                                    " a subclass of GillesPySolver")
-        else:
-            return StochKitSolver.run(self,t=self.tspan[-1],
-                    increment=self.tspan[-1]-self.tspan[-2], seed=seed,
-                    number_of_trajectories=number_of_trajectories,
-                    stochkit_home=stochkit_home, debug=debug,
-                    show_labels=show_labels)
+        if profile:
+            from .timing import profiled
+            return profiled(profile, self.run, number_of_trajectories, seed,
+                            solver, stochkit_home, debug, show_labels,
+                            steady_state, precision, phase_callback,
+                            progress=progress,
+                            progress_interval=progress_interval,
+                            checkpoint=checkpoint,
+                            checkpoint_interval=checkpoint_interval,
+                            resume_from=resume_from,
+                            initial_state=initial_state, timeout=timeout)
+        increment = None
+        if len(self.tspan) > 1:
+            increment = self.tspan[-1]-self.tspan[-2]
+        # A timeout rules out the solvers that can not enforce one
+        timeouts = timeout is not None
+        if precision is not None:
+            if steady_state is not None:
+                raise SimulationError("A run can not both stop at steady "
+                                      "state and run to a precision")
+            if checkpoint is not None or resume_from is not None:
+                raise SimulationError("A run to a precision can not be "
+                                      "checkpointed")
+            if initial_state is not None:
+                raise SimulationError("A run to a precision can not start "
+                                      "from an initial state")
+            options = {}
+            if solver is None:
+                from .backends import select_backend
+                solver = select_backend(self, stochkit_home=stochkit_home,
+                                        timeouts=timeouts).solver
+            elif solver == 'auto':
+                from .backends import choose_backend
+                backend, _ = choose_backend(self, stochastic_only=True,
+                                            stochkit_home=stochkit_home,
+                                            timeouts=timeouts)
+                solver = backend.solver
+                if backend.algorithm is not None:
+                    options['algorithm'] = backend.algorithm
+            if timeout is not None:
+                if not getattr(solver, 'timeouts', False):
+                    raise SimulationError("Only the StochKit, NumPy SSA "
+                                          "and SciPy ODE solvers take a "
+                                          "timeout")
+                options['timeout'] = timeout
+            from .ensemble import run_to_precision
+            return run_to_precision(self, solver, precision, seed=seed,
+                                    show_labels=show_labels,
+                                    progress=progress,
+                                    t=self.tspan[-1], increment=increment,
+                                    tspan=self.tspan,
+                                    stochkit_home=stochkit_home, debug=debug,
+                                    phase_callback=phase_callback, **options)
+        backend = decision = None
+        # Features of the native solvers rule out StochKit
+        external = steady_state is None and checkpoint is None and \
+            resume_from is None and initial_state is None
+        if solver is None:
+            from .backends import select_backend
+            backend = select_backend(self, stochkit_home=stochkit_home,
+                                     external=external, timeouts=timeouts)
+            solver = backend.solver
+        elif solver == 'auto':
+            from .backends import choose_backend
+            backend, decision = choose_backend(self,
+                                               stochkit_home=stochkit_home,
+                                               external=external,
+                                               timeouts=timeouts)
+            solver = backend.solver
+        elif not (isinstance(solver, type) and
+                  issubclass(solver, GillesPySolver)):
+            raise SimulationError(
+                    "argument 'solver' to run() must be"+
+                                " a subclass of GillesPySolver")
+        options = {}
+        if steady_state is not None:
+            options['steady_state'] = steady_state
+        if phase_callback is not None:
+            options['phase_callback'] = phase_callback
+        if progress is not None:
+            options.update(progress=progress,
+                           progress_interval=progress_interval)
+        if checkpoint is not None or resume_from is not None:
+            if not getattr(solver, 'checkpoints', False):
+                raise SimulationError("Only NumPySSASolver runs can be "
+                                      "checkpointed and resumed")
+            options.update(checkpoint=checkpoint,
+                           checkpoint_interval=checkpoint_interval,
+                           resume_from=resume_from)
+        if initial_state is not None:
+            if not getattr(solver, 'warm_start', False):
+                raise SimulationError("Only the native solvers can start "
+                                      "from an initial state")
+            options['initial_state'] = initial_state
+        if timeout is not None:
+            if not getattr(solver, 'timeouts', False):
+                raise SimulationError("Only the StochKit, NumPy SSA and "
+                                      "SciPy ODE solvers take a timeout")
+            options['timeout'] = timeout
+        run = solver.run if backend is None else backend.run
+        results = run(self, t=self.tspan[-1], increment=increment, seed=seed,
+                      number_of_trajectories=number_of_trajectories,
+                      stochkit_home=stochkit_home, debug=debug,
+                      show_labels=show_labels, tspan=self.tspan, **options)
+        if decision is not None:
+            results.metadata['solver_selection'] = decision
+        return results
 
 
 class Species(object):
@@ -422,13 +847,19 @@ class Species(object):
         the model.
     initial_value : int >= 0
         Initial population of this species. If this is not provided as an int,
-        the type will be changed when it is added by numpy.int
+        the type will be changed when it is added by int
     """
+
+    # Large models hold many of these: the attributes are slots, and the
+    # __dict__ is only created for others set on a species (e.g. a
+    # description). The fingerprint digests are cached, see
+    # gillespy.fingerprint
+    __slots__ = ('name', 'initial_value', '_fingerprint', '__dict__')
     
     def __init__(self, name="", initial_value=0):
         # A species has a name (string) and an initial value (positive integer)
         self.name = name
-        self.initial_value = np.int(initial_value)
+        self.initial_value = int(initial_value)
         assert self.initial_value >= 0, "A species initial value has to \
                                         be a positive number."
 
@@ -450,6 +881,8 @@ class Parameter():
         Value of a parameter if it is not dependent on other Model entities.
     """
 
+    __slots__ = ('name', 'expression', 'value', '_fingerprint', '__dict__')
+
     def __init__(self, name="", expression=None, value=None):
 
         self.name = name        
@@ -542,6 +975,10 @@ class Reaction():
     must be scaled by the volume prior to being added for unit consistency.
     """
 
+    __slots__ = ('name', 'annotation', 'massaction', 'propensity_function',
+                 'reactants', 'products', 'type', 'marate', '_fingerprint',
+                 '__dict__')
+
     def __init__(self, name = "", reactants = {}, products = {}, 
                  propensity_function = None, massaction = False, 
                  rate=None, annotation=None):
@@ -601,37 +1038,8 @@ class Reaction():
         Initializes the mass action propensity function given
         self.reactants and a single parameter value.
         """
-        # We support zeroth, first and second order propensities only.
-        # There is no theoretical justification for higher order propensities.
-        # Users can still create such propensities if they really want to,
-        # but should then use a custom propensity.
-        total_stoch=0
-        for r in self.reactants:
-            total_stoch+=self.reactants[r]
-        if total_stoch>2:
-            raise ReactionError("Reaction: A mass-action reaction cannot \
-            involve more than two of one species or one of two species.")
-        # Case EmptySet -> Y
-        propensity_function = self.marate.name;
-             
-        # There are only three ways to get 'total_stoch==2':
-        for r in self.reactants:
-            # Case 1: 2X -> Y
-            if self.reactants[r] == 2:
-                propensity_function = ("0.5*" +propensity_function+ 
-                                            "*"+r+"*("+r+"-1)/vol")
-            else:
-            # Case 3: X1, X2 -> Y;
-                propensity_function += "*"+r
-
-        # Set the volume dependency based on order.
-        order = len(self.reactants)
-        if order == 2:
-            propensity_function += "/vol"
-        elif order == 0:
-            propensity_function += "*vol"
-
-        self.propensity_function = propensity_function
+        self.propensity_function = _mass_action_propensity(self.reactants,
+                                                           self.marate.name)
             
     def setType(self, rxntype):
         """
@@ -691,6 +1099,644 @@ class Reaction():
 
 
 
+def _mass_action_propensity(reactants, rate):
+    """
+    The propensity function of a mass-action reaction with the reactants
+    ({species name: stoichiometry}) and the rate parameter named rate.
+    """
+    # We support zeroth, first and second order propensities only.
+    # There is no theoretical justification for higher order propensities.
+    # Users can still create such propensities if they really want to,
+    # but should then use a custom propensity.
+    total_stoch=0
+    for r in reactants:
+        total_stoch+=reactants[r]
+    if total_stoch>2:
+        raise ReactionError("Reaction: A mass-action reaction cannot \
+        involve more than two of one species or one of two species.")
+    # Case EmptySet -> Y
+    propensity_function = rate
+         
+    # There are only three ways to get 'total_stoch==2':
+    for r in reactants:
+        # Case 1: 2X -> Y
+        if reactants[r] == 2:
+            propensity_function = ("0.5*" +propensity_function+ 
+                                        "*"+r+"*("+r+"-1)/vol")
+        else:
+        # Case 3: X1, X2 -> Y;
+            propensity_function += "*"+r
+
+    # Set the volume dependency based on order.
+    order = len(reactants)
+    if order == 2:
+        propensity_function += "/vol"
+    elif order == 0:
+        propensity_function += "*vol"
+    return propensity_function
+
+
+def _variable_name(variable):
+    """ Name of a Species or Parameter, or the string itself. """
+    if isinstance(variable, (Species, Parameter)):
+        return variable.name
+    return str(variable)
+
+
+class Event(object):
+    """
+    A discrete change of the model state, executed whenever the trigger
+    expression changes from false to true.
+
+    Attributes
+    ----------
+    name : str
+        The name of the event.
+    trigger : str
+        Boolean expression in the namespace of the model (species,
+        parameters, 'vol' and the time 't'), e.g. "t >= 5" or "A > 100".
+    assignments : dict
+        Maps each variable (Species, Parameter, or their names) to the
+        expression of its new value. All expressions are evaluated before
+        any of the variables is changed.
+    initial_value : bool (False)
+        Value of the trigger before the simulation starts. If False, an
+        event whose trigger is true at time 0 is executed at time 0.
+    annotation : str
+        An optional note about the event.
+    """
+
+    def __init__(self, name="", trigger=None, assignments=None,
+                 initial_value=False, annotation=None):
+        if trigger is None:
+            raise ModelError("Event {0}: a trigger is required".format(name))
+        self.name = name
+        self.trigger = str(trigger)
+        self.assignments = OrderedDict()
+        for variable, expression in (assignments or {}).items():
+            self.assignments[_variable_name(variable)] = str(expression)
+        self.initial_value = bool(initial_value)
+        self.annotation = annotation
+
+
+class AssignmentRule(object):
+    """
+    Defines a variable by an expression that holds at all times, e.g. a
+    parameter that depends on species. Native solvers substitute the rule
+    into every expression that uses the variable.
+
+    Attributes
+    ----------
+    variable : Species, Parameter or str
+        The variable the rule assigns.
+    expression : str
+        Expression in the namespace of the model.
+    """
+
+    def __init__(self, variable, expression):
+        self.variable = _variable_name(variable)
+        self.name = self.variable
+        self.expression = str(expression)
+
+
+class RateRule(object):
+    """
+    Defines the time derivative of a variable, d(variable)/dt = expression.
+    Integrated exactly by ODE solvers and by forward Euler over each step
+    of stochastic solvers.
+
+    Attributes
+    ----------
+    variable : Species, Parameter or str
+        The variable the rule changes.
+    expression : str
+        Expression in the namespace of the model.
+    """
+
+    def __init__(self, variable, expression):
+        self.variable = _variable_name(variable)
+        self.name = self.variable
+        self.expression = str(expression)
+
+
+class _ReactionTable(object):
+    """
+    Column-compressed reactant and product stoichiometry, rates and names
+    of the reactions of a mass-action model, as built by
+    Model.from_arrays. The reactions and their rate parameters k_<index>
+    are not stored as objects; see _TableDict.
+    """
+
+    def __init__(self, species_names, stoichiometry, rates, orders=None,
+                 reactants=None, reaction_names=None):
+        self.species_names = [str(s) for s in species_names]
+        self.rates = numpy.asarray(rates, dtype=float).ravel()
+        nr = self.size = len(self.rates)
+        shape = (len(self.species_names), nr)
+
+        if hasattr(stoichiometry, 'tocsc'):
+            net = stoichiometry.tocsc()
+        else:
+            net = numpy.asarray(stoichiometry)
+        if net.shape != shape:
+            raise ModelError("stoichiometry must have shape (species, "
+                             "reactions) = {0}, got {1}".format(shape,
+                                                                net.shape))
+        if reactants is None:
+            consumed = (-net).maximum(0) if hasattr(net, 'tocsc') \
+                else numpy.maximum(-net, 0)
+        elif hasattr(reactants, 'tocsc'):
+            consumed = reactants.tocsc()
+        else:
+            consumed = numpy.asarray(reactants)
+        if consumed.shape != shape:
+            raise ModelError("reactants must have the same shape as "
+                             "stoichiometry")
+        produced = consumed + net
+
+        self.reactants = self._compress(consumed)
+        self.products = self._compress(produced)
+        if numpy.any(self.reactants[2] < 0) or numpy.any(self.products[2] < 0):
+            raise ReactionError("Reaction Stoichiometry must be a "
+                                "positive integer.")
+
+        indptr, _, data = self.reactants
+        total = numpy.concatenate([[0], numpy.cumsum(data)])
+        self.orders = (total[indptr[1:]] - total[indptr[:-1]]).astype(int)
+        if orders is not None:
+            orders = numpy.asarray(orders, dtype=int).ravel()
+            if len(orders) != nr or numpy.any(orders != self.orders):
+                raise ReactionError("Reaction orders do not match the "
+                                    "reactant stoichiometry.")
+        if nr and self.orders.max() > 2:
+            raise ReactionError("Reaction: A mass-action reaction cannot "
+                "involve more than two of one species or one of two species.")
+
+        # Names are kept in an array, sorted for lookups; the default names
+        # R<index> are not stored at all
+        self.names = None
+        if reaction_names is not None:
+            self.names = numpy.array([str(r) for r in reaction_names])
+            if len(self.names) != nr:
+                raise ModelError("reaction_names must have one entry per "
+                                 "reaction")
+            self._sorted = numpy.argsort(self.names, kind='mergesort')
+            ordered = self.names[self._sorted]
+            if nr > 1 and numpy.any(ordered[1:] == ordered[:-1]):
+                raise ModelError("reaction_names must be unique")
+
+    @staticmethod
+    def _compress(matrix):
+        """ (indptr, indices, data) of a matrix in column-major order. """
+        if hasattr(matrix, 'tocsc'):
+            matrix = matrix.tocsc()
+            matrix.eliminate_zeros()
+            matrix.sort_indices()
+            return (matrix.indptr, matrix.indices,
+                    numpy.asarray(matrix.data).astype(int))
+        cols, rows = numpy.nonzero(matrix.T)
+        indptr = numpy.searchsorted(cols, numpy.arange(matrix.shape[1]+1))
+        return indptr, rows, matrix[rows, cols].astype(int)
+
+    def _column(self, compressed, j):
+        indptr, indices, data = compressed
+        lo, hi = indptr[j], indptr[j+1]
+        return dict(zip([self.species_names[i] for i in indices[lo:hi]],
+                        data[lo:hi].tolist()))
+
+    @staticmethod
+    def _generated_index(name, prefix, size):
+        """ j if name is prefix + str(j) for a reaction j, else None. """
+        if not isinstance(name, str) or not name.startswith(prefix):
+            return None
+        digits = name[len(prefix):]
+        if not digits.isdigit() or str(int(digits)) != digits:
+            return None
+        j = int(digits)
+        return j if j < size else None
+
+    def reaction_name(self, j):
+        if self.names is None:
+            return 'R{0}'.format(j)
+        return str(self.names[j])
+
+    def reaction_index(self, name):
+        """ The index of the reaction with the given name, or None. """
+        if self.names is None:
+            return self._generated_index(name, 'R', self.size)
+        ordered = self.names[self._sorted]
+        i = numpy.searchsorted(ordered, str(name))
+        if i < self.size and ordered[i] == str(name):
+            return int(self._sorted[i])
+        return None
+
+    def parameter_name(self, j):
+        return 'k_{0}'.format(j)
+
+    def parameter_index(self, name):
+        """ The index of the reaction of the rate parameter name, or None. """
+        return self._generated_index(name, 'k_', self.size)
+
+
+class _TableDict(MutableMapping):
+    """
+    Ordered dict of the reactions (or of the rate parameters) of a model
+    built by Model.from_arrays. The entries of the table are not stored:
+    looking one up returns a view of its column of the table (see
+    _TableReaction and _TableParameter), which is only kept once it is
+    changed. Other entries are stored as in a dict, after those of the
+    table.
+    """
+
+    def __init__(self, table, parameters=False, model=None):
+        self._table = table
+        self._parameters = parameters
+        self._model = model
+        self._size = table.size
+        self._stored = OrderedDict()
+        self._deleted = set()
+        # Stored objects that are not shared with a clone of the model
+        self._owned = set()
+
+    def _name(self, j):
+        if self._parameters:
+            return self._table.parameter_name(j)
+        return self._table.reaction_name(j)
+
+    def table_index(self, key):
+        """ The index in the table of entry key, or None. """
+        if self._parameters:
+            j = self._table.parameter_index(key)
+        else:
+            j = self._table.reaction_index(key)
+        if j is None or j >= self._size or j in self._deleted:
+            return None
+        return j
+
+    def __getitem__(self, key):
+        if key in self._stored:
+            return self._stored[key]
+        j = self.table_index(key)
+        if j is None:
+            raise KeyError(key)
+        if self._parameters:
+            return _TableParameter(self, j)
+        return _TableReaction(self, j)
+
+    def __delitem__(self, key):
+        j = self.table_index(key)
+        if key in self._stored:
+            del self._stored[key]
+        elif j is None:
+            raise KeyError(key)
+        if j is not None:
+            self._deleted.add(j)
+
+    def __iter__(self):
+        for j in range(self._size):
+            if j not in self._deleted:
+                yield self._name(j)
+        for key in list(self._stored):
+            if self.table_index(key) is None:
+                yield key
+
+    def __len__(self):
+        extra = sum(1 for key in self._stored if self.table_index(key) is None)
+        return self._size - len(self._deleted) + extra
+
+    def __contains__(self, key):
+        return key in self._stored or self.table_index(key) is not None
+
+    def clear(self):
+        self._stored.clear()
+        self._deleted.clear()
+        self._owned.clear()
+        self._size = 0
+
+    def is_built(self, key):
+        """ True if entry key is stored, rather than read from the table. """
+        return key in self._stored
+
+    def __setitem__(self, key, value):
+        self._stored[key] = value
+        self._owned.discard(key)
+
+    def _keep(self, view):
+        """ Stores a view that has been changed, unless it is stale. """
+        key = self._name(view._index)
+        if key not in self._stored and self.table_index(key) is not None:
+            self._stored[key] = view
+            self._owned.add(key)
+
+    def own(self, key):
+        """
+        The value of key, copied first if it is shared with a clone of the
+        model, so that it can be changed.
+        """
+        if key not in self._owned:
+            value = self[key]
+            if key in self._stored:
+                value = copy.copy(value)
+                if isinstance(value, _TableView):
+                    value._container = self
+            self._stored[key] = value
+            self._owned.add(key)
+        return self._stored[key]
+
+    def share(self, model=None):
+        """
+        A copy for a clone of the model, sharing the table; the stored
+        objects are shared by both until either changes them (see own).
+        Views of the table are copied, they belong to their model.
+        """
+        other = copy.copy(self)
+        other._model = model
+        other._stored = OrderedDict()
+        for key, value in self._stored.items():
+            if isinstance(value, _TableView) and key in self._owned:
+                value = copy.copy(value)
+                value._container = other
+            else:
+                self._owned.discard(key)
+            other._stored[key] = value
+        other._owned = set(key for key in self._owned)
+        other._deleted = set(self._deleted)
+        return other
+
+
+class _Overlay(MutableMapping):
+    """
+    Ordered dict of the species, parameters, reactions, events or rules of
+    a cloned model (see Model.clone): a base dict shared with the other
+    clones, which is never changed, and the entries this model has set or
+    deleted. A clone thus takes memory only for what it changes.
+    """
+
+    def __init__(self, base):
+        self._base = base
+        self._changes = OrderedDict()
+        self._deleted = set()
+        # Changed objects that are not shared with a clone of the model
+        self._owned = set()
+
+    def __getitem__(self, key):
+        if key in self._changes:
+            return self._changes[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        return self._base[key]
+
+    def __setitem__(self, key, value):
+        self._changes[key] = value
+        self._owned.discard(key)
+
+    def __delitem__(self, key):
+        if key in self._changes:
+            del self._changes[key]
+        elif key not in self._base or key in self._deleted:
+            raise KeyError(key)
+        if key in self._base:
+            self._deleted.add(key)
+
+    def __iter__(self):
+        # Entries deleted from the base and set again come last, as in a dict
+        for key in self._base:
+            if key not in self._deleted:
+                yield key
+        for key in list(self._changes):
+            if key in self._deleted or key not in self._base:
+                yield key
+
+    def __len__(self):
+        extra = sum(1 for key in self._changes
+                    if key in self._deleted or key not in self._base)
+        return len(self._base) - len(self._deleted) + extra
+
+    def __contains__(self, key):
+        return key in self._changes or \
+            (key in self._base and key not in self._deleted)
+
+    def clear(self):
+        self._base = OrderedDict()
+        self._changes.clear()
+        self._deleted.clear()
+        self._owned.clear()
+
+    def own(self, key):
+        """
+        The value of key, copied first if it is shared with a clone of the
+        model, so that it can be changed.
+        """
+        if key not in self._owned:
+            self._changes[key] = copy.copy(self[key])
+            self._owned.add(key)
+        return self._changes[key]
+
+    def share(self, model=None):
+        """
+        A copy for a clone of the model, sharing the base; the objects are
+        shared by both until either changes them (see own).
+        """
+        other = copy.copy(self)
+        other._changes = OrderedDict(self._changes)
+        other._deleted = set(self._deleted)
+        other._owned = set()
+        self._owned.clear()
+        return other
+
+
+def _share(model, attribute, clone):
+    """
+    The dict attribute of clone, a clone of model, sharing the entries of
+    the model's dict. A plain dict of the model is left as it is: the
+    clone reads through a snapshot of it, which all clones taken while the
+    dict is unchanged share.
+    """
+    mapping = getattr(model, attribute)
+    if isinstance(mapping, (_Overlay, _TableDict)):
+        return mapping.share(clone)
+    bases = model.__dict__.setdefault('_clone_bases', {})
+    base = bases.get(attribute)
+    if base is None or len(base) != len(mapping) or \
+            any(k is not j or v is not w for (k, v), (j, w) in
+                zip(base.items(), mapping.items())):
+        base = bases[attribute] = OrderedDict(mapping)
+    return _Overlay(base)
+
+
+def _own(model, attribute, key):
+    """
+    The value of key in the dict attribute of model, copied first if it is
+    shared with a clone, so that it can be changed.
+    """
+    mapping = getattr(model, attribute)
+    if isinstance(mapping, (_Overlay, _TableDict)):
+        return mapping.own(key)
+    value = mapping[key]
+    base = model.__dict__.get('_clone_bases', {}).get(attribute)
+    if base is not None and base.get(key) is value:
+        # Clones read it through the snapshot of the dict
+        value = mapping[key] = copy.copy(value)
+    return value
+
+
+def _table_attribute(cls, name, default):
+    """
+    Attribute name of a view over a _ReactionTable, a subclass of cls: the
+    value set on the view, else default(view), read from the table. Once
+    an attribute is set the view is kept by its _TableDict.
+    """
+    slot = cls.__dict__[name]
+
+    def get(self):
+        try:
+            return slot.__get__(self, cls)
+        except AttributeError:
+            return default(self)
+
+    def set(self, value):
+        slot.__set__(self, value)
+        self._container._keep(self)
+    return property(get, set)
+
+
+class _TableView(object):
+    """
+    Pickling of the views over a _ReactionTable: only the attributes set
+    on a view are stored, not those read from the table.
+    """
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        # An attribute the classes do not declare goes to the __dict__ of
+        # the view, which is kept like a view with a changed attribute
+        if not hasattr(type(self), name):
+            self._container._keep(self)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name == '__dict__':
+                    continue
+                try:
+                    state[name] = cls.__dict__[name].__get__(self, cls)
+                except AttributeError:
+                    pass
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name in state and name != '__dict__':
+                    cls.__dict__[name].__set__(self, state.pop(name))
+        self.__dict__.update(state)
+
+
+class _TableParameter(_TableView, Parameter):
+    """
+    Rate Parameter k_<index> of a model built by Model.from_arrays, a view
+    of its entry of the rate array until its expression or value is set.
+    """
+
+    __slots__ = ('_container', '_index')
+
+    def __init__(self, container, index):
+        self._container = container
+        self._index = index
+
+    def _rate(self):
+        return float(self._container._table.rates[self._index])
+
+    name = _table_attribute(Parameter, 'name',
+        lambda p: p._container._table.parameter_name(p._index))
+    expression = _table_attribute(Parameter, 'expression',
+                                  lambda p: repr(p._rate()))
+    value = _table_attribute(Parameter, 'value', _rate)
+
+
+class _Stoichiometry(MutableMapping):
+    """
+    The reactants or products of a _TableReaction, read from the column of
+    the table. A change copies them to a dict set on the reaction.
+    """
+
+    __slots__ = ('_reaction', '_name')
+
+    def __init__(self, reaction, name):
+        self._reaction = reaction
+        self._name = name
+
+    def _mapping(self, copy=False):
+        reaction = self._reaction
+        try:
+            return Reaction.__dict__[self._name].__get__(reaction, Reaction)
+        except AttributeError:
+            table = reaction._container._table
+            column = table._column(getattr(table, self._name),
+                                   reaction._index)
+            if copy:
+                setattr(reaction, self._name, column)
+            return column
+
+    def __getitem__(self, key):
+        return self._mapping()[key]
+
+    def __setitem__(self, key, value):
+        self._mapping(copy=True)[key] = value
+
+    def __delitem__(self, key):
+        del self._mapping(copy=True)[key]
+
+    def __iter__(self):
+        return iter(self._mapping())
+
+    def __len__(self):
+        return len(self._mapping())
+
+    def __repr__(self):
+        return repr(self._mapping())
+
+
+class _TableReaction(_TableView, Reaction):
+    """
+    Mass-action Reaction of a model built by Model.from_arrays, a view of
+    its column of the reaction table that holds no data of its own until
+    an attribute is set. Its rate is the parameter k_<index> of the model.
+    """
+
+    __slots__ = ('_container', '_index')
+
+    def __init__(self, container, index):
+        self._container = container
+        self._index = index
+
+    def _rate(self):
+        table, model = self._container._table, self._container._model
+        pname = table.parameter_name(self._index)
+        if pname in model.listOfParameters:
+            return model.listOfParameters[pname]
+        return Parameter(name=pname, expression=repr(float(
+            table.rates[self._index])))
+
+    name = _table_attribute(Reaction, 'name',
+        lambda r: r._container._table.reaction_name(r._index))
+    annotation = _table_attribute(Reaction, 'annotation', lambda r: "")
+    massaction = _table_attribute(Reaction, 'massaction', lambda r: True)
+    type = _table_attribute(Reaction, 'type', lambda r: "mass-action")
+    marate = _table_attribute(Reaction, 'marate', _rate)
+    reactants = _table_attribute(Reaction, 'reactants',
+                                 lambda r: _Stoichiometry(r, 'reactants'))
+    products = _table_attribute(Reaction, 'products',
+                                lambda r: _Stoichiometry(r, 'products'))
+    propensity_function = _table_attribute(
+        Reaction, 'propensity_function',
+        lambda r: _mass_action_propensity(r.reactants, r.marate.name))
+
+
 # Module exceptions
 class ModelError(Exception):
     pass
@@ -980,6 +2026,7 @@ class StochMLDocument():
         except:
             # Hack to print pretty xml without pretty-print 
             # (requires the lxml module).
+            import xml.dom.minidom
             doc = etree.tostring(self.document)
             xmldoc = xml.dom.minidom.parseString(doc)
             uglyXml = xmldoc.toprettyxml(indent='  ')
@@ -1065,6 +2112,135 @@ class StochMLDocument():
         return e
 
 
+class Results(list):
+    """
+    The trajectories returned by a solver, a list with information about
+    the run in the dict metadata, for example the time at which a run
+    stopped at steady state.
+    """
+
+    def __init__(self, trajectories=(), **metadata):
+        list.__init__(self, trajectories)
+        self.metadata = metadata
+
+
+class SteadyState(object):
+    """
+    Convergence criterion to stop a simulation once it has settled. The
+    ensemble mean (and standard deviation, for more than one trajectory) of
+    the selected species are computed at each output time; steady state is
+    reached when neither changes by more than atol + rtol * |mean| over the
+    last window output times.
+
+    Attributes
+    ----------
+    window : int
+        Number of output times over which the statistics must be constant.
+    rtol : float
+        Relative tolerance of the change.
+    atol : float
+        Absolute tolerance of the change.
+    species : list of str
+        The species to check. Defaults to all species.
+    """
+
+    def __init__(self, window=10, rtol=1e-2, atol=1e-6, species=None):
+        if window < 2:
+            raise ValueError("The steady state window must be at least 2 "
+                             "output times")
+        self.window = int(window)
+        self.rtol = rtol
+        self.atol = atol
+        self.species = species
+
+    def reached(self, data, columns):
+        """
+        Whether steady state is reached, given the state of the ensemble at
+        the output times so far, an array of shape (trajectories, times,
+        state), and the state columns to check.
+        """
+        if data.shape[1] < self.window:
+            return False
+        recent = data[:, -self.window:, columns]
+        mean = recent.mean(axis=0)
+        statistics = [mean]
+        if data.shape[0] > 1:
+            statistics.append(recent.std(axis=0))
+        tolerance = self.atol + self.rtol * numpy.abs(mean).max(axis=0)
+        for values in statistics:
+            change = values.max(axis=0) - values.min(axis=0)
+            if numpy.any(change > tolerance):
+                return False
+        return True
+
+
+class Precision(object):
+    """
+    Target precision of the ensemble mean, to run as many trajectories as
+    needed rather than a fixed number. The ensemble grows in batches, run in
+    parallel, until the confidence interval of the mean of every selected
+    species at every selected time is narrower than width.
+
+    Attributes
+    ----------
+    width : float
+        Target (full) width of the confidence interval of the mean.
+    confidence : float
+        Confidence level of the interval. Defaults to 0.95.
+    relative : bool (False)
+        If True, width is relative to the magnitude of the mean.
+    species : list of str
+        The species to check. Defaults to all species.
+    times : list of float
+        The times to check, each rounded to the nearest output time.
+        Defaults to all output times.
+    batch_size : int
+        Number of trajectories per batch.
+    max_trajectories : int
+        The ensemble never grows beyond this size, even if the target is
+        not met.
+    processes : int
+        Number of worker processes. Defaults to the number of CPUs; 1 runs
+        the batches in this process.
+    """
+
+    def __init__(self, width, confidence=0.95, relative=False, species=None,
+                 times=None, batch_size=100, max_trajectories=100000,
+                 processes=None):
+        if width <= 0 or not 0 < confidence < 1:
+            raise ValueError("The target width must be positive and the "
+                             "confidence between 0 and 1")
+        if int(batch_size) < 1 or int(max_trajectories) < 1:
+            raise ValueError("The batch size and the maximum number of "
+                             "trajectories must be at least 1")
+        self.width = width
+        self.confidence = confidence
+        self.relative = relative
+        self.species = species
+        self.times = times
+        self.batch_size = int(batch_size)
+        self.max_trajectories = int(max_trajectories)
+        self.processes = processes
+
+    def interval_width(self, data):
+        """
+        The widest confidence interval of the mean, given the selected
+        values of the ensemble, an array of shape (trajectories, times,
+        species).
+        """
+        from scipy.special import ndtri
+        n = data.shape[0]
+        if n < 2:
+            return numpy.inf
+        z = ndtri(0.5 + self.confidence / 2)
+        width = 2 * z * data.std(axis=0, ddof=1) / numpy.sqrt(n)
+        if self.relative:
+            mean = numpy.abs(data.mean(axis=0))
+            width = numpy.where(width > 0, width / numpy.maximum(
+                mean, numpy.finfo(float).tiny), 0)
+        return width.max()
+
+
 class GillesPySolver():
     """ 
     Abstract class for a solver. This is generally called from within a
@@ -1101,20 +2277,89 @@ class GillesPySolver():
         simulation.
     show_labels : bool (True)
         Use names of species as index of result object rather than position numbers.
+    tspan : numpy ndarray
+        Output times. If given, t and increment are taken from it. StochKit
+        requires evenly spaced times.
+    steady_state : gillespy.SteadyState
+        Not supported by StochKit, which always runs to t.
+    phase_callback : callable
+        Called as phase_callback(name, seconds, nbytes) at the end of each
+        phase of the run. The phases are also recorded in
+        results.metadata['phases'].
+    progress : callable
+        Called as progress(p) with a gillespy.ensemble.Progress every
+        progress_interval seconds while StochKit runs, counting the
+        trajectory files written so far. Returning False kills StochKit
+        and returns the trajectories it had finished.
+    progress_interval : float
+        Time in seconds between progress calls.
+    timeout : float
+        Wall time in seconds after which StochKit is killed and a
+        SimulationError is raised. Defaults to no limit.
+
+    StochKit is run without a shell, and its output and error streams are
+    read while it runs, keeping their last lines for error messages (see
+    process.py). The input and output files of StochKit are written to a temporary
+    directory, on the RAM-backed /dev/shm if possible (see output.py).
     """
 
+    # Solvers that give each trajectory its own random stream (see
+    # streams.py) accept a list of trajectory numbers to run.
+    independent_streams = False
+    # Solvers that can save and resume a run (see checkpoint.py), and start
+    # from the end state of an earlier run.
+    checkpoints = False
+    warm_start = False
+    # Solvers that stop a run that takes longer than a timeout
+    timeouts = False
+
     def run(self, model, t=20, number_of_trajectories=1,
             increment=0.05, seed=None, stochkit_home=None, algorithm=None,
-            job_id=None, extra_args='', debug=False, show_labels=False):
+            job_id=None, extra_args='', debug=False, show_labels=False,
+            tspan=None, steady_state=None, phase_callback=None,
+            progress=None, progress_interval=1.0, timeout=None):
         """ 
         Call out and run the solver. Collect the results.
         """
+        from .timing import PhaseTimer, directory_size
+        from .output import work_directory, output_size
+        timer = PhaseTimer(phase_callback)
         
         if algorithm is None:
             raise SimuliationError("No algorithm selected")
+
+        if steady_state is not None:
+            raise SimulationError("StochKit solvers can not stop at steady "
+                "state; use NumPySSASolver or SciPyODESolver instead.")
+
+        if not isinstance(model, (Model, str)):
+            raise SimulationError("StochKit solvers simulate a Model or a "
+                "StochML file, not a frozen model; use NumPySSASolver or "
+                "SciPyODESolver instead.")
+
+        if tspan is not None and len(tspan) > 1:
+            steps = numpy.round(numpy.diff(tspan), 10)
+            if len(set(steps)) != 1:
+                raise InvalidModelError("StochKit only supports uniform "
+                                        "timespans")
+            t, increment = tspan[-1], steps[0]
+
+        if isinstance(model, Model) and (model.listOfEvents or
+                model.listOfAssignmentRules or model.listOfRateRules):
+            raise SimulationError("StochKit solvers do not support events "
+                "or rules; use NumPySSASolver or SciPyODESolver instead.")
         
+        if increment == None:
+            increment = t/20.0
+        points = int(float(t/increment))
+
         # We write all StochKit input and output files to a temporary folder
-        prefix_basedir = tempfile.mkdtemp()
+        timer.begin('setup')
+        species = 0
+        if isinstance(model, Model):
+            species = len(model.listOfSpecies)
+        prefix_basedir = work_directory(output_size(number_of_trajectories,
+                                                    points, species))
         prefix_outdir = os.path.join(prefix_basedir, 'output')
         os.mkdir(os.path.join(prefix_basedir, 'output'))
         
@@ -1125,15 +2370,20 @@ class GillesPySolver():
         if isinstance(model, Model):
             outfile =  os.path.join(prefix_basedir, 
                                         "temp_input_"+job_id+".xml")
-            mfhandle = open(outfile, 'w')
+            mfhandle = open(outfile, 'wb')
             #document = StochMLDocument.from_model(model)
 
         # If the model is a Model instance, we serialize it to XML,
         # and if it is an XML file, we just make a copy.
         if isinstance(model, Model):
+            timer.begin('serialize')
             document = model.serialize()
+            if not isinstance(document, bytes):
+                document = document.encode('utf-8')
             mfhandle.write(document)
             mfhandle.close()
+            timer.count(len(document))
+            timer.begin('setup')
         elif isinstance(model, str):
             outfile = model
 
@@ -1146,82 +2396,83 @@ class GillesPySolver():
         outdir = prefix_outdir+'/'+ensemblename
         
 
-        # Algorithm, SSA or Tau-leaping?
-        executable = None
-        if stochkit_home is not None:
-            if os.path.isfile(os.path.join(stochkit_home, algorithm)):
-                executable = os.path.join(stochkit_home, algorithm)
-            else:
-                raise SimuliationError("stochkit executable '{0}' not found \
-                stochkit_home={1}".format(algorithm, stochkit_home))
-        elif os.environ.get('STOCHKIT_HOME') is not None:
-            if os.path.isfile(os.path.join(os.environ.get('STOCHKIT_HOME'), 
-                                           algorithm)):
-                executable = os.path.join(os.environ.get('STOCHKIT_HOME'), 
-                                          algorithm)
-        if executable is None:
-            # try to find the executable in the path
-            if os.environ.get('PATH') is not None:
-                for dir in os.environ.get('PATH').split(':'):
-                    if os.path.isfile(os.path.join(dir, algorithm)):
-                        executable = os.path.join(dir, algorithm)
-                        break
+        # Algorithm, SSA or Tau-leaping? Executables are looked up once per
+        # process (see backends.py).
+        from .backends import find_executable
+        executable = find_executable(algorithm, stochkit_home)
+        if executable is None and stochkit_home is not None:
+            raise SimuliationError("stochkit executable '{0}' not found \
+            stochkit_home={1}".format(algorithm, stochkit_home))
         if executable is None:
             raise SimulationError("stochkit executable '{0}' not found. \
                 Make sure it is your path, or set STOCHKIT_HOME envronment \
                 variable'".format(algorithm))
 
-
-
         # Assemble the argument list
-        args = ''
-        args += '--model '
-        args += outfile
-        args += ' --out-dir '+outdir
-        args += ' -t '
-        args += str(t)
-        if increment == None:
-            increment = t/20.0
-        num_output_points = str(int(float(t/increment)))
-        args += ' -i ' + num_output_points
+        args = [executable, '--model', outfile, '--out-dir', outdir,
+                '-t', str(t), '-i', str(points)]
         if ensemblename in directories:
             print('Ensemble '+ensemblename+' already existed, using --force.')
-            args+=' --force'
-        
+            args.append('--force')
+        args += shlex.split(extra_args)
 
-        # If we are using local mode, shell out and run StochKit 
-        # (SSA or Tau-leaping or ODE)
-        cmd = executable+' '+args+' '+extra_args
+        # If we are using local mode, run StochKit (SSA or Tau-leaping or
+        # ODE) directly, without a shell
+        cmd = ' '.join(shlex.quote(arg) for arg in args)
         if debug:
             print("cmd: {0}".format(cmd))
 
+        def discard():
+            # The work directory of a failed run is kept for debugging
+            if not debug:
+                shutil.rmtree(prefix_basedir, ignore_errors=True)
+
         # Execute
+        from .process import Process
+        process = None
+        finished = False
         try:
-            #print "CMD: {0}".format(cmd)
-            handle = subprocess.Popen(cmd, stdout = subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-            return_code = handle.wait()
+            timer.begin('launch')
+            process = Process(args)
+            timer.begin('simulate')
+            reader = self.trajectory_reader(outdir, points + 1)
+            return_code, aborted = self._wait(process, reader,
+                number_of_trajectories, t, progress, progress_interval,
+                timeout)
+            timer.end()
+            finished = True
         except OSError as e:
             raise SimuliationError("Solver execution failed: \
             {0}\n{1}".format(cmd, e))
-        
-        try:
-            stderr = handle.stderr.read()
-        except Exception as e:
-            stderr = 'Error reading stderr: {0}'.format(e)
-        try:
-            stdout = handle.stdout.read()
-        except Exception as e:
-            stdout = 'Error reading stdout: {0}'.format(e)
-
-        if return_code != 0:
-            #print stdout
-            #print stderr
+        except subprocess.TimeoutExpired:
+            raise SimulationError("Solver execution timed out after {0} s: "
+                "'{1}' output: {2}{3}".format(timeout, cmd,
+                                              process.output('stdout'),
+                                              process.output('stderr')))
+        finally:
+            # Also on errors while waiting, such as an unexpected output
+            # file or an exception in the progress callback
+            if not finished:
+                if process is not None:
+                    process.kill()
+                    process.wait()
+                discard()
+
+        stdout = process.output('stdout')
+        stderr = process.output('stderr')
+
+        if return_code != 0 and not aborted:
+            discard()
             raise SimuliationError("Solver execution failed: \
             '{0}' output: {1}{2}".format(cmd,stdout,stderr))
 
         # Get data using solver specific function
+        timer.begin('parse')
         try:
-            if show_labels:
+            if reader is not None:
+                # Most trajectories were parsed while StochKit was running
+                labels, trajectories = reader.collect(partial=aborted)
+            elif show_labels:
                 labels, trajectories = self.get_trajectories(outdir, debug=debug, show_labels=True)
             else:
                 trajectories = self.get_trajectories(outdir, debug=debug, show_labels=False)
@@ -1230,29 +2481,37 @@ class GillesPySolver():
             if os.path.isfile(fname):
                 with open(fname) as f:
                     cerr = f.read()
+                discard()
                 raise SimulationError("Error compiling custom propensities: {0}\n{1}\n".format(fname,cerr))
 
             fname = os.path.join(prefix_outdir,ensemblename,'log.txt')
             if os.path.isfile(fname):
                 with open(fname) as f:
                     cerr = f.read()
+                discard()
                 raise SimulationError("Error running simulation: {0}\n{1}\n".format(fname,cerr))
-            
+            discard()
             raise SimulationError("Error using solver.get_trajectories('{0}'): {1}".format(outdir, e))
+        timer.count(directory_size(outdir))
+        if aborted and trajectories:
+            # Only keep the trajectories StochKit had finished
+            length = max(len(r) for r in trajectories)
+            trajectories = [r for r in trajectories if len(r) == length]
 
         if len(trajectories) == 0:
-            #print stdout
-            #print stderr
+            discard()
             raise SimuliationError("Solver execution failed: \
             '{0}' output: {1}{2}".format(cmd,stdout,stderr))
 
         # Clean up
+        timer.begin('cleanup')
         if debug:
             print("prefix_basedir={0}".format(prefix_basedir))
             print("STDOUT: {0}".format(stdout))
             print("STDERR: {0}".format(stderr))
         else:
             shutil.rmtree(prefix_basedir)
+        timer.end()
         # Return data
         if show_labels:
             results2 = []
@@ -1261,9 +2520,76 @@ class GillesPySolver():
                 for n,l in enumerate(labels):
                     ret[l] = r[:,n]
                 results2.append(ret)
-            return results2
-        else:
-            return trajectories
+            trajectories = results2
+        results = Results(trajectories, stop_time=t, phases=timer.phases)
+        if progress is not None:
+            results.metadata['aborted'] = aborted
+        return results
+
+    def trajectory_reader(self, outdir, rows):
+        """
+        An output.TrajectoryReader that parses the output in outdir while
+        StochKit runs, or None if the output is only parsed at the end.
+        """
+        return None
+
+    def _wait(self, process, reader, number_of_trajectories, t, progress,
+              interval, timeout=None):
+        """
+        Waits for the StochKit process, parsing the trajectory files it has
+        completed with reader, if any, and reporting progress from them.
+        Returns the return code and whether the callback aborted the run,
+        in which case the process is killed. If the process runs longer
+        than timeout seconds it is killed and subprocess.TimeoutExpired is
+        raised.
+        """
+        import timeit
+        from .ensemble import EnsembleStatistics, Progress, ProgressMonitor
+
+        def statistics():
+            if reader is None or not reader.trajectories:
+                return None
+            data = list(reader.trajectories.values())
+            return EnsembleStatistics.from_trajectories(data,
+                                                        reader.labels[1:])
+
+        def report(events, elapsed):
+            done = process.poll() is not None
+            completed = len(reader.trajectories) if reader else 0
+            return Progress(number_of_trajectories,
+                            number_of_trajectories if done else completed,
+                            t if done else 0.0, t, None, elapsed, statistics)
+
+        monitor = None
+        if progress is not None:
+            monitor = ProgressMonitor(progress, interval, report)
+        # Poll often at first, so short runs return quickly
+        delay = 0.01
+        start = last = timeit.default_timer()
+        while True:
+            try:
+                process.wait(timeout=delay)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            delay = min(2 * delay, 0.25, interval)
+            if reader is not None:
+                reader.poll()
+            now = timeit.default_timer()
+            if timeout is not None and now - start >= timeout:
+                process.kill()
+                process.wait()
+                raise subprocess.TimeoutExpired(process.args, timeout)
+            if monitor is not None and now - last >= interval:
+                last = now
+                if not monitor.notify():
+                    process.kill()
+                    return process.wait(), True
+        if monitor is not None:
+            if reader is not None:
+                reader.poll()
+            monitor.notify()
+        return process.returncode, False
 
 class StochKitSolver(GillesPySolver):
     """ 
@@ -1298,11 +2624,15 @@ class StochKitSolver(GillesPySolver):
         Set to True to provide additional debug information about the     
         simulation.
     """
-    
+
+    timeouts = True
+
     @classmethod
     def run(cls, model, t=20, number_of_trajectories=1,
             increment=0.05, seed=None, stochkit_home=None, algorithm='ssa',
-            job_id=None, method=None,debug=False, show_labels=False):
+            job_id=None, method=None,debug=False, show_labels=False,
+            tspan=None, steady_state=None, phase_callback=None,
+            progress=None, progress_interval=1.0, timeout=None):
     
         # all this is specific to StochKit
         if model.units == "concentration":
@@ -1311,13 +2641,10 @@ class StochKitSolver(GillesPySolver):
                 "stochastic simulation. Use solver = StochKitODESolver "+
                 "instead to simulate a concentration model deterministically.")
 
-        if seed is None:
-            seed = random.randint(0, 2147483647)
-        # StochKit breaks for long ints
-        if seed.bit_length()>=32:
-            seed = seed & ((1<<32)-1)
-            if seed > (1 << 31) -1:
-                seed -= 1 << 32
+        # StochKit breaks for long ints, so wide seeds are hashed to 31 bits
+        from .streams import root_seed, stochkit_seed
+        entropy = root_seed(seed)
+        seed = stochkit_seed(entropy)
 
         # Only use on processor per StochKit job.
         args = ' -p 1'
@@ -1334,34 +2661,41 @@ class StochKitSolver(GillesPySolver):
         args += str(realizations)
 
         if method is not None:  #This only works for StochKit 2.1
+            from .backends import find_executable, executable_options
+            executable = find_executable(algorithm, stochkit_home)
+            if executable is not None and \
+                    '--method' not in executable_options(executable):
+                raise SimulationError("'{0}' does not support --method, "
+                    "which needs StochKit 2.1 or later".format(executable))
             args += ' --method ' + str(method)
 
         
         self = StochKitSolver()
-        return GillesPySolver.run(self, model,t, number_of_trajectories, 
+        results = GillesPySolver.run(self, model,t, number_of_trajectories, 
                                   increment, seed, stochkit_home,
                                   algorithm, 
                                   job_id, extra_args=args, debug=debug,
-                                  show_labels=show_labels)
+                                  show_labels=show_labels, tspan=tspan,
+                                  steady_state=steady_state,
+                                  phase_callback=phase_callback,
+                                  progress=progress,
+                                  progress_interval=progress_interval,
+                                  timeout=timeout)
+        results.metadata['seed'] = entropy
+        return results
 
 
+    def trajectory_reader(self, outdir, rows):
+        from .output import TrajectoryReader
+        return TrajectoryReader(os.path.join(outdir, 'trajectories'), rows)
+
     def get_trajectories(self, outdir, debug=False, show_labels=False):
         # Collect all the output data
-        files = os.listdir(outdir + '/stats')
-        trajectories = []
-        files = os.listdir(outdir + '/trajectories')
-        labels = []
-        if show_labels:
-            with open(outdir + '/trajectories/trajectory0.txt', 'r') as f:
-                first_line= f.readline()
-                labels = first_line.split()
-        for filename in files:
-            if 'trajectory' in filename:
-                trajectories.append(numpy.loadtxt(outdir + '/trajectories/' + 
-                                        filename, skiprows=1))
-            else:
-                raise SimuliationError("Couldn't identify file '{0}' found in \
-                                        output folder".format(filename))
+        try:
+            labels, trajectories = self.trajectory_reader(outdir,
+                                                          None).collect()
+        except ValueError as e:
+            raise SimuliationError(str(e))
         if show_labels:
             return (labels, trajectories)
         else:
@@ -1397,18 +2731,27 @@ class StochKitODESolver(GillesPySolver):
         Set to True to provide additional debug information about the     
         simulation.
     """
-    
+
+    timeouts = True
+
     @classmethod
     def run(cls, model, t=20, number_of_trajectories=1,
                 increment=0.05, seed=None, stochkit_home=None, 
                 algorithm='stochkit_ode.py',
-                job_id=None, debug=False, show_labels=False):
+                job_id=None, debug=False, show_labels=False, tspan=None,
+                steady_state=None, phase_callback=None, progress=None,
+                progress_interval=1.0, timeout=None):
         self = StochKitODESolver()
         return GillesPySolver.run(self,model,t, number_of_trajectories, 
                                   increment, seed, stochkit_home,
                                   algorithm, 
                                   job_id, debug=debug,
-                                  show_labels=show_labels)
+                                  show_labels=show_labels, tspan=tspan,
+                                  steady_state=steady_state,
+                                  phase_callback=phase_callback,
+                                  progress=progress,
+                                  progress_interval=progress_interval,
+                                  timeout=timeout)
 
     def get_trajectories(self, outdir, debug=False, show_labels=False):
         if debug:
@@ -1460,3 +2803,9 @@ class SimulationError(Exception):
     
     
     
+
+
+# The native solvers subclass GillesPySolver and return Results, so they are
+# imported last.
+from .native import NumPySSASolver, SciPyODESolver, EventLog
+from .moments import MomentSolver
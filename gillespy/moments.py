@@ -0,0 +1,201 @@
+"""
+Ensemble means and covariances computed directly from the moment equations
+of the chemical master equation, at about the cost of one ODE solve instead
+of a large SSA ensemble.
+
+The linear noise approximation (LNA) integrates the reaction rate equations
+for the mean together with the covariance driven by them,
+
+    dC/dt = A C + C A' + S' diag(a) S,    A = S' da/dx,
+
+where S is the stoichiometry (reactions, species) and a the propensities at
+the mean. The second-order (normal) moment closure also feeds the
+covariance back into the mean, through the curvature of the propensities,
+E[a(X)] = a(m) + tr(H C) / 2, and neglects the third central moments. It is
+exact for reactions of up to first order and captures the shift of the mean
+by second-order (bimolecular) reactions, which the LNA misses.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import numpy
+
+from .gillespy import GillesPySolver, SimulationError
+from .compiled import compile_model
+from .conservation import ConservationLaws, conservation_laws
+from .timing import PhaseTimer
+from .ensemble import EnsembleStatistics, Progress
+from .native import _output_times, _format_trajectories
+
+ALGORITHMS = ('lna', 'normal')
+
+
+def moments(compiled, tspan, algorithm='lna', rtol=1e-6, atol=1e-9,
+            reduce=True):
+    """
+    Integrates the moment equations of compiled, a CompiledModel without
+    events or rules, from its deterministic initial state.
+
+    If reduce, only the mean and covariance of the species that are not
+    determined by conservation laws (see gillespy.conservation) are
+    integrated; those of the others follow from them. reduce may also be
+    the ConservationLaws of the model.
+
+    Returns the mean, shape (times, species), and the covariance, shape
+    (times, species, species), at the times in tspan.
+    """
+    from scipy.integrate import solve_ivp
+
+    S = compiled.stoichiometry
+    ns = S.shape[1]
+    second = algorithm == 'normal'
+    laws = reduce
+    if reduce is True:
+        laws = conservation_laws(compiled)
+    if not laws:
+        laws = ConservationLaws(compiled.species_names, range(ns), [], [])
+    # The species are x = x0 + T (x_I - x0_I) for the independent species
+    # x_I, so their covariance is T C_I T'
+    x0 = compiled.initial_values[:ns]
+    T = laws.transform
+    S = S[:, laws.independent]
+    ni = S.shape[1]
+    # The covariance is symmetric; only its upper triangle is integrated
+    upper = numpy.triu_indices(ni)
+
+    def unpack(c):
+        C = numpy.empty((ni, ni))
+        C[upper] = c
+        C[upper[1], upper[0]] = c
+        return C
+
+    def rhs(t, y):
+        m, C = y[:ni], unpack(y[ni:])
+        if laws:
+            m = laws.expand(m, x0)
+        a, jacobian, hessian = compiled.propensity_derivatives(m, t, second)
+        if laws:
+            jacobian = jacobian.dot(T)
+        if second:
+            full = T.dot(C).dot(T.T) if laws else C
+            a = a + 0.5 * numpy.einsum('rij,ij->r', hessian, full)
+        A = S.T.dot(jacobian)
+        dC = A.dot(C)
+        dC += dC.T
+        dC += (S.T * a).dot(S)
+        return numpy.concatenate([a.dot(S), dC[upper]])
+
+    y0 = numpy.zeros(ni + len(upper[0]))
+    y0[:ni] = x0[laws.independent]
+    sol = solve_ivp(rhs, (0.0, tspan[-1]), y0, method='LSODA', rtol=rtol,
+                    atol=atol, t_eval=tspan)
+    if not sol.success:
+        raise SimulationError("Moment integration failed at t={0}: "
+                              "{1}".format(sol.t[-1] if len(sol.t) else 0.0,
+                                           sol.message))
+    mean = laws.expand(sol.y[:ni].T, x0)
+    covariance = numpy.empty((len(tspan), ni, ni))
+    covariance[:, upper[0], upper[1]] = sol.y[ni:].T
+    covariance[:, upper[1], upper[0]] = sol.y[ni:].T
+    if laws:
+        covariance = numpy.einsum('ij,tjk,lk->til', T, covariance, T)
+    return mean, covariance
+
+
+class MomentSolver(GillesPySolver):
+    """
+    Solver for the mean and covariance of the species over the ensemble of
+    stochastic trajectories, from the moment equations (see moments.py).
+    Only for population models of reactions, without events or rules.
+    Species determined by conservation laws are computed rather than
+    integrated; they are listed in results.metadata['conserved'].
+
+    The results hold a single trajectory, the mean, like those of
+    SciPyODESolver; results.metadata['statistics'] holds the mean, variance
+    and covariance as an EnsembleStatistics, in the form
+    EnsembleStatistics.from_trajectories gives for an SSA ensemble.
+
+    Attributes
+    ----------
+    model : gillespy.Model
+        The model on which the solver will operate, or a frozen snapshot of
+        it (Model.freeze).
+    t : float
+        The end time of the solver.
+    number_of_trajectories : int
+        Ignored, the moments are those of the infinite ensemble.
+    increment : float
+        The time step of the solution.
+    algorithm : str
+        'lna' for the linear noise approximation (the default) or 'normal'
+        for the second-order moment closure.
+    debug : bool (False)
+        Set to True to provide additional debug information about the
+        simulation.
+    show_labels : bool (False)
+        Use names of species as index of result object rather than position
+        numbers.
+    tspan : numpy ndarray
+        Output times, any increasing non-negative times. Overrides t and
+        increment.
+    phase_callback : callable
+        Called as phase_callback(name, seconds, nbytes) at the end of each
+        phase (compile, simulate, format), which are also recorded in
+        results.metadata['phases'].
+    progress : callable
+        Called once as progress(p) with a gillespy.ensemble.Progress when
+        the integration is done; accepted for compatibility with the
+        stochastic solvers.
+    progress_interval : float
+        Unused.
+    """
+
+    @classmethod
+    def run(cls, model, t=20, number_of_trajectories=1,
+            increment=0.05, seed=None, stochkit_home=None, algorithm=None,
+            job_id=None, debug=False, show_labels=False, tspan=None,
+            phase_callback=None, progress=None, progress_interval=1.0):
+
+        if algorithm is None:
+            algorithm = 'lna'
+        if algorithm not in ALGORITHMS:
+            raise SimulationError("Unknown moment algorithm '{0}', use one "
+                                  "of {1}".format(algorithm,
+                                                  ', '.join(ALGORITHMS)))
+        if model.units == "concentration":
+            raise SimulationError("MomentSolver can only simulate population "
+                "models, please convert to population-based model for "
+                "stochastic simulation.")
+
+        timer = PhaseTimer(phase_callback)
+        timer.begin('compile')
+        compiled = compile_model(model)
+        if compiled.has_events or compiled.species_rules:
+            raise SimulationError("MomentSolver does not support events or "
+                                  "rules; use NumPySSASolver instead.")
+        laws = conservation_laws(compiled)
+        tspan = _output_times(model, t, increment, tspan)
+        if debug:
+            print("MomentSolver ({0}): {1} species ({2} conserved), {3} "
+                  "reactions, {4} output times".format(
+                      algorithm, len(compiled.species_names), len(laws),
+                      len(compiled.reaction_names), len(tspan)))
+        timer.begin('simulate')
+        mean, covariance = moments(compiled, tspan, algorithm, reduce=laws)
+        timer.count(mean.nbytes + covariance.nbytes)
+        timer.begin('format')
+        variance = numpy.diagonal(covariance, axis1=1, axis2=2).copy()
+        statistics = EnsembleStatistics(tspan, compiled.species_names, mean,
+                                        variance, numpy.inf, covariance)
+        results = _format_trajectories(compiled, tspan, mean[None],
+                                       show_labels, algorithm=algorithm,
+                                       statistics=statistics,
+                                       phases=timer.phases,
+                                       conserved=laws.dependent_names)
+        timer.end()
+        if progress is not None:
+            elapsed = sum(phase['time'] for phase in timer.phases.values())
+            progress(Progress(1, 1, tspan[-1], tspan[-1], None, elapsed,
+                              lambda: statistics))
+        return results
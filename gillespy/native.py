@@ -0,0 +1,829 @@
+"""
+Native solvers, which simulate a Model in-process with NumPy instead of
+shelling out to StochKit. The model is compiled once (see compiled.py), so
+customized propensity functions do not need a C compiler.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import timeit
+
+import numpy
+
+from .gillespy import GillesPySolver, Results, SimulationError
+from .compiled import compile_model
+from .conservation import ConservationLaws, conservation_laws
+from .streams import RandomStreams
+from .checkpoint import Checkpoint, Checkpointer, initial_states
+from .timing import PhaseTimer
+from .ensemble import EnsembleStatistics, Progress, ProgressMonitor
+
+
+def _output_times(model, t, increment, tspan=None):
+    """
+    Output times of a run: tspan if given (any increasing times), else
+    evenly spaced times to t, as StochKit would use them.
+    """
+    if tspan is not None:
+        return numpy.asarray(tspan, dtype=float)
+    if increment is None:
+        increment = t / 20.0
+    return numpy.linspace(0, t, int(round(t / increment)) + 1)
+
+
+def _format_trajectories(compiled, tspan, data, show_labels,
+                         steady_state=None, **metadata):
+    """
+    Converts an array of shape (trajectories, times, state) to the
+    result format of GillesPySolver.run: a list of arrays with time in the
+    first column, or a list of {label: array} dicts if show_labels. The data
+    may stop before the end of tspan if the run stopped at steady state.
+    """
+    n, T, ns = data.shape[0], data.shape[1], len(compiled.species_names)
+    full = numpy.empty((n, T, ns + 1))
+    full[:, :, 0] = tspan[:T]
+    full[:, :, 1:] = data[:, :, :ns]
+    trajectories = list(full)
+    if show_labels:
+        labels = ['time'] + compiled.species_names
+        trajectories = [dict((l, r[:, i]) for i, l in enumerate(labels))
+                        for r in trajectories]
+    metadata['stop_time'] = tspan[T - 1]
+    if steady_state is not None:
+        metadata['steady_state'] = T < len(tspan) or \
+            steady_state.reached(data, _steady_state_columns(compiled,
+                                                             steady_state))
+    return Results(trajectories, **metadata)
+
+
+def _steady_state_columns(compiled, steady_state):
+    """ State columns checked by a SteadyState criterion. """
+    names = steady_state.species
+    if names is None:
+        names = compiled.species_names
+    try:
+        return [compiled.state_index[name] for name in names]
+    except KeyError as e:
+        raise SimulationError("Unknown species {0} in steady state "
+                              "criterion".format(e))
+
+
+def ssa(compiled, tspan, number_of_trajectories, rng, steady_state=None,
+        monitor=None, initial=None, resume=None, checkpointer=None):
+    """
+    Gillespie's direct method. All trajectories of the ensemble are advanced
+    together, one reaction event per trajectory per iteration, so the work
+    of each step is done by NumPy over the whole ensemble. Each trajectory
+    draws from its own stream of rng, a RandomStreams.
+
+    With a SteadyState criterion the ensemble is advanced window output
+    times at a time, and stops once the criterion is met. A
+    ProgressMonitor is called every step and reports the progress of the
+    ensemble, and may abort the run.
+
+    The trajectories start from initial, an array of shape (trajectories,
+    state size), if given, or continue from the Checkpoint resume, whose
+    random streams rng must have. A Checkpointer is called every step to
+    save the state of the run, and once at the end.
+
+    Returns the state at the times in tspan (up to the stop, if the run
+    stopped at steady state or was aborted), an array of shape
+    (trajectories, times, state size).
+    """
+    n = number_of_trajectories
+    end = 0  # end of the current chunk of output points
+    if resume is not None:
+        out, X, t, k = (numpy.array(a) for a in
+                        (resume.out, resume.X, resume.t, resume.k))
+        previous, end = resume.previous, resume.end
+        if previous is not None:
+            previous = numpy.array(previous, dtype=bool)
+        rng.set_state(resume.refills, resume.position)
+    else:
+        out = numpy.empty((n, len(tspan), len(compiled.state_names)))
+        if initial is None:
+            X = numpy.tile(compiled.initial_values, (n, 1))
+        else:
+            X = numpy.array(initial, dtype=float)
+        t = numpy.zeros(n)
+        k = numpy.zeros(n, dtype=int)  # next output point of each trajectory
+
+        previous = None
+        if compiled.events:
+            previous = numpy.array([[e.initial_value for e in compiled.events]]
+                                   * n, dtype=bool).reshape(n, -1)
+            now = compiled.triggers(X, t)
+            compiled.fire_events(X, t, now & ~previous)
+            previous = now
+
+    if monitor is not None:
+        def report(events, elapsed):
+            reached = k.min()
+            return Progress(n, int((k == len(tspan)).sum()),
+                            tspan[reached - 1] if reached else 0.0,
+                            tspan[-1], events, elapsed,
+                            lambda: _statistics(compiled, tspan, out,
+                                                reached))
+        monitor.report = report
+
+    step = monitor
+    if checkpointer is not None:
+        def snapshot():
+            refills, position = rng.get_state()
+            return Checkpoint(compiled.state_names, tspan, rng.entropy,
+                              rng.trajectories, X, t, k, out, previous, end,
+                              refills, position)
+        checkpointer.snapshot = snapshot
+
+        def step(events):
+            checkpointer(events)
+            return monitor is None or monitor(events)
+
+    chunk = len(tspan)
+    if steady_state is not None:
+        chunk = steady_state.window
+        checked = _steady_state_columns(compiled, steady_state)
+    stop = None
+    with numpy.errstate(divide='ignore'):
+        while True:
+            # A chunk is done when every trajectory has reached its end. The
+            # steps between chunks are repeatable, so a run resumed from a
+            # checkpoint taken at any step continues the same way.
+            if (k >= end).all():
+                if end:
+                    # No trajectory fired a reaction between its last event
+                    # and the last output time, so all continue from there
+                    # (memorylessness)
+                    t[:] = tspan[end - 1]
+                    if steady_state is not None and \
+                            steady_state.reached(out[:, :end], checked):
+                        break
+                if end == len(tspan):
+                    break
+                end = min(end + chunk, len(tspan))
+            if compiled.has_events:
+                _ssa_event_loop(compiled, tspan[:end], rng, out, X, t, k,
+                                previous, step)
+            else:
+                _ssa_loop(compiled, tspan[:end], rng, out, X, t, k, step)
+            if monitor is not None and monitor.aborted:
+                # Keep the output times reached by every trajectory
+                stop = k.min()
+                break
+    if checkpointer is not None:
+        checkpointer.save()
+    if monitor is not None and not monitor.aborted:
+        monitor.notify()
+    out = _with_rules(compiled, tspan, out[:, :end if stop is None else stop])
+    return out
+
+
+def _with_rules(compiled, tspan, data):
+    """ A contiguous copy of data with the assignment rules applied. """
+    data = numpy.ascontiguousarray(data)
+    if compiled.species_rules:
+        flat = data.reshape(-1, data.shape[2])
+        compiled.apply_rules(flat, numpy.tile(tspan[:data.shape[1]],
+                                              data.shape[0]))
+    return data
+
+
+def _statistics(compiled, tspan, out, end):
+    """ EnsembleStatistics of the first end output times of out. """
+    if not end:
+        return None
+    data = _with_rules(compiled, tspan, out[:, :end])
+    ns = len(compiled.species_names)
+    trajectories = numpy.empty((data.shape[0], end, ns + 1))
+    trajectories[:, :, 0] = tspan[:end]
+    trajectories[:, :, 1:] = data[:, :, :ns]
+    return EnsembleStatistics.from_trajectories(trajectories,
+                                                compiled.species_names)
+
+
+def _ssa_loop(compiled, tspan, rng, out, X, t, k, monitor=None):
+    T = len(tspan)
+    S = compiled.stoichiometry
+    ns = S.shape[1]
+    active = numpy.flatnonzero(k < T)
+    while len(active):
+        a = compiled.propensities(X[active], t[active])
+        a0 = a.sum(axis=1)
+        r = rng.uniform(active)
+        t_next = t[active] - numpy.log1p(-r[0]) / a0
+
+        # Record the current state at all output times passed by this step
+        crossing = numpy.flatnonzero(t_next > tspan[k[active]])
+        if len(crossing):
+            rows = active[crossing]
+            reached = numpy.searchsorted(tspan, t_next[crossing], side='left')
+            passed = reached - k[rows]
+            single = rows[passed == 1]
+            out[single, k[single]] = X[single]
+            for i in numpy.flatnonzero(passed > 1):
+                out[rows[i], k[rows[i]]:reached[i]] = X[rows[i]]
+            k[rows] = reached
+            if reached.max() == T:
+                fire = k[active] < T
+                active, a, a0 = active[fire], a[fire], a0[fire]
+                r, t_next = r[:, fire], t_next[fire]
+                if not len(active):
+                    break
+
+        j = (numpy.cumsum(a, axis=1) < (r[1] * a0)[:, None]).sum(axis=1)
+        X[active, :ns] += S[numpy.minimum(j, S.shape[0] - 1)]
+        t[active] = t_next
+        if monitor is not None and not monitor(len(active)):
+            return
+
+
+def _ssa_event_loop(compiled, tspan, rng, out, X, t, k, previous,
+                    monitor=None):
+    """
+    Direct method with events and rate rules. A step never goes past the
+    next output time: if the next reaction would, the trajectory is moved
+    to the output time instead and the reaction is redrawn from there,
+    which is exact because reaction waiting times are memoryless. Event
+    triggers are checked after every step, so they are resolved to within
+    one reaction or one output interval, and rate rules are integrated by
+    forward Euler over each step.
+    """
+    T = len(tspan)
+    S = compiled.stoichiometry
+    ns = S.shape[1]
+    columns = [c for c, _ in compiled.rate_rules]
+    active = numpy.flatnonzero(k < T)
+
+    while len(active):
+        Xa, ta = X[active], t[active]
+        a = compiled.propensities(Xa, ta)
+        a0 = a.sum(axis=1)
+        r = rng.uniform(active)
+        t_next = ta - numpy.log1p(-r[0]) / a0
+        t_out = tspan[k[active]]
+        capped = t_next > t_out
+        t_step = numpy.where(capped, t_out, t_next)
+
+        if columns:
+            X[active[:, None], columns] = Xa[:, columns] + \
+                compiled.rates(Xa, ta) * (t_step - ta)[:, None]
+
+        rows = active[capped]
+        out[rows, k[rows]] = X[rows]
+        k[rows] += 1
+
+        fire = numpy.flatnonzero(~capped)
+        j = (numpy.cumsum(a[fire], axis=1) <
+             (r[1, fire] * a0[fire])[:, None]).sum(axis=1)
+        X[active[fire], :ns] += S[numpy.minimum(j, S.shape[0] - 1)]
+        t[active] = t_step
+
+        if compiled.events:
+            now = compiled.triggers(X[active], t[active])
+            fired = now & ~previous[active]
+            if fired.any():
+                Xa = X[active]
+                compiled.fire_events(Xa, t[active], fired)
+                X[active] = Xa
+                now = compiled.triggers(Xa, t[active])
+            previous[active] = now
+
+        active = active[k[active] < T]
+        if monitor is not None and not monitor(len(fire)):
+            return
+
+
+def ssa_events(compiled, t_end, number_of_trajectories, rng, initial=None):
+    """
+    Gillespie's direct method, recording every reaction firing up to t_end
+    instead of the state on a grid, from the initial states initial if
+    given.
+
+    Returns a list with an EventLog for each trajectory.
+    """
+    S = compiled.stoichiometry
+    ns = S.shape[1]
+    n = number_of_trajectories
+    if initial is None:
+        X = numpy.tile(compiled.initial_values, (n, 1))
+    else:
+        X = numpy.array(initial, dtype=float)
+    start = X[:, :ns].copy()
+    t = numpy.zeros(n)
+    active = numpy.arange(n)
+    rows, times, reactions = [], [], []
+    with numpy.errstate(divide='ignore'):
+        while len(active):
+            a = compiled.propensities(X[active], t[active])
+            a0 = a.sum(axis=1)
+            r = rng.uniform(active)
+            t_next = t[active] - numpy.log1p(-r[0]) / a0
+            fire = t_next <= t_end
+            if not fire.all():
+                active, a, a0 = active[fire], a[fire], a0[fire]
+                r, t_next = r[:, fire], t_next[fire]
+            j = numpy.minimum(
+                (numpy.cumsum(a, axis=1) < (r[1] * a0)[:, None]).sum(axis=1),
+                S.shape[0] - 1)
+            X[active, :ns] += S[j]
+            t[active] = t_next
+            rows.append(active)
+            times.append(t_next)
+            reactions.append(j)
+
+    logs = [EventLog(compiled.species_names, compiled.reaction_names,
+                     start[i], S, t_end) for i in range(n)]
+    if rows:
+        # Steps are in time order within a trajectory, so a stable sort by
+        # trajectory keeps each log chronological
+        rows = numpy.concatenate(rows)
+        order = numpy.argsort(rows, kind='stable')
+        times = numpy.concatenate(times)[order]
+        reactions = numpy.concatenate(reactions)[order]
+        bounds = numpy.searchsorted(rows[order], numpy.arange(n + 1))
+        for i, log in enumerate(logs):
+            log.append(times[bounds[i]:bounds[i+1]],
+                       reactions[bounds[i]:bounds[i+1]])
+    return logs
+
+
+class EventLog(object):
+    """
+    Every reaction firing of one trajectory, stored as an append-only
+    binary buffer of (time, reaction index) records. The state at any time
+    is reconstructed from the initial state and the stoichiometry of the
+    reactions fired before it, so any output grid can be produced later.
+
+    Attributes
+    ----------
+    species_names : list of str
+        The species, in the order of the state columns.
+    reaction_names : list of str
+        The reactions, in the order of the reaction indices.
+    initial_values : numpy ndarray
+        The initial species populations.
+    stoichiometry : numpy ndarray
+        Net change of each species per reaction, shape (reactions, species).
+    t_end : float
+        The end time of the simulation; the log is complete up to t_end.
+    """
+
+    dtype = numpy.dtype([('time', '<f8'), ('reaction', '<i4')])
+
+    def __init__(self, species_names, reaction_names, initial_values,
+                 stoichiometry, t_end):
+        self.species_names = list(species_names)
+        self.reaction_names = list(reaction_names)
+        self.initial_values = numpy.array(initial_values, dtype=float)
+        self.stoichiometry = numpy.asarray(stoichiometry)
+        self.t_end = t_end
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer) // self.dtype.itemsize
+
+    def append(self, times, reactions):
+        """ Append firings, which must come after those already logged. """
+        records = numpy.empty(len(times), dtype=self.dtype)
+        records['time'] = times
+        records['reaction'] = reactions
+        self.buffer.extend(records.tobytes())
+
+    @property
+    def records(self):
+        """ The logged firings, a structured array of (time, reaction). """
+        return numpy.frombuffer(bytes(self.buffer), dtype=self.dtype)
+
+    @property
+    def times(self):
+        return self.records['time']
+
+    @property
+    def reactions(self):
+        return self.records['reaction']
+
+    def state(self, tspan):
+        """
+        Species populations at the times in tspan, an array of shape
+        (times, species). Times after t_end are not covered by the log.
+        """
+        tspan = numpy.asarray(tspan, dtype=float)
+        if len(tspan) and tspan.max() > self.t_end:
+            raise SimulationError("The event log ends at t={0}".format(
+                self.t_end))
+        records = self.records
+        states = numpy.empty((len(records) + 1, len(self.initial_values)))
+        states[0] = self.initial_values
+        states[1:] = self.stoichiometry[records['reaction']]
+        numpy.cumsum(states, axis=0, out=states)
+        return states[numpy.searchsorted(records['time'], tspan,
+                                         side='right')]
+
+    def trajectory(self, tspan, show_labels=False):
+        """
+        The trajectory on the grid tspan, in the format returned by the
+        solvers: an array with time in the first column, or a dict of
+        {label: array} if show_labels.
+        """
+        tspan = numpy.asarray(tspan, dtype=float)
+        result = numpy.column_stack([tspan, self.state(tspan)])
+        if show_labels:
+            labels = ['time'] + self.species_names
+            return dict((l, result[:, i]) for i, l in enumerate(labels))
+        return result
+
+
+class NumPySSASolver(GillesPySolver):
+    """
+    Stochastic simulation algorithm (Gillespie's direct method) run
+    in-process with NumPy. Requires no external StochKit installation, and
+    customized propensity functions are evaluated without compiling C code.
+
+    Attributes
+    ----------
+    model : gillespy.Model
+        The model on which the solver will operate, or a frozen snapshot of
+        it (Model.freeze).
+    t : float
+        The end time of the solver.
+    number_of_trajectories : int
+        The number of times to sample the chemical master equation. Each
+        trajectory will be returned at the end of the simulation.
+    increment : float
+        The time step of the solution.
+    seed : int
+        The root random seed for the simulation. Each trajectory draws from
+        its own stream, derived from the seed and the trajectory number.
+        Defaults to fresh entropy, which is recorded as results.metadata
+        ['seed'] to reproduce the run.
+    stochkit_home : str
+        Unused, accepted for compatibility with the other solvers.
+    debug : bool (False)
+        Set to True to provide additional debug information about the
+        simulation.
+    show_labels : bool (False)
+        Use names of species as index of result object rather than position
+        numbers.
+    tspan : numpy ndarray
+        Output times, any increasing non-negative times. Overrides t and
+        increment; the state is recorded exactly at each time.
+    trajectories : list of int
+        The numbers of the trajectories to run, instead of the first
+        number_of_trajectories. With the seed of an ensemble, this re-runs
+        its trajectories bit for bit, for example a single anomalous one.
+    record_events : bool (False)
+        Record every reaction firing instead of the state on a grid, and
+        return an EventLog for each trajectory. Not supported for models
+        with events or rules.
+    steady_state : gillespy.SteadyState
+        Stop once the ensemble statistics have settled. The results are
+        truncated at the stop time, which is in results.metadata.
+    phase_callback : callable
+        Called as phase_callback(name, seconds, nbytes) at the end of each
+        phase (compile, simulate, format), which are also recorded in
+        results.metadata['phases'].
+    progress : callable
+        Called as progress(p) with a gillespy.ensemble.Progress at most
+        every progress_interval seconds and at the end of the run. The
+        partial ensemble statistics are p.statistics(). Returning False
+        aborts the run.
+    progress_interval : float
+        Minimum time in seconds between progress calls.
+    checkpoint : str
+        File to save a checkpoint of the run to, at most every
+        checkpoint_interval seconds and at the end of the run. It is
+        replaced atomically, so a run that is killed leaves the last one.
+    checkpoint_interval : float
+        Minimum time in seconds between checkpoints.
+    resume_from : str or gillespy.checkpoint.Checkpoint
+        Continue a run from its checkpoint, with the same output times,
+        seed and trajectories (those arguments are ignored). The results
+        are the same as those of the run if it had not stopped.
+    initial_state : Results, Checkpoint or array
+        Start each trajectory from the state at the end of an earlier run
+        (warm start), with time restarting at 0: results of a native run
+        or a Checkpoint, with one state per trajectory, or an array of
+        species populations for one or every trajectory.
+    timeout : float
+        Wall time in seconds after which the run is stopped and a
+        SimulationError raised; a checkpointed run can be resumed from its
+        last checkpoint. Defaults to no limit.
+    """
+
+    independent_streams = True
+    checkpoints = True
+    warm_start = True
+    timeouts = True
+
+    @classmethod
+    def run(cls, model, t=20, number_of_trajectories=1,
+            increment=0.05, seed=None, stochkit_home=None, algorithm=None,
+            job_id=None, debug=False, show_labels=False, tspan=None,
+            trajectories=None, record_events=False, steady_state=None,
+            phase_callback=None, progress=None, progress_interval=1.0,
+            checkpoint=None, checkpoint_interval=60.0, resume_from=None,
+            initial_state=None, timeout=None):
+
+        if model.units == "concentration":
+            raise SimulationError("NumPySSASolver can only simulate "
+                "population models, please convert to population-based model "
+                "for stochastic simulation.")
+
+        timer = PhaseTimer(phase_callback)
+        timer.begin('compile')
+        compiled = compile_model(model)
+        tspan = _output_times(model, t, increment, tspan)
+        if resume_from is not None:
+            if initial_state is not None:
+                raise SimulationError("A resumed run can not have an initial "
+                                      "state")
+            if not isinstance(resume_from, Checkpoint):
+                resume_from = Checkpoint.load(resume_from)
+            if resume_from.state_names != compiled.state_names:
+                raise SimulationError("The checkpoint is of a different model")
+            tspan, seed = resume_from.tspan, resume_from.seed
+            trajectories = resume_from.trajectories
+        if trajectories is None:
+            trajectories = range(number_of_trajectories)
+        rng = RandomStreams(seed, trajectories)
+        number_of_trajectories = len(rng.trajectories)
+        initial = None
+        if initial_state is not None:
+            initial = initial_states(initial_state, compiled,
+                                     number_of_trajectories)
+        if record_events:
+            if compiled.has_events or compiled.species_rules:
+                raise SimulationError("Event logs can not be recorded for "
+                                      "models with events or rules")
+            if checkpoint is not None or resume_from is not None:
+                raise SimulationError("Runs recording event logs can not be "
+                                      "checkpointed")
+            if timeout is not None:
+                raise SimulationError("Runs recording event logs can not "
+                                      "have a timeout")
+            timer.begin('simulate')
+            logs = ssa_events(compiled, tspan[-1], number_of_trajectories,
+                              rng, initial)
+            timer.count(sum(len(log.buffer) for log in logs))
+            timer.end()
+            return Results(logs, stop_time=tspan[-1], seed=rng.entropy,
+                           trajectory_numbers=trajectories,
+                           phases=timer.phases)
+        if debug:
+            print("NumPySSASolver: {0} species, {1} reactions ({2} "
+                  "customized), {3} output times".format(
+                      len(compiled.species_names),
+                      len(compiled.reaction_names), len(compiled.custom),
+                      len(tspan)))
+        timer.begin('simulate')
+        monitor, checkpointer, metadata = None, None, {}
+        if progress is not None or timeout is not None:
+            monitor = ProgressMonitor(progress, progress_interval,
+                                      timeout=timeout)
+        if checkpoint is not None:
+            checkpointer = Checkpointer(checkpoint, checkpoint_interval)
+            metadata['checkpoint'] = checkpoint
+        data = ssa(compiled, tspan, number_of_trajectories, rng,
+                   steady_state, monitor, initial, resume_from, checkpointer)
+        timer.count(data.nbytes)
+        timer.begin('format')
+        if progress is not None:
+            metadata['aborted'] = monitor.aborted
+        results = _format_trajectories(compiled, tspan, data, show_labels,
+                                       steady_state, seed=rng.entropy,
+                                       trajectory_numbers=trajectories,
+                                       phases=timer.phases, **metadata)
+        timer.end()
+        return results
+
+
+def ode(compiled, tspan, rtol=1e-6, atol=1e-9, steady_state=None,
+        initial=None, reduce=True, timeout=None):
+    """
+    Integrates the reaction rate equations dX/dt = a(X, t) S, with the
+    propensities a as rates, plus any rate rules. Event triggers are located
+    by root finding; at each event the integration is stopped, the event
+    assignments are applied, and the integration is restarted; the output
+    at the time of an event is the state before it. With a
+    SteadyState criterion the integration is done window output times at a
+    time, and stops once the criterion is met. The integration starts from
+    the state initial if given.
+
+    If reduce, the species that conservation laws determine (see
+    gillespy.conservation) are not integrated but computed from the
+    others; reduce may also be the ConservationLaws of the model.
+
+    A SimulationError is raised once the integration has taken more than
+    timeout seconds of wall time.
+
+    Returns the state at the times in tspan (up to the stop, if the run
+    stopped at steady state), an array of shape (1, times, state size).
+    """
+    from scipy.integrate import solve_ivp
+
+    S = compiled.stoichiometry
+    ns = S.shape[1]
+    size = len(compiled.state_names)
+    laws = reduce
+    if reduce is True:
+        laws = conservation_laws(compiled)
+    if not laws or len(laws.columns(size)) == 0:
+        laws = ConservationLaws(compiled.species_names, range(ns), [], [])
+    # The integrated columns of the state, and the full state of the
+    # current trajectory segment the others are computed from
+    integrated = laws.columns(size)
+    position = dict((c, i) for i, c in enumerate(integrated))
+    S = S[:, laws.independent]
+    ni = len(laws.independent)
+    columns = [position[c] for c, _ in compiled.rate_rules]
+    segment = {}
+
+    def expand(z):
+        if not laws:
+            return numpy.array(z, dtype=float)
+        return laws.expand(z, segment['base'])
+
+    start = timeit.default_timer()
+
+    def rhs(t, z):
+        # The solver evaluates the right-hand side many times per step, so
+        # reading the clock here costs little and stops slow steps too
+        if timeout is not None and \
+                timeit.default_timer() - start >= timeout:
+            raise SimulationError("The run timed out after {0:g} "
+                                  "s".format(timeout))
+        X = expand(z)[None, :]
+        dz = numpy.zeros_like(z)
+        dz[:ni] = compiled.propensities(X, t)[0].dot(S)
+        if columns:
+            dz[columns] += compiled.rates(X, t)[0]
+        return dz
+
+    def trigger(event):
+        # +1 when the trigger is true and -1 otherwise, so the solver finds
+        # the time at which the trigger changes.
+        def g(t, z):
+            return 1.0 if compiled.evaluate(event.trigger, expand(z)[None, :],
+                                            t)[0] else -1.0
+        g.terminal = True
+        g.direction = 1
+        return g
+    events = [trigger(e) for e in compiled.events]
+
+    out = numpy.empty((1, len(tspan), len(compiled.state_names)))
+    if initial is None:
+        y = compiled.initial_values.copy()
+    else:
+        y = numpy.array(initial, dtype=float)
+    t0 = 0.0
+    if compiled.events:
+        previous = numpy.array([[e.initial_value for e in compiled.events]])
+        X = y[None, :]
+        now = compiled.triggers(X, numpy.zeros(1))
+        compiled.fire_events(X, numpy.zeros(1), now & ~previous)
+        y = X[0]
+
+    chunk = len(tspan)
+    if steady_state is not None:
+        chunk = steady_state.window
+        checked = _steady_state_columns(compiled, steady_state)
+    k = 0  # next output point
+    end = 0  # end of the current chunk of output points
+    while k < len(tspan):
+        if k == end:
+            if steady_state is not None and \
+                    steady_state.reached(out[:, :k], checked):
+                break
+            end = min(end + chunk, len(tspan))
+        if tspan[k] <= t0:
+            out[0, k] = y
+            k += 1
+            continue
+        segment['base'] = y
+        sol = solve_ivp(rhs, (t0, tspan[end - 1]), y[integrated],
+                        method='LSODA', rtol=rtol, atol=atol,
+                        t_eval=tspan[k:end], events=events or None)
+        if not sol.success:
+            raise SimulationError("ODE integration failed at t={0}: "
+                                  "{1}".format(sol.t[-1] if len(sol.t) else
+                                               t0, sol.message))
+        if len(sol.t):
+            out[0, k:k+len(sol.t)] = expand(sol.y.T)
+            k += len(sol.t)
+        if sol.status != 1:
+            t0, y = tspan[end - 1], out[0, end - 1].copy()
+            continue
+        # An event was triggered: apply it and continue from just after the
+        # located trigger time, so the same crossing is not found again
+        fired = numpy.array([[len(te) > 0 for te in sol.t_events]])
+        hit = numpy.flatnonzero(fired[0])[0]
+        t0 = sol.t_events[hit][0]
+        X = expand(sol.y_events[hit][:1])
+        # The trigger time is only located to within a tolerance; output
+        # times at the event get the state before it, as in the SSA
+        after = t0 + 1e-12 * max(1.0, abs(t0))
+        while k < end and tspan[k] <= after:
+            out[0, k] = X[0]
+            k += 1
+        compiled.fire_events(X, numpy.array([t0]), fired)
+        y = X[0]
+        t0 = after
+
+    out = out[:, :k]
+    if compiled.species_rules:
+        compiled.apply_rules(out[0], tspan[:k])
+    return out
+
+
+class SciPyODESolver(GillesPySolver):
+    """
+    Deterministic solver that integrates the reaction rate equations of the
+    model in-process with SciPy (LSODA), including events (located by root
+    finding), assignment rules and rate rules. Species determined by
+    conservation laws are computed rather than integrated; they are listed
+    in results.metadata['conserved'].
+
+    Attributes
+    ----------
+    model : gillespy.Model
+        The model on which the solver will operate, or a frozen snapshot of
+        it (Model.freeze).
+    t : float
+        The end time of the solver.
+    number_of_trajectories : int
+        Ignored, a deterministic solver returns a single trajectory.
+    increment : float
+        The time step of the solution.
+    debug : bool (False)
+        Set to True to provide additional debug information about the
+        simulation.
+    show_labels : bool (False)
+        Use names of species as index of result object rather than position
+        numbers.
+    tspan : numpy ndarray
+        Output times, any increasing non-negative times. Overrides t and
+        increment; the state is recorded exactly at each time.
+    steady_state : gillespy.SteadyState
+        Stop once the solution has settled. The results are truncated at
+        the stop time, which is in results.metadata.
+    phase_callback : callable
+        Called as phase_callback(name, seconds, nbytes) at the end of each
+        phase (compile, simulate, format), which are also recorded in
+        results.metadata['phases'].
+    progress : callable
+        Called once as progress(p) with a gillespy.ensemble.Progress when
+        the integration is done; accepted for compatibility with the
+        stochastic solvers.
+    progress_interval : float
+        Unused.
+    initial_state : Results, Checkpoint or array
+        Start from the state at the end of an earlier run (warm start),
+        with time restarting at 0: results of a native run or a Checkpoint
+        (the mean state of their trajectories), or an array of species
+        populations.
+    timeout : float
+        Wall time in seconds after which the integration is stopped and a
+        SimulationError raised. Defaults to no limit.
+    """
+
+    warm_start = True
+    timeouts = True
+
+    @classmethod
+    def run(cls, model, t=20, number_of_trajectories=1,
+            increment=0.05, seed=None, stochkit_home=None, algorithm=None,
+            job_id=None, debug=False, show_labels=False, tspan=None,
+            steady_state=None, phase_callback=None, progress=None,
+            progress_interval=1.0, initial_state=None, timeout=None):
+
+        timer = PhaseTimer(phase_callback)
+        timer.begin('compile')
+        compiled = compile_model(model)
+        laws = conservation_laws(compiled)
+        tspan = _output_times(model, t, increment, tspan)
+        if debug:
+            print("SciPyODESolver: {0} species ({1} conserved), {2} "
+                  "reactions, {3} events, {4} output times".format(
+                      len(compiled.species_names), len(laws),
+                      len(compiled.reaction_names), len(compiled.events),
+                      len(tspan)))
+        initial = None
+        if initial_state is not None:
+            initial = initial_states(initial_state, compiled).mean(axis=0)
+        timer.begin('simulate')
+        data = ode(compiled, tspan, steady_state=steady_state,
+                   initial=initial, reduce=laws, timeout=timeout)
+        timer.count(data.nbytes)
+        timer.begin('format')
+        results = _format_trajectories(compiled, tspan, data, show_labels,
+                                       steady_state, phases=timer.phases,
+                                       conserved=laws.dependent_names)
+        timer.end()
+        if progress is not None:
+            elapsed = sum(phase['time'] for phase in timer.phases.values())
+            progress(Progress(1, 1, results.metadata['stop_time'], tspan[-1],
+                              None, elapsed,
+                              lambda: _statistics(compiled, tspan, data,
+                                                  data.shape[1])))
+        return results
@@ -0,0 +1,120 @@
+"""
+The files of a StochKit run: the working directory that holds its input
+and output, and the parsing of the trajectory files it writes.
+
+StochKit can only write its results to files in an output directory, so it
+can not stream them over a pipe. Instead the working directory is put on a
+RAM-backed file system when there is one, and the trajectory files are
+parsed while StochKit is still running, as each one is completed, so that
+little parsing is left when it exits.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import io
+import os
+import re
+import tempfile
+
+import numpy
+
+SHARED_MEMORY = '/dev/shm'
+
+
+def work_directory(nbytes=0):
+    """
+    A new temporary directory for the files of a StochKit run. Unless
+    TMPDIR is set, it is made on the RAM-backed /dev/shm if that has room
+    for nbytes, the expected size of the output, and allows executables
+    (StochKit compiles customized propensities into the directory).
+    """
+    base = None
+    if 'TMPDIR' not in os.environ and os.path.isdir(SHARED_MEMORY) and \
+            os.access(SHARED_MEMORY, os.W_OK | os.X_OK):
+        stat = os.statvfs(SHARED_MEMORY)
+        noexec = stat.f_flag & getattr(os, 'ST_NOEXEC', 0)
+        if not noexec and stat.f_bavail * stat.f_frsize > 2 * nbytes + 2**26:
+            base = SHARED_MEMORY
+    return tempfile.mkdtemp(prefix='gillespy_', dir=base)
+
+
+def output_size(number_of_trajectories, points, species):
+    """ Rough size in bytes of the StochKit output of a run. """
+    return 12 * number_of_trajectories * (points + 1) * (species + 1)
+
+
+class TrajectoryReader(object):
+    """
+    Parses the trajectory files (trajectory<i>.txt, a header line of labels
+    and a row per output time) in a StochKit output directory. poll()
+    parses the files completed so far and may be called while StochKit is
+    writing them; a file is taken as complete once it has rows lines and
+    ends in a newline. collect() parses the rest.
+
+    Attributes
+    ----------
+    directory : str
+        The trajectories directory of the StochKit output.
+    rows : int
+        The number of output times, or None to only parse in collect().
+    labels : list of str
+        The labels of the columns, once a file has been parsed.
+    trajectories : dict
+        Parsed trajectories, {trajectory number: array}.
+    """
+
+    pattern = re.compile(r'trajectory(\d+)\.txt$')
+
+    def __init__(self, directory, rows=None):
+        self.directory = directory
+        self.rows = rows
+        self.labels = None
+        self.trajectories = {}
+
+    def _read(self, filename, complete):
+        with open(os.path.join(self.directory, filename), 'rb') as f:
+            data = f.read()
+        if not complete:
+            if not data.endswith(b'\n') or data.count(b'\n') != self.rows + 1:
+                return None
+        header, _, body = data.partition(b'\n')
+        if self.labels is None:
+            self.labels = header.decode('utf-8').split()
+        return numpy.loadtxt(io.BytesIO(body), ndmin=2)
+
+    def poll(self, complete=False, partial=False):
+        """
+        Parses the new files that are complete (all of them if complete).
+        If partial, files that can not be parsed, such as the last ones of
+        a killed run, are skipped. Returns the number of trajectories
+        parsed so far.
+        """
+        if (self.rows is None and not complete) or \
+                not os.path.isdir(self.directory):
+            return len(self.trajectories)
+        for filename in os.listdir(self.directory):
+            match = self.pattern.match(filename)
+            if match is None:
+                raise ValueError("Couldn't identify file '{0}' found in "
+                                 "output folder".format(filename))
+            number = int(match.group(1))
+            if number in self.trajectories:
+                continue
+            try:
+                data = self._read(filename, complete)
+            except ValueError:
+                if not partial:
+                    raise
+                continue
+            if data is not None:
+                self.trajectories[number] = data
+        return len(self.trajectories)
+
+    def collect(self, partial=False):
+        """
+        Parses the remaining files (see poll). Returns the labels and the
+        list of trajectories, in trajectory number order.
+        """
+        self.poll(complete=True, partial=partial)
+        return self.labels or [], [self.trajectories[i] for i in
+                                   sorted(self.trajectories)]
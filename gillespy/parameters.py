@@ -0,0 +1,330 @@
+"""
+Resolution of the parameter expressions of a model. An expression may
+refer to other parameters, defined before or after it. The expressions are
+parsed into a dependency graph, sorted topologically and compiled to a
+single code object that evaluates all of them elementwise over NumPy
+arrays, so a whole batch of parameter sets, such as a sweep over the free
+parameters, is resolved in one call:
+
+    evaluate = compile_parameters(model)
+    values = evaluate({'k1': numpy.logspace(-2, 2, 1000)})
+
+gives every parameter, derived ones included, as an array of 1000 values.
+
+Each expression is parsed once: parsed expressions and compiled code
+objects are kept in bounded caches, and the evaluator of a model is kept
+on it until its parameters change. Model.set_parameter only evaluates the
+parameters that depend on the one it sets.
+
+Expressions are those of the propensity functions (see
+gillespy.compiled.parse_expression): numbers, parameter names,
+arithmetic, comparisons, conditional expressions, and/or/not and the
+functions in gillespy.compiled.FUNCTIONS. Other Python, such as builtins
+like int() or round(), subscripts or attribute access, is not evaluated
+any more and raises ParameterError.
+"""
+from __future__ import absolute_import
+
+import ast
+import copy
+from collections import OrderedDict
+
+from functools import lru_cache
+
+import numpy
+
+from .gillespy import ReactionError, ParameterError, _TableDict
+from .compiled import FUNCTIONS, parse_expression
+
+
+@lru_cache(maxsize=4096)
+def _parse(expression):
+    """ The syntax tree of expression and the names it refers to. """
+    tree, refers = parse_expression(expression)
+    return tree, frozenset(refers)
+
+
+@lru_cache(maxsize=256)
+def _compile(assignments):
+    """
+    The code object assigning the (name, expression) pairs of assignments,
+    in order.
+    """
+    body = [ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())],
+                       value=_parse(expression)[0])
+            for name, expression in assignments]
+    module = ast.fix_missing_locations(ast.Module(body=body,
+                                                  type_ignores=[]))
+    return compile(module, '<parameters>', 'exec')
+
+
+class ParameterEvaluator(object):
+    """
+    Evaluates the parameters of a model, see compile_parameters.
+
+    Attributes
+    ----------
+    names : list of str
+        All parameters, in model order.
+    constants : OrderedDict
+        Values of the parameters whose expressions are numbers (the free
+        parameters).
+    expressions : OrderedDict
+        Expressions of the other (derived) parameters, in dependency order:
+        each only refers to constants and to derived parameters before it.
+    dependencies : dict
+        The parameters each derived parameter refers to directly.
+    """
+
+    def __init__(self, expressions):
+        self.names = list(expressions)
+        self.constants = OrderedDict()
+        self.dependencies = {}
+        derived = {}
+        for name, expression in expressions.items():
+            try:
+                self.constants[name] = float(expression)
+                continue
+            except (TypeError, ValueError):
+                pass
+            derived[name] = str(expression).strip()
+            try:
+                refers = _parse(derived[name])[1]
+            except ReactionError as e:
+                raise ParameterError("Parameter {0}: {1}".format(name, e))
+            unknown = refers - set(expressions)
+            if unknown:
+                raise ParameterError("Parameter {0} refers to unknown "
+                                     "parameter(s) {1}".format(
+                                         name, ', '.join(sorted(unknown))))
+            self.dependencies[name] = refers
+        self.expressions = OrderedDict((name, derived[name])
+                                       for name in self._sort())
+        self._dependents = self._order = None
+
+    def _sort(self):
+        """ The derived parameters in dependency order (depth first). """
+        order, done, path = [], set(self.constants), []
+        for name in self.dependencies:
+            self._visit(name, order, done, path)
+        return order
+
+    def _visit(self, name, order, done, path):
+        # A method rather than a recursive closure, which would be a
+        # reference cycle keeping the evaluator alive until garbage
+        # collection
+        if name in done:
+            return
+        if name in path:
+            cycle = path[path.index(name):]
+            raise ParameterError("Parameters {0} depend on each "
+                                 "other".format(', '.join(cycle)))
+        path.append(name)
+        for dependency in sorted(self.dependencies[name]):
+            self._visit(dependency, order, done, path)
+        path.pop()
+        done.add(name)
+        order.append(name)
+
+    @property
+    def derived(self):
+        """ Names of the derived parameters, in dependency order. """
+        return list(self.expressions)
+
+    def _namespace(self):
+        namespace = dict(FUNCTIONS)
+        namespace['__builtins__'] = {}
+        namespace.update(self.constants)
+        return namespace
+
+    def _run(self, names, namespace):
+        """ Assigns the derived parameters names, in order, in namespace. """
+        try:
+            exec(_compile(tuple((name, self.expressions[name])
+                                for name in names)), namespace)
+        except Exception as e:
+            failed = next(name for name in names if name not in namespace)
+            raise ParameterError("Could not resolve Parameter expression {0} "
+                                 "({1}): {2}".format(failed,
+                                                     self.expressions[failed],
+                                                     e))
+
+    def __call__(self, values=None):
+        """
+        Evaluates all parameters. values ({name: value}) overrides the
+        values of parameters, free or derived; a value may be an array of
+        the values of a batch of parameter sets. Returns an OrderedDict in
+        model order: floats, or arrays of the broadcast shape of the values
+        for a batch.
+        """
+        values = values or {}
+        unknown = set(values) - set(self.names)
+        if unknown:
+            raise ParameterError("No parameter(s) named {0}".format(
+                                 ', '.join(sorted(unknown))))
+        namespace = self._namespace()
+        batch = []
+        for name, value in values.items():
+            if numpy.ndim(value):
+                value = numpy.asarray(value, dtype=float)
+                batch.append(value)
+            else:
+                value = float(value)
+            namespace[name] = value
+        self._run([name for name in self.expressions if name not in values],
+                  namespace)
+        if not batch:
+            return OrderedDict((name, float(namespace[name]))
+                               for name in self.names)
+        shape = numpy.broadcast_arrays(*batch)[0].shape
+        return OrderedDict((name, numpy.broadcast_to(namespace[name], shape))
+                           for name in self.names)
+
+    def affected(self, name):
+        """
+        The derived parameters whose values depend on parameter name,
+        directly or not, name itself included if it is derived, in
+        dependency order.
+        """
+        if self._dependents is None:
+            self._dependents = {}
+            for derived, refers in self.dependencies.items():
+                for other in refers:
+                    self._dependents.setdefault(other, []).append(derived)
+            self._order = dict((derived, i) for i, derived in
+                               enumerate(self.expressions))
+        found = set([name]) if name in self.expressions else set()
+        stack = [name]
+        while stack:
+            for derived in self._dependents.get(stack.pop(), ()):
+                if derived not in found:
+                    found.add(derived)
+                    stack.append(derived)
+        return sorted(found, key=self._order.get)
+
+    def update(self, name, current):
+        """
+        Evaluates parameter name and the derived parameters that depend on
+        it, see affected. current(other) gives the value of another
+        parameter they refer to, or None if it is not known. Returns an
+        OrderedDict {name: float} in dependency order, or None if a value
+        they need is not known.
+        """
+        names = self.affected(name)
+        namespace = self._namespace()
+        evaluated = set(names)
+        for derived in names:
+            for other in self.dependencies[derived]:
+                if other not in namespace and other not in evaluated:
+                    namespace[other] = current(other)
+                    if namespace[other] is None:
+                        return None
+        self._run(names, namespace)
+        values = OrderedDict()
+        if name in self.constants:
+            values[name] = self.constants[name]
+        for derived in names:
+            values[derived] = float(namespace[derived])
+        return values
+
+    def _changed(self, name, expression):
+        """
+        An evaluator of the same parameters, with the expression of
+        parameter name changed: this one if it is the same, a copy with
+        other constants if it stays a number, else a new one.
+        """
+        if name in self.expressions:
+            if str(expression).strip() == self.expressions[name]:
+                return self
+        else:
+            try:
+                value = float(expression)
+            except (TypeError, ValueError):
+                pass
+            else:
+                evaluator = copy.copy(self)
+                evaluator.constants = OrderedDict(self.constants)
+                evaluator.constants[name] = value
+                return evaluator
+        expressions = OrderedDict((other, self.expressions[other]
+                                   if other in self.expressions
+                                   else self.constants[other])
+                                  for other in self.names)
+        expressions[name] = expression
+        return ParameterEvaluator(expressions)
+
+    def _with(self, expressions):
+        """
+        An evaluator of the parameters with the given expressions (in model
+        order): this one if they are its own, a copy with other constants
+        if only those differ, else a new one.
+        """
+        constants = None
+        if list(expressions) == self.names:
+            constants = OrderedDict()
+            for name, expression in expressions.items():
+                if name in self.expressions:
+                    if str(expression).strip() != self.expressions[name]:
+                        constants = None
+                        break
+                    continue
+                try:
+                    constants[name] = float(expression)
+                except (TypeError, ValueError):
+                    constants = None
+                    break
+        if constants is None:
+            return ParameterEvaluator(expressions)
+        if constants == self.constants:
+            return self
+        evaluator = copy.copy(self)
+        evaluator.constants = constants
+        return evaluator
+
+
+def _expressions(model):
+    """ The expressions of the parameters of model, in model order. """
+    params = model.listOfParameters
+    table = params._table if isinstance(params, _TableDict) else None
+    expressions = OrderedDict()
+    for pname in params:
+        if table is not None and not params.is_built(pname):
+            expressions[pname] = table.rates[params.table_index(pname)]
+        else:
+            expressions[pname] = params[pname].expression
+    return expressions
+
+
+def compile_parameters(model):
+    """
+    The ParameterEvaluator of the parameters of model. The rate parameters
+    of a model built with Model.from_arrays that have not been changed are
+    taken from its arrays, without creating Parameter objects. The
+    evaluator is kept on the model, and reused while the expressions are
+    the same.
+    """
+    expressions = _expressions(model)
+    evaluator = getattr(model, '_parameter_evaluator', None)
+    if evaluator is None:
+        evaluator = ParameterEvaluator(expressions)
+    else:
+        evaluator = evaluator._with(expressions)
+    model._parameter_evaluator = evaluator
+    return evaluator
+
+
+def update_parameter(model, name):
+    """
+    Resolves parameter name of model, after a change of its expression,
+    and the derived parameters that depend on it, with the evaluator kept
+    on the model: the other parameters are not read or evaluated again.
+    Returns their values, {name: value}, or None if they could not be
+    resolved on their own (all parameters must be resolved then).
+    """
+    evaluator = getattr(model, '_parameter_evaluator', None)
+    if evaluator is None or name not in evaluator.names:
+        return None
+    params = model.listOfParameters
+    evaluator = model._parameter_evaluator = evaluator._changed(
+        name, params[name].expression)
+    return evaluator.update(name, lambda other: params[other].value)
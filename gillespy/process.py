@@ -0,0 +1,102 @@
+"""
+Running solver executables. The standard output and error of the child
+process are drained by threads while it runs, so a chatty child never
+blocks on a full pipe, and only their last lines are kept, so a long run
+can not fill up memory with its log.
+"""
+from __future__ import absolute_import
+
+import os
+import signal
+import subprocess
+import threading
+from collections import deque
+
+# Lines of stdout and stderr kept by default
+MAX_LINES = 1000
+
+
+class Process(object):
+    """
+    A child process, started without a shell in a session of its own, so
+    that kill() also stops any processes it started.
+
+    Attributes
+    ----------
+    args : list of str
+        The executable and its arguments.
+    max_lines : int
+        Number of lines kept of each of stdout and stderr; earlier lines
+        are dropped and counted.
+    """
+
+    def __init__(self, args, max_lines=MAX_LINES):
+        self.args = list(args)
+        kwargs = {}
+        if os.name == 'posix':
+            kwargs['start_new_session'] = True
+        self.handle = subprocess.Popen(self.args, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, **kwargs)
+        self._lines = {'stdout': deque(maxlen=max_lines),
+                       'stderr': deque(maxlen=max_lines)}
+        self._count = {'stdout': 0, 'stderr': 0}
+        self._threads = [self._drain('stdout', self.handle.stdout),
+                         self._drain('stderr', self.handle.stderr)]
+
+    def _drain(self, name, stream):
+        lines = self._lines[name]
+
+        def drain():
+            for line in iter(stream.readline, b''):
+                lines.append(line)
+                self._count[name] += 1
+            stream.close()
+        thread = threading.Thread(target=drain, name='gillespy-' + name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    @property
+    def returncode(self):
+        return self.handle.returncode
+
+    def poll(self):
+        """ The return code, or None while the process runs. """
+        return self.handle.poll()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the process to exit and returns its return code. Raises
+        subprocess.TimeoutExpired if it is still running after timeout
+        seconds.
+        """
+        return self.handle.wait(timeout=timeout)
+
+    def kill(self):
+        """ Kills the process and the processes it started. """
+        if self.handle.poll() is not None:
+            return
+        try:
+            if os.name == 'posix':
+                os.killpg(self.handle.pid, signal.SIGKILL)
+            else:
+                self.handle.kill()
+        except OSError:
+            pass  # exited in the meantime
+
+    def output(self, name):
+        """
+        The kept lines of 'stdout' or 'stderr' as a str, noting how many
+        lines were dropped. Once the process has exited, waits for the
+        stream to be drained.
+        """
+        if self.handle.poll() is not None:
+            # Processes started by the child may still hold the pipes open
+            for thread in self._threads:
+                thread.join(5.0)
+        lines = list(self._lines[name])
+        text = b''.join(lines).decode('utf-8', 'replace')
+        dropped = self._count[name] - len(lines)
+        if dropped > 0:
+            text = "[{0} earlier lines dropped]\n{1}".format(dropped, text)
+        return text
@@ -0,0 +1,112 @@
+"""
+Reproducible random numbers for ensembles. Every trajectory draws from its
+own stream, derived from the root seed and the trajectory number with
+NumPy's SeedSequence and generated by the counter-based Philox bit
+generator. The numbers a trajectory gets do not depend on the size of the
+ensemble, on how it is split among batches or workers, or on when the other
+trajectories finish, so any single trajectory can be re-run on its own.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import numpy
+
+
+def root_seed(seed=None):
+    """
+    The root entropy of a run, an int. Without a seed fresh entropy is
+    drawn from the OS; recording the returned value makes the run
+    reproducible.
+    """
+    return numpy.random.SeedSequence(seed).entropy
+
+
+def stochkit_seed(seed=None):
+    """
+    A 31-bit seed for StochKit, which only takes a C int. The seed is
+    hashed by SeedSequence, so wide seeds that differ only in their high
+    bits still give different StochKit seeds.
+    """
+    state = numpy.random.SeedSequence(seed).generate_state(1)
+    return int(state[0] & 0x7fffffff)
+
+
+def trajectory_seed(entropy, index):
+    """ The SeedSequence of trajectory (or batch) number index. """
+    return numpy.random.SeedSequence(entropy, spawn_key=(int(index),))
+
+
+class RandomStreams(object):
+    """
+    One independent Philox stream for each trajectory of an ensemble, with
+    the draws buffered in blocks so that the solvers can take the numbers
+    of all active trajectories in one vectorized call.
+
+    Attributes
+    ----------
+    seed : int
+        Root seed. Defaults to fresh OS entropy, see root_seed.
+    trajectories : list of int
+        The numbers of the trajectories, which select their streams.
+    draws : int
+        Numbers taken per trajectory per step.
+    block : int
+        Steps buffered per refill of a trajectory's buffer. block * draws
+        must be a multiple of 4, the Philox output size, so that each block
+        starts at a counter value and a stream can be positioned at any
+        block without drawing the ones before it.
+    """
+
+    def __init__(self, seed, trajectories, draws=2, block=256):
+        if block * draws % 4:
+            raise ValueError("block * draws must be a multiple of 4")
+        self.entropy = root_seed(seed)
+        self.trajectories = [int(i) for i in trajectories]
+        self.block = block
+        self.buffer = numpy.empty((len(self.trajectories), block, draws))
+        self.generators = [self._generator(i) for i in self.trajectories]
+        self.position = numpy.full(len(self.trajectories), block)
+        self.refills = numpy.zeros(len(self.trajectories), dtype=numpy.int64)
+
+    def _generator(self, trajectory, blocks=0):
+        """ The generator of a trajectory, advanced past blocks blocks. """
+        bit_generator = numpy.random.Philox(trajectory_seed(self.entropy,
+                                                            trajectory))
+        if blocks:
+            bit_generator.advance(blocks * self.buffer[0].size // 4)
+        return numpy.random.Generator(bit_generator)
+
+    def get_state(self):
+        """
+        The position of every stream, (refills, position): the number of
+        blocks drawn and the position in the current block.
+        """
+        return self.refills.copy(), self.position.copy()
+
+    def set_state(self, refills, position):
+        """ Moves every stream to a position returned by get_state. """
+        for row, trajectory in enumerate(self.trajectories):
+            if refills[row]:
+                # A NumPy integer overflows in Philox.advance on NumPy 2
+                self.generators[row] = self._generator(trajectory,
+                                                       int(refills[row]) - 1)
+                self.buffer[row] = self.generators[row].random(
+                    self.buffer.shape[1:])
+        self.refills[:] = refills
+        self.position[:] = position
+
+    def uniform(self, rows):
+        """
+        The next uniform numbers in [0, 1) of each of the given rows (the
+        positions of trajectories in the ensemble), an array of shape
+        (draws, len(rows)).
+        """
+        position = self.position[rows]
+        for row in rows[position == self.block]:
+            self.buffer[row] = self.generators[row].random(
+                self.buffer.shape[1:])
+            self.position[row] = 0
+            self.refills[row] += 1
+        position = self.position[rows]
+        self.position[rows] += 1
+        return self.buffer[rows, position].T
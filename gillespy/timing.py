@@ -0,0 +1,93 @@
+"""
+Instrumentation of solver runs: the wall time and bytes of each phase of a
+run (serializing the model, launching StochKit, simulating, parsing the
+output, ...), and optional profiling of the Python side of a run.
+"""
+from __future__ import division
+from __future__ import absolute_import
+
+import cProfile
+import logging
+import os
+import tempfile
+import timeit
+from collections import OrderedDict
+
+logger = logging.getLogger('gillespy')
+
+
+class PhaseTimer(object):
+    """
+    Records the consecutive phases of a run. A phase lasts from its begin()
+    until the next begin() or end(); a phase that is entered again adds its
+    time and bytes to the earlier ones. The phases are returned in
+    results.metadata['phases'] as {name: {'time': seconds, 'bytes': count}}.
+
+    Attributes
+    ----------
+    callback : callable
+        Called as callback(name, seconds, nbytes) at the end of each phase,
+        with the time and bytes of that stretch of the phase only. Every
+        phase is also logged to the 'gillespy' logger at DEBUG level.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = OrderedDict()
+        self._current = None
+        self._start = None
+        self._bytes = 0
+
+    def begin(self, name):
+        """ Ends the current phase, if any, and starts phase name. """
+        self.end()
+        self.phases.setdefault(name, {'time': 0.0, 'bytes': 0})
+        self._current = name
+        self._start = timeit.default_timer()
+        self._bytes = 0
+
+    def count(self, nbytes):
+        """ Adds nbytes to the bytes of the current phase. """
+        self._bytes += nbytes
+
+    def end(self):
+        """ Ends the current phase. """
+        if self._current is None:
+            return
+        name, elapsed = self._current, timeit.default_timer() - self._start
+        self._current = None
+        phase = self.phases[name]
+        phase['time'] += elapsed
+        phase['bytes'] += self._bytes
+        logger.debug("phase %s: %.6f s, %d bytes", name, elapsed,
+                     self._bytes)
+        if self.callback is not None:
+            self.callback(name, elapsed, self._bytes)
+
+
+def directory_size(path):
+    """ Total size in bytes of the files under path. """
+    return sum(os.path.getsize(os.path.join(root, filename))
+               for root, _, filenames in os.walk(path)
+               for filename in filenames)
+
+
+def profiled(profile, function, *args, **kwargs):
+    """
+    Calls function(*args, **kwargs) under cProfile and dumps the statistics
+    to the file profile, or to a new temporary file if profile is True. The
+    path is recorded in results.metadata['profile'] of the returned results;
+    load it with pstats.Stats(path).
+    """
+    if profile is True:
+        handle, profile = tempfile.mkstemp(prefix='gillespy_',
+                                           suffix='.prof')
+        os.close(handle)
+    profiler = cProfile.Profile()
+    results = profiler.runcall(function, *args, **kwargs)
+    profiler.dump_stats(profile)
+    logger.debug("profile written to %s", profile)
+    metadata = getattr(results, 'metadata', None)
+    if metadata is not None:
+        metadata['profile'] = profile
+    return results
@@ -0,0 +1,375 @@
+"""
+The backend registry and solver selection in Model.run (backends.py).
+"""
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy
+
+import gillespy
+from gillespy import backends
+from gillespy.backends import (analyze_model, choose_backend,
+                               find_executable, executable_options,
+                               select_backend)
+from gillespy.native import NumPySSASolver
+
+
+def birth_death(birth=10.0, death=0.1, initial_value=0, t=20):
+    """ 0 -> A -> 0 """
+    model = gillespy.Model(name='birth_death')
+    k = gillespy.Parameter(name='k', expression=birth)
+    g = gillespy.Parameter(name='g', expression=death)
+    model.add_parameter([k, g])
+    A = gillespy.Species(name='A', initial_value=initial_value)
+    model.add_species([A])
+    model.add_reaction([
+        gillespy.Reaction(name='birth', reactants={}, products={A: 1},
+                          rate=k),
+        gillespy.Reaction(name='death', reactants={A: 1}, products={},
+                          rate=g)])
+    model.timespan(numpy.linspace(0, t, 21))
+    return model
+
+
+def stiff(population, t=10):
+    """
+    A <-> B, fast, and C -> 0, slow: reaction time scales spanning a
+    factor of about 1e6.
+    """
+    model = gillespy.Model(name='stiff')
+    fast = gillespy.Parameter(name='fast', expression=100.0)
+    slow = gillespy.Parameter(name='slow', expression=1e-4)
+    model.add_parameter([fast, slow])
+    A = gillespy.Species(name='A', initial_value=population)
+    B = gillespy.Species(name='B', initial_value=population)
+    C = gillespy.Species(name='C', initial_value=500)
+    model.add_species([A, B, C])
+    model.add_reaction([
+        gillespy.Reaction(name='forward', reactants={A: 1}, products={B: 1},
+                          rate=fast),
+        gillespy.Reaction(name='backward', reactants={B: 1},
+                          products={A: 1}, rate=fast),
+        gillespy.Reaction(name='decay', reactants={C: 1}, products={},
+                          rate=slow)])
+    model.timespan(numpy.linspace(0, t, 11))
+    return model
+
+
+def write_executable(directory, name='ssa', output='usage'):
+    """ A fake StochKit executable that prints output. """
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        f.write("#!/bin/sh\necho '{0}'\n".format(output))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+class TestExecutables(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.home = os.path.join(self.directory, 'home')
+        self.bin = os.path.join(self.directory, 'bin')
+        os.mkdir(self.home)
+        os.mkdir(self.bin)
+        self.environ = mock.patch.dict(os.environ, {'STOCHKIT_HOME':
+                                                    self.home,
+                                                    'PATH': self.bin})
+        self.environ.start()
+        backends.clear_cache()
+
+    def tearDown(self):
+        self.environ.stop()
+        backends.clear_cache()
+        shutil.rmtree(self.directory)
+
+    def test_found_in_order(self):
+        self.assertIsNone(find_executable('ssa'))
+        backends.clear_cache()
+        on_path = write_executable(self.bin)
+        self.assertEqual(find_executable('ssa'), on_path)
+        backends.clear_cache()
+        in_home = write_executable(self.home)
+        self.assertEqual(find_executable('ssa'), in_home)
+        missing = os.path.join(self.directory, 'missing')
+        self.assertIsNone(find_executable('ssa', stochkit_home=missing))
+        self.assertEqual(find_executable('ssa', stochkit_home=self.bin),
+                         on_path)
+
+    def test_cached(self):
+        # A miss is cached until clear_cache
+        self.assertIsNone(find_executable('ssa'))
+        in_home = write_executable(self.home)
+        self.assertIsNone(find_executable('ssa'))
+        backends.clear_cache()
+        self.assertEqual(find_executable('ssa'), in_home)
+        # So is a hit, as long as the executable exists
+        on_path = write_executable(self.bin)
+        self.assertEqual(find_executable('ssa'), in_home)
+        os.remove(in_home)
+        self.assertEqual(find_executable('ssa'), on_path)
+
+    def test_key(self):
+        self.assertIsNone(find_executable('ssa'))
+        other = os.path.join(self.directory, 'other')
+        os.mkdir(other)
+        path = write_executable(other)
+        # A different STOCHKIT_HOME or PATH is looked up again
+        os.environ['STOCHKIT_HOME'] = other
+        self.assertEqual(find_executable('ssa'), path)
+        os.environ['STOCHKIT_HOME'] = self.home
+        self.assertIsNone(find_executable('ssa'))
+        os.environ['PATH'] = os.pathsep.join([self.bin, other])
+        self.assertEqual(find_executable('ssa'), path)
+
+    def test_options(self):
+        path = write_executable(self.bin, output="usage: ssa --model FILE "
+                                "--time T [--method NAME] -h, --help")
+        self.assertEqual(executable_options(path),
+                         {'--model', '--time', '--method', '--help'})
+        # Probed again once the executable changes
+        write_executable(self.bin, output="usage: ssa --model-file FILE")
+        future = time.time() + 10
+        os.utime(path, (future, future))
+        self.assertEqual(executable_options(path), {'--model-file'})
+
+    def test_options_of_broken_executable(self):
+        path = os.path.join(self.bin, 'ssa')
+        with open(path, 'w') as f:
+            f.write('not an executable')
+        self.assertEqual(executable_options(path), frozenset())
+
+    def test_backend_executable(self):
+        backend = backends.get_backend('stochkit_ssa')
+        self.assertFalse(backend.available())
+        backends.clear_cache()
+        path = write_executable(self.home, output="--method")
+        self.assertTrue(backend.available())
+        self.assertEqual(backend.executable(), path)
+        self.assertEqual(backend.options(), {'--method'})
+        native = backends.get_backend('numpy_ssa')
+        self.assertTrue(native.available())
+        self.assertEqual(native.options(), frozenset())
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        # No StochKit installed
+        self.home = tempfile.mkdtemp()
+        backends.clear_cache()
+
+    def tearDown(self):
+        backends.clear_cache()
+        shutil.rmtree(self.home)
+
+    def test_order(self):
+        self.assertEqual(list(backends.BACKENDS),
+                         ['stochkit_ssa', 'stochkit_tau_leaping',
+                          'numpy_ssa', 'scipy_ode', 'stochkit_ode',
+                          'moments'])
+        self.assertEqual([b.name for b in backends.available_backends(
+            self.home)], ['numpy_ssa', 'scipy_ode', 'moments'])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(gillespy.SimulationError):
+            backends.get_backend('hybrid')
+
+    def test_select(self):
+        model = birth_death()
+        self.assertEqual(select_backend(model, stochkit_home=self.home).name,
+                         'numpy_ssa')
+        self.assertEqual(select_backend(model, stochastic=False,
+                                        stochkit_home=self.home).name,
+                         'scipy_ode')
+
+    def test_select_fails_with_reasons(self):
+        model = birth_death()
+        model.set_units("concentration")
+        with self.assertRaises(gillespy.SimulationError) as context:
+            select_backend(model, stochkit_home=self.home)
+        message = str(context.exception)
+        self.assertIn("stochkit_ssa is not installed", message)
+        self.assertIn("numpy_ssa only simulates population models", message)
+
+
+class TestTimeout(unittest.TestCase):
+
+    def test_default_solver(self):
+        model = birth_death()
+        results = model.run(seed=1, timeout=60, show_labels=False)
+        self.assertIn(results.metadata['backend'],
+                      ('stochkit_ssa', 'numpy_ssa'))
+
+    def test_auto(self):
+        model = birth_death()
+        results = model.run(solver='auto', seed=1, timeout=60,
+                            show_labels=False)
+        self.assertEqual(results.metadata['solver_selection']['method'],
+                         'ssa')
+
+    def test_auto_ode(self):
+        # Large populations call for the reaction rate equations, with or
+        # without a timeout
+        model = birth_death(1e6, 0.1, 10 ** 7, t=10)
+        for timeouts in (False, True):
+            backend, decision = choose_backend(model, timeouts=timeouts)
+            self.assertEqual(decision['method'], 'ode')
+            self.assertEqual(backend.name, 'scipy_ode')
+
+    def test_ode_timeout(self):
+        model = birth_death(1e6, 0.1, 10 ** 7, t=10)
+        with self.assertRaises(gillespy.SimulationError):
+            gillespy.SciPyODESolver.run(model, tspan=model.tspan, timeout=0)
+        results = gillespy.SciPyODESolver.run(model, tspan=model.tspan,
+                                              timeout=60)
+        self.assertEqual(len(results[0]), len(model.tspan))
+
+    def test_native_timeout(self):
+        model = birth_death(1e6, 1.0, t=1000)
+        with self.assertRaises(gillespy.SimulationError):
+            NumPySSASolver.run(model, tspan=model.tspan, timeout=0.05)
+
+    def test_precision_timeout(self):
+        model = birth_death(1e6, 1.0, t=1000)
+        precision = gillespy.Precision(0.01, batch_size=2,
+                                       max_trajectories=2, processes=1)
+        for solver in (None, 'auto'):
+            with self.assertRaises(gillespy.SimulationError):
+                model.run(solver=solver, precision=precision, timeout=0.05)
+
+    def test_precision_solver_without_timeout(self):
+        precision = gillespy.Precision(1.0, processes=1)
+        with self.assertRaises(gillespy.SimulationError):
+            birth_death().run(solver=gillespy.MomentSolver,
+                              precision=precision, timeout=60)
+
+    def test_solver_without_timeout(self):
+        with self.assertRaises(gillespy.SimulationError):
+            birth_death().run(solver=gillespy.MomentSolver, timeout=60)
+
+
+class TestAnalyzeModel(unittest.TestCase):
+
+    def test_events(self):
+        # The expected number of events is the integral of the total
+        # propensity: k t births and as many deaths at steady state
+        model = birth_death(10.0, 0.1, initial_value=100, t=20)
+        analysis = analyze_model(model)
+        self.assertAlmostEqual(analysis['events'], 400, delta=5)
+        self.assertAlmostEqual(analysis['min_population'], 100, delta=5)
+
+    def test_integration_failure(self):
+        # Falls back to the initial state
+        model = birth_death(10.0, 0.1, initial_value=100, t=20)
+        failure = gillespy.SimulationError("ODE integration failed")
+        with mock.patch('gillespy.native.ode', side_effect=failure):
+            analysis = analyze_model(model)
+        self.assertAlmostEqual(analysis['events'], 400)
+
+    def test_errors_propagate(self):
+        model = birth_death()
+        with mock.patch('gillespy.native.ode',
+                        side_effect=ZeroDivisionError):
+            with self.assertRaises(ZeroDivisionError):
+                analyze_model(model)
+
+
+class TestChooseBackend(unittest.TestCase):
+
+    def setUp(self):
+        # No StochKit installed
+        self.home = tempfile.mkdtemp()
+        backends.clear_cache()
+
+    def tearDown(self):
+        backends.clear_cache()
+        shutil.rmtree(self.home)
+
+    def choose(self, model, **kwargs):
+        return choose_backend(model, stochkit_home=self.home, **kwargs)
+
+    def test_few_events(self):
+        backend, decision = self.choose(birth_death())
+        self.assertEqual(decision['method'], 'ssa')
+        self.assertEqual(backend.name, 'numpy_ssa')
+        self.assertIn('exact SSA is cheap', decision['reason'])
+
+    def test_large_populations(self):
+        backend, decision = self.choose(birth_death(1e6, 0.1, 10 ** 7,
+                                                    t=10))
+        self.assertEqual(decision['method'], 'ode')
+        self.assertEqual(backend.name, 'scipy_ode')
+        # Only stochastic methods
+        backend, decision = self.choose(birth_death(1e6, 0.1, 10 ** 7,
+                                                    t=10),
+                                        stochastic_only=True)
+        self.assertEqual(decision['method'], 'tau_leaping')
+
+    def test_stiff_large_populations(self):
+        # C is small, but the fast reactions among the large A and B cost
+        # exact SSA most of its time
+        backend, decision = self.choose(stiff(10 ** 5))
+        analysis = decision['analysis']
+        self.assertGreater(analysis['timescale_spread'],
+                           backends.STIFF_SPREAD)
+        self.assertLess(analysis['min_population'], backends.ODE_POPULATION)
+        self.assertEqual(decision['method'], 'ode')
+        self.assertEqual(backend.name, 'scipy_ode')
+        self.assertIn('stiff', decision['reason'])
+
+    def test_stiff(self):
+        # Populations large enough for tau-leaping, but the model is stiff
+        backend, decision = self.choose(stiff(500))
+        self.assertGreaterEqual(decision['analysis']['min_population'],
+                                backends.TAU_POPULATION)
+        self.assertEqual(decision['method'], 'ssa')
+        self.assertEqual(backend.name, 'numpy_ssa')
+        self.assertIn('too stiff for tau-leaping', decision['reason'])
+        # The same with large populations, when only stochastic methods
+        # may be used
+        backend, decision = self.choose(stiff(10 ** 5),
+                                        stochastic_only=True)
+        self.assertEqual(decision['method'], 'ssa')
+
+    def test_tau_leaping(self):
+        model = birth_death(1e4, 10.0, initial_value=1000, t=100)
+        backend, decision = self.choose(model)
+        self.assertLess(decision['analysis']['timescale_spread'],
+                        backends.STIFF_SPREAD)
+        self.assertEqual(decision['method'], 'tau_leaping')
+        # StochKit is not installed
+        self.assertEqual(backend.name, 'numpy_ssa')
+        self.assertIn('no tau-leaping backend', decision['reason'])
+        write_executable(self.home, name='tau_leaping')
+        backends.clear_cache()
+        backend, decision = self.choose(model)
+        self.assertEqual(backend.name, 'stochkit_tau_leaping')
+        backend, decision = self.choose(model, external=False)
+        self.assertEqual(backend.name, 'numpy_ssa')
+
+    def test_small_populations(self):
+        model = birth_death(500.0, 10.0, initial_value=50, t=200)
+        backend, decision = self.choose(model)
+        self.assertGreater(decision['analysis']['events'],
+                           backends.SSA_EVENTS)
+        self.assertEqual(decision['method'], 'ssa')
+        self.assertIn('too small for tau-leaping', decision['reason'])
+
+    def test_concentration(self):
+        model = birth_death()
+        model.set_units("concentration")
+        backend, decision = self.choose(model)
+        self.assertEqual(decision['method'], 'ode')
+        self.assertEqual(backend.name, 'scipy_ode')
+        with self.assertRaises(gillespy.SimulationError):
+            self.choose(model, stochastic_only=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
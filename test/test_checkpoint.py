@@ -0,0 +1,105 @@
+"""
+Checkpoints of NumPySSASolver runs: a run stopped part way and resumed from
+its checkpoint gives the same output as a run that was never stopped.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.checkpoint import Checkpoint
+from gillespy.native import NumPySSASolver
+
+
+def birth_death(events=False):
+    """ 0 -> A -> 0, with an event that resets A above a threshold. """
+    model = gillespy.Model(name='birth_death')
+    birth = gillespy.Parameter(name='birth', expression=10.0)
+    death = gillespy.Parameter(name='death', expression=0.1)
+    model.add_parameter([birth, death])
+    A = gillespy.Species(name='A', initial_value=0)
+    model.add_species([A])
+    model.add_reaction([
+        gillespy.Reaction(name='r1', reactants={}, products={A: 1},
+                          rate=birth),
+        gillespy.Reaction(name='r2', reactants={A: 1}, products={},
+                          rate=death)])
+    if events:
+        model.add_event(gillespy.Event(name='reset', trigger='A > 80',
+                                       assignments={'A': '20'}))
+    model.timespan(numpy.linspace(0, 50, 101))
+    return model
+
+
+class Stop(Exception):
+    pass
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'run.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertResumed(self, model, expected):
+        resumed = NumPySSASolver.run(model, resume_from=self.filename)
+        self.assertEqual(len(resumed), len(expected))
+        for trajectory, full in zip(resumed, expected):
+            numpy.testing.assert_array_equal(trajectory, full)
+
+    def test_resume_aborted_run(self):
+        model = birth_death()
+        expected = NumPySSASolver.run(model, seed=5, number_of_trajectories=4)
+        aborted = NumPySSASolver.run(model, seed=5, number_of_trajectories=4,
+                                     checkpoint=self.filename,
+                                     progress=lambda progress: False,
+                                     progress_interval=0)
+        self.assertTrue(aborted.metadata['aborted'])
+        self.assertFalse(Checkpoint.load(self.filename).complete)
+        self.assertResumed(model, expected)
+
+    def test_resume_after_crash(self):
+        # The run dies part way; the last periodic checkpoint is resumed
+        for events in (False, True):
+            model = birth_death(events)
+            expected = NumPySSASolver.run(model, seed=3,
+                                          number_of_trajectories=3)
+            calls = []
+
+            def progress(progress):
+                calls.append(progress)
+                if len(calls) == 5:
+                    raise Stop()
+            with self.assertRaises(Stop):
+                NumPySSASolver.run(model, seed=3, number_of_trajectories=3,
+                                   checkpoint=self.filename,
+                                   checkpoint_interval=0, progress=progress,
+                                   progress_interval=0)
+            self.assertFalse(Checkpoint.load(self.filename).complete)
+            self.assertResumed(model, expected)
+
+    def test_save_replaces(self):
+        model = birth_death()
+        NumPySSASolver.run(model, seed=1, checkpoint=self.filename)
+        NumPySSASolver.run(model, seed=2, checkpoint=self.filename)
+        self.assertEqual(os.listdir(self.directory), ['run.npz'])
+        self.assertTrue(Checkpoint.load(self.filename).complete)
+        self.assertEqual(Checkpoint.load(self.filename).seed,
+                         gillespy.streams.root_seed(2))
+
+    def test_precision_rejects_initial_state(self):
+        model = birth_death()
+        results = NumPySSASolver.run(model, seed=1)
+        with self.assertRaises(gillespy.SimulationError):
+            model.run(precision=gillespy.Precision(1.0, processes=1),
+                      initial_state=results)
+
+
+if __name__ == '__main__':
+    unittest.main()
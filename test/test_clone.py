@@ -0,0 +1,110 @@
+"""
+Model.clone: variants of a model share its objects, copied on write.
+"""
+import pickle
+import unittest
+from collections import OrderedDict
+
+import numpy
+
+import gillespy
+
+
+def dimerization():
+    """ 2 A <-> B """
+    model = gillespy.Model(name='dimerization')
+    k1 = gillespy.Parameter(name='k1', expression=0.005)
+    k2 = gillespy.Parameter(name='k2', expression='20 * k1')
+    model.add_parameter([k1, k2])
+    A = gillespy.Species(name='A', initial_value=50)
+    B = gillespy.Species(name='B', initial_value=0)
+    model.add_species([A, B])
+    model.add_reaction([
+        gillespy.Reaction(name='dimerize', reactants={A: 2}, products={B: 1},
+                          rate=k1),
+        gillespy.Reaction(name='split', reactants={B: 1}, products={A: 2},
+                          rate=k2)])
+    model.timespan(numpy.linspace(0, 10, 11))
+    model.resolve_parameters()
+    return model
+
+
+class TestClone(unittest.TestCase):
+
+    def test_original_unchanged(self):
+        model = dimerization()
+        before = pickle.dumps(model)
+        model.clone({'k1': 0.01})
+        for attribute in ('listOfSpecies', 'listOfParameters',
+                          'listOfReactions', 'listOfEvents'):
+            self.assertIs(type(getattr(model, attribute)), OrderedDict)
+        self.assertEqual(pickle.dumps(model), before)
+
+    def test_overrides(self):
+        model = dimerization()
+        clone = model.clone({'k1': 0.01, 'A': 80}, name='variant')
+        self.assertEqual(clone.name, 'variant')
+        self.assertEqual(clone.listOfParameters['k1'].value, 0.01)
+        # Dependent parameters are evaluated again
+        self.assertAlmostEqual(clone.listOfParameters['k2'].value, 0.2)
+        self.assertEqual(clone.listOfSpecies['A'].initial_value, 80)
+        self.assertEqual(model.listOfParameters['k1'].value, 0.005)
+        self.assertAlmostEqual(model.listOfParameters['k2'].value, 0.1)
+        self.assertEqual(model.listOfSpecies['A'].initial_value, 50)
+        # Unchanged objects are shared
+        self.assertIs(clone.listOfSpecies['B'], model.listOfSpecies['B'])
+        self.assertIs(clone.listOfReactions['split'],
+                      model.listOfReactions['split'])
+        with self.assertRaises(gillespy.ModelError):
+            model.clone({'C': 1})
+
+    def test_changes_to_the_model(self):
+        model = dimerization()
+        clone = model.clone()
+        model.set_parameter('k1', '0.02')
+        model.add_species([gillespy.Species(name='C', initial_value=1)])
+        model.delete_species('B')
+        self.assertAlmostEqual(model.listOfParameters['k2'].value, 0.4)
+        self.assertEqual(clone.listOfParameters['k1'].value, 0.005)
+        self.assertAlmostEqual(clone.listOfParameters['k2'].value, 0.1)
+        self.assertEqual(list(clone.listOfSpecies), ['A', 'B'])
+
+    def test_changes_to_the_clone(self):
+        model = dimerization()
+        clone = model.clone()
+        clone.set_parameter('k1', '0.02')
+        clone.delete_species('B')
+        self.assertEqual(model.listOfParameters['k1'].value, 0.005)
+        self.assertAlmostEqual(model.listOfParameters['k2'].value, 0.1)
+        self.assertEqual(list(model.listOfSpecies), ['A', 'B'])
+        self.assertEqual(list(clone.listOfSpecies), ['A'])
+
+    def test_clones_share_a_snapshot(self):
+        model = dimerization()
+        first, second = model.clone(), model.clone()
+        self.assertIs(first.listOfSpecies._base, second.listOfSpecies._base)
+        model.set_parameter('k1', '0.02')
+        third = model.clone()
+        self.assertIsNot(third.listOfParameters._base,
+                         first.listOfParameters._base)
+        self.assertEqual(third.listOfParameters['k1'].value, 0.02)
+        self.assertEqual(first.listOfParameters['k1'].value, 0.005)
+
+    def test_clone_of_clone(self):
+        model = dimerization()
+        clone = model.clone({'k1': 0.01})
+        grandchild = clone.clone({'A': 10})
+        clone.set_parameter('k1', '0.03')
+        self.assertEqual(grandchild.listOfParameters['k1'].value, 0.01)
+        self.assertEqual(grandchild.listOfSpecies['A'].initial_value, 10)
+        self.assertEqual(clone.listOfSpecies['A'].initial_value, 50)
+
+    def test_pickle_clone(self):
+        clone = dimerization().clone({'k1': 0.01})
+        copy = pickle.loads(pickle.dumps(clone))
+        self.assertEqual(list(copy.listOfSpecies), ['A', 'B'])
+        self.assertEqual(copy.listOfParameters['k1'].value, 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Conservation laws, and the ODE and moment solvers integrating only the
+species the laws do not determine.
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.compiled import compile_model
+from gillespy.conservation import conservation_laws
+from gillespy.moments import MomentSolver, moments
+from gillespy.native import SciPyODESolver, ode
+
+TSPAN = numpy.linspace(0, 50, 51)
+
+
+def michaelis_menten():
+    """ E + S <-> ES -> E + P """
+    model = gillespy.Model(name='michaelis_menten')
+    kf = gillespy.Parameter(name='kf', expression=0.01)
+    kr = gillespy.Parameter(name='kr', expression=0.1)
+    kcat = gillespy.Parameter(name='kcat', expression=0.5)
+    model.add_parameter([kf, kr, kcat])
+    E = gillespy.Species(name='E', initial_value=20)
+    S = gillespy.Species(name='S', initial_value=200)
+    ES = gillespy.Species(name='ES', initial_value=0)
+    P = gillespy.Species(name='P', initial_value=0)
+    model.add_species([E, S, ES, P])
+    model.add_reaction([
+        gillespy.Reaction(name='bind', reactants={E: 1, S: 1},
+                          products={ES: 1}, rate=kf),
+        gillespy.Reaction(name='unbind', reactants={ES: 1},
+                          products={E: 1, S: 1}, rate=kr),
+        gillespy.Reaction(name='convert', reactants={ES: 1},
+                          products={E: 1, P: 1}, rate=kcat)])
+    model.timespan(TSPAN)
+    return model
+
+
+class TestConservationLaws(unittest.TestCase):
+
+    def test_laws(self):
+        compiled = compile_model(michaelis_menten())
+        laws = conservation_laws(compiled)
+        self.assertEqual(len(laws), 2)
+        self.assertEqual(laws.dependent_names, ['ES', 'P'])
+        numpy.testing.assert_array_equal(laws.independent, [0, 1])
+        # No reaction changes the laws' totals
+        numpy.testing.assert_allclose(
+            laws.matrix.dot(compiled.stoichiometry.T), 0, atol=1e-12)
+        # The dependent species follow from the independent ones
+        x0 = numpy.array([20.0, 200.0, 0.0, 0.0])
+        x = numpy.array([15.0, 150.0, 5.0, 45.0])
+        numpy.testing.assert_allclose(laws.expand(x[laws.independent], x0),
+                                      x)
+        numpy.testing.assert_allclose(laws.totals(x), laws.totals(x0))
+        numpy.testing.assert_allclose(laws.transform[laws.dependent],
+                                      laws.coefficients)
+
+    def test_no_laws(self):
+        # 0 -> A -> 0
+        model = gillespy.Model.from_arrays(['A'], [0], [[1, -1]],
+                                           [10.0, 0.5])
+        self.assertEqual(len(conservation_laws(model)), 0)
+
+    def test_events(self):
+        # E is changed by an event, so E + ES is no longer conserved
+        model = michaelis_menten()
+        model.add_event(gillespy.Event(name='more', trigger='t >= 10',
+                                       assignments={'E': '40'}))
+        laws = conservation_laws(model)
+        self.assertEqual(len(laws), 1)
+        # S + ES + P
+        self.assertEqual(laws.matrix[0, 0], 0)
+        self.assertEqual(laws.matrix[0, 2], laws.matrix[0, 3])
+
+
+class TestReduction(unittest.TestCase):
+
+    def test_ode(self):
+        compiled = compile_model(michaelis_menten())
+        reduced = ode(compiled, TSPAN)
+        full = ode(compiled, TSPAN, reduce=False)
+        self.assertEqual(reduced.shape, full.shape)
+        numpy.testing.assert_allclose(reduced, full, rtol=1e-5, atol=1e-3)
+        # The totals are conserved exactly
+        laws = conservation_laws(compiled)
+        totals = laws.totals(reduced[0])
+        numpy.testing.assert_allclose(totals - totals[0], 0, atol=1e-9)
+
+    def test_ode_solver(self):
+        results = SciPyODESolver.run(michaelis_menten(), t=50, increment=1)
+        self.assertEqual(results.metadata['conserved'], ['ES', 'P'])
+        E, ES = results[0][:, 1], results[0][:, 3]
+        numpy.testing.assert_allclose(E + ES, 20)
+
+    def test_events(self):
+        model = michaelis_menten()
+        model.add_event(gillespy.Event(name='more', trigger='t >= 10',
+                                       assignments={'E': '40'}))
+        compiled = compile_model(model)
+        numpy.testing.assert_allclose(ode(compiled, TSPAN),
+                                      ode(compiled, TSPAN, reduce=False),
+                                      rtol=1e-5, atol=1e-3)
+
+    def test_moments(self):
+        compiled = compile_model(michaelis_menten())
+        for algorithm in ('lna', 'normal'):
+            mean, covariance = moments(compiled, TSPAN, algorithm)
+            full_mean, full_covariance = moments(compiled, TSPAN, algorithm,
+                                                 reduce=False)
+            numpy.testing.assert_allclose(mean, full_mean, rtol=1e-5,
+                                          atol=1e-3)
+            numpy.testing.assert_allclose(covariance, full_covariance,
+                                          rtol=1e-4, atol=1e-3)
+        results = MomentSolver.run(michaelis_menten(), t=50, increment=1)
+        self.assertEqual(results.metadata['conserved'], ['ES', 'P'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Event logs of NumPySSASolver (record_events): every reaction firing is
+recorded, and states are decoded from the log on any grid.
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.native import EventLog, NumPySSASolver
+
+
+def isomerization():
+    """ A <-> B """
+    model = gillespy.Model(name='isomerization')
+    k1 = gillespy.Parameter(name='k1', expression=0.5)
+    k2 = gillespy.Parameter(name='k2', expression=0.2)
+    model.add_parameter([k1, k2])
+    A = gillespy.Species(name='A', initial_value=30)
+    B = gillespy.Species(name='B', initial_value=10)
+    model.add_species([A, B])
+    model.add_reaction([
+        gillespy.Reaction(name='forward', reactants={A: 1}, products={B: 1},
+                          rate=k1),
+        gillespy.Reaction(name='backward', reactants={B: 1}, products={A: 1},
+                          rate=k2)])
+    return model
+
+
+class TestEventLog(unittest.TestCase):
+
+    def log(self):
+        log = EventLog(['A', 'B'], ['forward', 'backward'], [30, 10],
+                       [[-1, 1], [1, -1]], t_end=10.0)
+        log.append([0.5, 1.0], [0, 0])
+        log.append([2.5], [1])
+        return log
+
+    def test_records(self):
+        log = self.log()
+        self.assertEqual(len(log), 3)
+        self.assertEqual(len(log.buffer), 3 * 12)
+        numpy.testing.assert_array_equal(log.times, [0.5, 1.0, 2.5])
+        numpy.testing.assert_array_equal(log.reactions, [0, 0, 1])
+
+    def test_state(self):
+        log = self.log()
+        # A firing at a grid time is included in the state at that time
+        numpy.testing.assert_array_equal(
+            log.state([0, 0.5, 0.75, 1.0, 3, 10]),
+            [[30, 10], [29, 11], [29, 11], [28, 12], [29, 11], [29, 11]])
+        trajectory = log.trajectory([0, 2, 4], show_labels=True)
+        numpy.testing.assert_array_equal(trajectory['time'], [0, 2, 4])
+        numpy.testing.assert_array_equal(trajectory['A'], [30, 28, 29])
+        numpy.testing.assert_array_equal(log.trajectory([0, 2])[:, 2],
+                                         [10, 12])
+        with self.assertRaises(gillespy.SimulationError):
+            log.state([0, 11])
+
+
+class TestRecordEvents(unittest.TestCase):
+
+    def test_logs(self):
+        results = NumPySSASolver.run(isomerization(), t=10, seed=1,
+                                     number_of_trajectories=3,
+                                     record_events=True)
+        self.assertEqual(len(results), 3)
+        for log in results:
+            self.assertIsInstance(log, EventLog)
+            self.assertEqual(log.t_end, 10)
+            times = log.times
+            self.assertGreater(len(times), 0)
+            self.assertTrue(numpy.all(numpy.diff(times) >= 0))
+            self.assertTrue(0 <= times[0] and times[-1] <= 10)
+            # Each firing changes the state by its reaction's stoichiometry
+            states = log.state(times)
+            previous = numpy.vstack([[30, 10], states[:-1]])
+            numpy.testing.assert_array_equal(
+                states - previous, log.stoichiometry[log.reactions])
+            numpy.testing.assert_array_equal(states.sum(1), 40)
+
+    def test_grid(self):
+        # Any grid can be decoded afterwards, fine or coarse
+        log = NumPySSASolver.run(isomerization(), t=10, seed=2,
+                                 record_events=True)[0]
+        fine = log.trajectory(numpy.linspace(0, 10, 1001))
+        coarse = log.trajectory([0, 5, 10])
+        numpy.testing.assert_array_equal(fine[::500], coarse)
+        final = numpy.array([30, 10]) + \
+            log.stoichiometry[log.reactions].sum(0)
+        numpy.testing.assert_array_equal(coarse[-1, 1:], final)
+
+    def test_unsupported(self):
+        model = isomerization()
+        model.add_event(gillespy.Event(name='reset', trigger='t >= 5',
+                                       assignments={'A': '30'}))
+        with self.assertRaises(gillespy.SimulationError):
+            NumPySSASolver.run(model, t=10, record_events=True)
+        with self.assertRaises(gillespy.SimulationError):
+            NumPySSASolver.run(isomerization(), t=10, record_events=True,
+                               timeout=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
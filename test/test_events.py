@@ -0,0 +1,220 @@
+"""
+Events, assignment and rate rules, natively and imported from SBML with
+function definitions, against known trajectories.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.native import NumPySSASolver, SciPyODESolver
+
+try:
+    import libsbml
+except ImportError:
+    libsbml = None
+
+
+def refilled_decay():
+    """
+    A -> 0 at rate k, with A refilled to 100 at t = 5, B = 2 A and
+    dC/dt = 1.
+    """
+    model = gillespy.Model(name='refilled_decay')
+    k = gillespy.Parameter(name='k', expression=0.5)
+    model.add_parameter([k])
+    A = gillespy.Species(name='A', initial_value=100)
+    B = gillespy.Species(name='B', initial_value=0)
+    C = gillespy.Species(name='C', initial_value=0)
+    model.add_species([A, B, C])
+    model.add_reaction([gillespy.Reaction(name='decay', reactants={A: 1},
+                                          products={}, rate=k)])
+    model.add_event(gillespy.Event(name='refill', trigger='t >= 5',
+                                   assignments={A: '100'}))
+    model.add_rule([gillespy.AssignmentRule(B, '2 * A'),
+                    gillespy.RateRule(C, '1')])
+    return model
+
+
+def expected_A(t):
+    """ A of refilled_decay, solved. """
+    return numpy.where(t < 5, 100 * numpy.exp(-0.5 * t),
+                       100 * numpy.exp(-0.5 * (t - 5)))
+
+
+def write_sbml(filename):
+    """
+    refilled_decay in SBML, with the kinetic law and the rule for B
+    written as calls of function definitions, and C a parameter.
+    """
+    document = libsbml.SBMLDocument(3, 1)
+    model = document.createModel()
+    model.setId('refilled_decay')
+    for name, formula in (('mass_action', 'lambda(rate, x, rate * x)'),
+                          ('double', 'lambda(x, 2 * x)')):
+        function = model.createFunctionDefinition()
+        function.setId(name)
+        function.setMath(libsbml.parseL3Formula(formula))
+    compartment = model.createCompartment()
+    compartment.setId('cell')
+    compartment.setSize(1.0)
+    compartment.setConstant(True)
+    for name, value in (('A', 100), ('B', 0)):
+        species = model.createSpecies()
+        species.setId(name)
+        species.setCompartment('cell')
+        species.setInitialAmount(value)
+        species.setHasOnlySubstanceUnits(True)
+        species.setBoundaryCondition(False)
+        species.setConstant(False)
+    for name, value, constant in (('k', 0.5, True), ('C', 0.0, False)):
+        parameter = model.createParameter()
+        parameter.setId(name)
+        parameter.setValue(value)
+        parameter.setConstant(constant)
+    reaction = model.createReaction()
+    reaction.setId('decay')
+    reaction.setReversible(False)
+    reaction.setFast(False)
+    reactant = reaction.createReactant()
+    reactant.setSpecies('A')
+    reactant.setStoichiometry(1)
+    reactant.setConstant(True)
+    law = reaction.createKineticLaw()
+    law.setMath(libsbml.parseL3Formula('mass_action(k, A)'))
+    rule = model.createAssignmentRule()
+    rule.setVariable('B')
+    rule.setMath(libsbml.parseL3Formula('double(A)'))
+    rule = model.createRateRule()
+    rule.setVariable('C')
+    rule.setMath(libsbml.parseL3Formula('1'))
+    event = model.createEvent()
+    event.setId('refill')
+    event.setUseValuesFromTriggerTime(True)
+    trigger = event.createTrigger()
+    trigger.setMath(libsbml.parseL3Formula('time >= 5'))
+    trigger.setInitialValue(False)
+    trigger.setPersistent(True)
+    assignment = event.createEventAssignment()
+    assignment.setVariable('A')
+    assignment.setMath(libsbml.parseL3Formula('100'))
+    libsbml.writeSBMLToFile(document, filename)
+
+
+class TestNative(unittest.TestCase):
+
+    def test_ode(self):
+        results = SciPyODESolver.run(refilled_decay(), t=10, increment=0.5)
+        t, A, B, C = results[0].T
+        # The output at t = 5 is taken before the event
+        after = t != 5
+        numpy.testing.assert_allclose(A[after], expected_A(t[after]),
+                                      rtol=1e-4)
+        self.assertAlmostEqual(A[t == 5][0], 100 * numpy.exp(-2.5), 3)
+        numpy.testing.assert_allclose(B, 2 * A)
+        numpy.testing.assert_allclose(C, t, atol=1e-6)
+
+    def test_ode_output_at_event(self):
+        # Wherever the event falls, the output at its time is the state
+        # before it
+        for time in (0.3, 1, 2.5, 7, 10):
+            model = refilled_decay()
+            model.delete_event('refill')
+            model.add_event(gillespy.Event(name='refill',
+                                           trigger='t >= {0!r}'.format(time),
+                                           assignments={'A': '100'}))
+            tspan = sorted(set(range(12)) | {time})
+            A = SciPyODESolver.run(model, tspan=tspan)[0][:, 1]
+            i = tspan.index(time)
+            self.assertAlmostEqual(A[i], 100 * numpy.exp(-0.5 * time), 3)
+            self.assertAlmostEqual(A[i + 1], 100 * numpy.exp(
+                -0.5 * (tspan[i + 1] - time)), 3)
+
+    def test_ssa(self):
+        results = NumPySSASolver.run(refilled_decay(), t=10, increment=1,
+                                     number_of_trajectories=20, seed=1)
+        for trajectory in results:
+            t, A, B, C = trajectory.T
+            self.assertTrue(numpy.all(numpy.diff(A[t <= 5]) <= 0))
+            self.assertGreater(A[t == 6][0], A[t == 5][0])
+            numpy.testing.assert_array_equal(B, 2 * A)
+            # Forward Euler is exact for a constant rate
+            numpy.testing.assert_allclose(C, t)
+        mean = numpy.mean([trajectory[:, 1] for trajectory in results], 0)
+        self.assertLess(abs(mean[7] - expected_A(7.0)), 10)
+
+    def test_species_trigger(self):
+        model = refilled_decay()
+        model.delete_event('refill')
+        model.add_event(gillespy.Event(name='refill', trigger='A < 10',
+                                       assignments={'A': '50'}))
+        results = NumPySSASolver.run(model, t=20, increment=1,
+                                     number_of_trajectories=10, seed=2)
+        for trajectory in results:
+            self.assertGreaterEqual(trajectory[:, 1].min(), 9)
+        A = SciPyODESolver.run(model, t=20, increment=1)[0][:, 1]
+        self.assertGreaterEqual(A.min(), 10 - 1e-3)
+        self.assertGreater(A.max(), A[-1])
+
+    def test_parameter_event(self):
+        # The reaction stops at t = 5
+        model = refilled_decay()
+        model.delete_event('refill')
+        model.add_event(gillespy.Event(name='stop', trigger='t >= 5',
+                                       assignments={'k': '0'}))
+        results = NumPySSASolver.run(model, t=10, increment=1, seed=3)
+        t, A = results[0][:, 0], results[0][:, 1]
+        self.assertTrue(numpy.all(A[t >= 6] == A[t == 6][0]))
+        A = SciPyODESolver.run(model, t=10, increment=1)[0][:, 1]
+        numpy.testing.assert_allclose(A[6:], 100 * numpy.exp(-2.5),
+                                      rtol=1e-4)
+
+    def test_rule_errors(self):
+        model = refilled_decay()
+        with self.assertRaises(gillespy.ModelError):
+            model.add_rule(gillespy.RateRule('B', '1'))
+        with self.assertRaises(gillespy.ModelError):
+            gillespy.Event(name='never')
+
+
+@unittest.skipIf(libsbml is None, "libsbml is not installed")
+class TestSBML(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'refilled_decay.xml')
+        write_sbml(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import(self):
+        model, errors = gillespy.import_SBML(self.filename)
+        self.assertEqual(list(model.listOfEvents), ['refill'])
+        self.assertEqual(model.listOfEvents['refill'].trigger, 't >= 5')
+        self.assertEqual(dict(model.listOfEvents['refill'].assignments),
+                         {'A': '100'})
+        self.assertFalse(model.listOfEvents['refill'].initial_value)
+        # Function definitions are inlined
+        self.assertEqual(model.listOfAssignmentRules['B'].expression,
+                         '(2*(A))')
+        self.assertEqual(model.listOfRateRules['C'].expression, '1')
+        self.assertNotIn('mass_action',
+                         model.listOfReactions['decay'].propensity_function)
+
+    def test_trajectory(self):
+        model, errors = gillespy.import_SBML(self.filename)
+        results = SciPyODESolver.run(model, t=10, increment=0.5,
+                                     show_labels=True)
+        t, A = results[0]['time'], results[0]['A']
+        after = t != 5
+        numpy.testing.assert_allclose(A[after], expected_A(t[after]),
+                                      rtol=1e-4)
+        numpy.testing.assert_allclose(results[0]['B'], 2 * A)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Canonical model fingerprints (gillespy.fingerprint).
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.fingerprint import differences
+
+
+def dimerization(order=(0, 1), law='k2*B', k1=0.005, name='dimerization'):
+    """
+    2 A -> B (mass action) and B -> 2 A (customized), with the species,
+    parameters and reactions added in the given order.
+    """
+    model = gillespy.Model(name=name)
+    parameters = [gillespy.Parameter(name='k1', expression=k1),
+                  gillespy.Parameter(name='k2', expression='0.1')]
+    species = [gillespy.Species(name='A', initial_value=50),
+               gillespy.Species(name='B', initial_value=0)]
+    A, B = species
+    reactions = [
+        gillespy.Reaction(name='dimerize', reactants={A: 2}, products={B: 1},
+                          rate=parameters[0]),
+        gillespy.Reaction(name='split', reactants={B: 1}, products={A: 2},
+                          propensity_function=law)]
+    model.add_parameter([parameters[i] for i in order])
+    model.add_species([species[i] for i in order])
+    model.add_reaction([reactions[i] for i in order])
+    return model
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_equal(self):
+        first, second = dimerization(), dimerization()
+        self.assertEqual(first.fingerprint(), second.fingerprint())
+        self.assertEqual(hash(first.fingerprint()),
+                         hash(second.fingerprint()))
+        self.assertEqual(len({first.fingerprint(), second.fingerprint()}), 1)
+        self.assertEqual(first.fingerprint().compare(second.fingerprint()),
+                         'identical')
+
+    def test_order_and_spacing(self):
+        fingerprint = dimerization().fingerprint()
+        for model in (dimerization(order=(1, 0)),
+                      dimerization(law=' k2 * (B) '),
+                      dimerization(k1='5e-3'),
+                      dimerization(name='other')):
+            self.assertEqual(model.fingerprint(), fingerprint)
+        # Name, annotation and output times are not part of it
+        model = dimerization()
+        model.annotation = 'another note'
+        model.timespan(numpy.linspace(0, 5, 3))
+        self.assertEqual(model.fingerprint(), fingerprint)
+
+    def test_parameters(self):
+        fingerprint = dimerization().fingerprint()
+        self.assertEqual(dimerization(k1=0.01).fingerprint().compare(
+            fingerprint), 'parameters')
+        model = dimerization()
+        model.listOfSpecies['A'].initial_value = 60
+        self.assertEqual(model.fingerprint().compare(fingerprint),
+                         'parameters')
+        model = dimerization()
+        model.volume = 2.0
+        self.assertEqual(model.fingerprint().compare(fingerprint),
+                         'parameters')
+        self.assertNotEqual(model.fingerprint(), fingerprint)
+
+    def test_structure(self):
+        fingerprint = dimerization().fingerprint()
+        model = dimerization(law='k2*B*B')
+        self.assertEqual(model.fingerprint().compare(fingerprint),
+                         'structure')
+        model = dimerization()
+        model.listOfReactions['dimerize'].products = \
+            {model.listOfSpecies['B']: 2}
+        self.assertEqual(model.fingerprint().compare(fingerprint),
+                         'structure')
+        model = dimerization()
+        model.add_species([gillespy.Species(name='C', initial_value=0)])
+        self.assertEqual(model.fingerprint().compare(fingerprint),
+                         'structure')
+        model = dimerization()
+        model.add_event(gillespy.Event(name='reset', trigger='t >= 5',
+                                       assignments={'A': '50'}))
+        self.assertEqual(model.fingerprint().compare(fingerprint),
+                         'structure')
+
+    def test_changes_after_fingerprint(self):
+        # Cached digests are computed again once a component changes
+        model = dimerization()
+        before = model.fingerprint()
+        model.set_parameter('k1', '0.01')
+        self.assertEqual(model.fingerprint().compare(before), 'parameters')
+        model.set_parameter('k1', '0.005')
+        self.assertEqual(model.fingerprint(), before)
+
+    def test_clone(self):
+        model = dimerization()
+        clone = model.clone({'k1': 0.01})
+        self.assertEqual(clone.fingerprint(),
+                         dimerization(k1=0.01).fingerprint())
+        self.assertEqual(model.fingerprint(), dimerization().fingerprint())
+
+    def test_from_arrays(self):
+        # The same model, built from objects and from arrays
+        def objects():
+            model = gillespy.Model(name='objects')
+            k = [gillespy.Parameter(name='k_0', expression=0.5),
+                 gillespy.Parameter(name='k_1', expression=2.0)]
+            model.add_parameter(k)
+            A = gillespy.Species(name='A', initial_value=10)
+            B = gillespy.Species(name='B', initial_value=0)
+            model.add_species([A, B])
+            model.add_reaction([
+                gillespy.Reaction(name='R0', reactants={A: 1},
+                                  products={B: 1}, rate=k[0]),
+                gillespy.Reaction(name='R1', reactants={B: 1},
+                                  products={A: 1}, rate=k[1])])
+            return model
+        arrays = gillespy.Model.from_arrays(['A', 'B'], [10, 0],
+                                            [[-1, 1], [1, -1]], [0.5, 2.0])
+        self.assertEqual(arrays.fingerprint(), objects().fingerprint())
+        # Changes through the table views
+        arrays.set_parameter('k_1', '3')
+        model = objects()
+        model.set_parameter('k_1', '3')
+        self.assertEqual(arrays.fingerprint(), model.fingerprint())
+        arrays.delete_reaction('R0')
+        model.delete_reaction('R0')
+        self.assertEqual(arrays.fingerprint(), model.fingerprint())
+
+
+class TestDifferences(unittest.TestCase):
+
+    def test_differences(self):
+        model = dimerization()
+        self.assertEqual(differences(model, dimerization()),
+                         {'structure': [], 'parameters': []})
+        other = dimerization(k1=0.01, law='k2*B*B')
+        other.listOfSpecies['A'].initial_value = 60
+        other.volume = 2.0
+        other.add_species([gillespy.Species(name='C', initial_value=0)])
+        self.assertEqual(differences(model, other), {
+            'structure': ['reaction split', 'species C'],
+            'parameters': ['parameter k1', 'species A', 'volume']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Model.freeze: immutable compiled snapshots of a model.
+"""
+import pickle
+import threading
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.compiled import compile_model
+from gillespy.native import NumPySSASolver, SciPyODESolver
+
+
+def enzyme():
+    """ S -> P, catalysed by E with a customized propensity """
+    model = gillespy.Model(name='enzyme')
+    Vmax = gillespy.Parameter(name='Vmax', expression=20.0)
+    Km = gillespy.Parameter(name='Km', expression=50.0)
+    k = gillespy.Parameter(name='k', expression=0.1)
+    model.add_parameter([Vmax, Km, k])
+    S = gillespy.Species(name='S', initial_value=200)
+    P = gillespy.Species(name='P', initial_value=0)
+    model.add_species([S, P])
+    model.add_reaction([
+        gillespy.Reaction(name='convert', reactants={S: 1}, products={P: 1},
+                          propensity_function='Vmax*S/(Km+S)'),
+        gillespy.Reaction(name='decay', reactants={P: 1}, products={},
+                          rate=k)])
+    model.timespan(numpy.linspace(0, 10, 11))
+    return model
+
+
+class TestFreeze(unittest.TestCase):
+
+    def test_read_only(self):
+        frozen = enzyme().freeze()
+        self.assertTrue(frozen.frozen)
+        for array in (frozen.stoichiometry, frozen.initial_values,
+                      frozen.ma_rate, frozen.tspan):
+            self.assertFalse(array.flags.writeable)
+            with self.assertRaises(ValueError):
+                array[0] = 1
+        with self.assertRaises(TypeError):
+            frozen.parameters['k'] = 1.0
+        with self.assertRaises(AttributeError):
+            frozen.volume = 2.0
+        self.assertIs(compile_model(frozen), frozen)
+        # A model that is not frozen can be changed
+        compiled = compile_model(enzyme())
+        self.assertFalse(compiled.frozen)
+        compiled.volume = 2.0
+
+    def test_snapshot(self):
+        model = enzyme()
+        frozen = model.freeze()
+        before = NumPySSASolver.run(model, t=10, increment=1, seed=4)
+        model.set_parameter('Vmax', '100')
+        model.listOfSpecies['S'].initial_value = 10
+        self.assertEqual(frozen.parameters['Vmax'], 20.0)
+        self.assertEqual(frozen.initial_values[0], 200)
+        after = NumPySSASolver.run(frozen, t=10, increment=1, seed=4)
+        numpy.testing.assert_array_equal(before[0], after[0])
+
+    def test_pickle(self):
+        frozen = enzyme().freeze()
+        copy = pickle.loads(pickle.dumps(frozen))
+        self.assertTrue(copy.frozen)
+        self.assertFalse(copy.stoichiometry.flags.writeable)
+        with self.assertRaises(TypeError):
+            copy.parameters['k'] = 1.0
+        first = NumPySSASolver.run(frozen, t=10, increment=1, seed=2)
+        second = NumPySSASolver.run(copy, t=10, increment=1, seed=2)
+        numpy.testing.assert_array_equal(first[0], second[0])
+
+    def test_threads(self):
+        frozen = enzyme().freeze()
+        seeds = range(8)
+        expected = [NumPySSASolver.run(frozen, t=10, increment=1,
+                                       seed=seed)[0] for seed in seeds]
+        results = {}
+
+        def simulate(seed):
+            results[seed] = NumPySSASolver.run(frozen, t=10, increment=1,
+                                               seed=seed)[0]
+        threads = [threading.Thread(target=simulate, args=(seed,))
+                   for seed in seeds]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for seed in seeds:
+            numpy.testing.assert_array_equal(results[seed], expected[seed])
+
+    def test_solvers(self):
+        model = enzyme()
+        frozen = model.freeze()
+        numpy.testing.assert_allclose(
+            SciPyODESolver.run(frozen, t=10, increment=1)[0],
+            SciPyODESolver.run(model, t=10, increment=1)[0])
+        with self.assertRaises(gillespy.SimulationError):
+            gillespy.StochKitSolver.run(frozen, t=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
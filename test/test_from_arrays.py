@@ -0,0 +1,159 @@
+"""
+Model.from_arrays: mass-action models kept as arrays, with lazy views of
+their reactions and rate parameters.
+"""
+import unittest
+
+import numpy
+import scipy.sparse
+
+import gillespy
+from gillespy.compiled import compile_model
+from gillespy.native import NumPySSASolver
+
+SPECIES = ['A', 'B', 'C']
+INITIAL = [50, 0, 3]
+# 2 A -> B, B -> 2 A, 0 -> C
+STOICHIOMETRY = numpy.array([[-2, 2, 0],
+                             [1, -1, 0],
+                             [0, 0, 1]])
+RATES = [0.005, 0.1, 2.0]
+
+
+def from_arrays(stoichiometry=STOICHIOMETRY, **kwargs):
+    model = gillespy.Model.from_arrays(SPECIES, INITIAL, stoichiometry,
+                                       RATES, name='arrays', **kwargs)
+    model.timespan(numpy.linspace(0, 10, 11))
+    return model
+
+
+def from_objects():
+    """ The same model built from Reaction and Parameter objects. """
+    model = gillespy.Model(name='objects')
+    k = [gillespy.Parameter(name='k_{0}'.format(j), expression=rate)
+         for j, rate in enumerate(RATES)]
+    model.add_parameter(k)
+    A, B, C = [gillespy.Species(name=name, initial_value=x)
+               for name, x in zip(SPECIES, INITIAL)]
+    model.add_species([A, B, C])
+    model.add_reaction([
+        gillespy.Reaction(name='R0', reactants={A: 2}, products={B: 1},
+                          rate=k[0]),
+        gillespy.Reaction(name='R1', reactants={B: 1}, products={A: 2},
+                          rate=k[1]),
+        gillespy.Reaction(name='R2', reactants={}, products={C: 1},
+                          rate=k[2])])
+    model.timespan(numpy.linspace(0, 10, 11))
+    return model
+
+
+class TestFromArrays(unittest.TestCase):
+
+    def test_round_trip(self):
+        model = from_arrays()
+        self.assertEqual(list(model.listOfSpecies), SPECIES)
+        self.assertEqual([s.initial_value for s in
+                          model.listOfSpecies.values()], INITIAL)
+        self.assertEqual(list(model.listOfReactions), ['R0', 'R1', 'R2'])
+        self.assertEqual(list(model.listOfParameters), ['k_0', 'k_1', 'k_2'])
+        self.assertEqual([p.value for p in model.listOfParameters.values()],
+                         RATES)
+        R0 = model.listOfReactions['R0']
+        self.assertEqual(dict(R0.reactants), {'A': 2})
+        self.assertEqual(dict(R0.products), {'B': 1})
+        self.assertTrue(R0.massaction)
+        self.assertEqual(R0.marate.name, 'k_0')
+        self.assertEqual(dict(model.listOfReactions['R2'].reactants), {})
+
+    def test_same_as_objects(self):
+        arrays, objects = compile_model(from_arrays()), \
+            compile_model(from_objects())
+        numpy.testing.assert_array_equal(arrays.stoichiometry,
+                                         objects.stoichiometry)
+        numpy.testing.assert_array_equal(arrays.ma_rate, objects.ma_rate)
+        self.assertEqual(arrays.reaction_names, objects.reaction_names)
+        first = NumPySSASolver.run(from_arrays(), seed=3)
+        second = NumPySSASolver.run(from_objects(), seed=3)
+        numpy.testing.assert_array_equal(first[0], second[0])
+
+    def test_sparse(self):
+        model = from_arrays(scipy.sparse.csr_matrix(STOICHIOMETRY),
+                            reaction_names=['dimerize', 'split', 'make'])
+        self.assertEqual(list(model.listOfReactions),
+                         ['dimerize', 'split', 'make'])
+        self.assertEqual(dict(model.listOfReactions['split'].products),
+                         {'A': 2})
+        # The compiled stoichiometry has a row per reaction
+        numpy.testing.assert_array_equal(compile_model(model).stoichiometry,
+                                         STOICHIOMETRY.T)
+
+    def test_catalysts(self):
+        # A + C -> B + C: C is a reactant with no net change
+        stoichiometry = numpy.array([[-1], [1], [0]])
+        reactants = numpy.array([[1], [0], [1]])
+        model = gillespy.Model.from_arrays(SPECIES, INITIAL, stoichiometry,
+                                           [1.0], reactants=reactants)
+        R0 = model.listOfReactions['R0']
+        self.assertEqual(dict(R0.reactants), {'A': 1, 'C': 1})
+        self.assertEqual(dict(R0.products), {'B': 1, 'C': 1})
+
+    def test_errors(self):
+        with self.assertRaises(gillespy.ModelError):
+            from_arrays(STOICHIOMETRY[:2])
+        with self.assertRaises(gillespy.ModelError):
+            from_arrays(reaction_names=['R', 'R', 'S'])
+        with self.assertRaises(gillespy.ModelError):
+            gillespy.Model.from_arrays(SPECIES, [1, 2], STOICHIOMETRY, RATES)
+        with self.assertRaises(gillespy.ReactionError):
+            from_arrays(orders=[2, 1, 1])
+        with self.assertRaises(gillespy.ReactionError):
+            # 3 A -> B
+            gillespy.Model.from_arrays(SPECIES, INITIAL,
+                                       numpy.array([[-3], [1], [0]]), [1.0])
+        with self.assertRaises(KeyError):
+            from_arrays().listOfReactions['R3']
+
+
+class TestLazyReactions(unittest.TestCase):
+
+    def test_views_not_kept(self):
+        model = from_arrays()
+        reactions = model.listOfReactions
+        R1 = reactions['R1']
+        self.assertEqual(R1.name, 'R1')
+        self.assertFalse(reactions.is_built('R1'))
+        self.assertIsNot(reactions['R1'], R1)
+        self.assertEqual(len(reactions), 3)
+        self.assertIn('R1', reactions)
+        self.assertNotIn('R3', reactions)
+
+    def test_changes_kept(self):
+        model = from_arrays()
+        # 0 -> C becomes B -> C
+        R2 = model.listOfReactions['R2']
+        R2.reactants['B'] = 1
+        self.assertTrue(model.listOfReactions.is_built('R2'))
+        self.assertFalse(model.listOfReactions.is_built('R0'))
+        self.assertEqual(dict(model.listOfReactions['R2'].reactants),
+                         {'B': 1})
+        model.set_parameter('k_1', '0.5')
+        self.assertEqual(model.listOfParameters['k_1'].value, 0.5)
+        compiled = compile_model(model)
+        numpy.testing.assert_array_equal(compiled.stoichiometry[2],
+                                         [0, -1, 1])
+        self.assertEqual(compiled.ma_rate[1], 0.5)
+
+    def test_delete_and_add(self):
+        model = from_arrays()
+        model.delete_reaction('R1')
+        self.assertEqual(list(model.listOfReactions), ['R0', 'R2'])
+        model.add_reaction([gillespy.Reaction(
+            name='decay', reactants={model.listOfSpecies['C']: 1},
+            products={}, rate=model.listOfParameters['k_1'])])
+        self.assertEqual(list(model.listOfReactions), ['R0', 'R2', 'decay'])
+        results = NumPySSASolver.run(model, t=10, increment=1, seed=1)
+        self.assertEqual(results[0].shape, (11, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+"""
+Import of gillespy: the heavy optional dependencies are only loaded when a
+feature that needs them is used, so that import gillespy stays fast.
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules that import gillespy must not load
+LAZY = ('scipy', 'libsbml', 'lxml', 'matplotlib')
+
+
+class TestImport(unittest.TestCase):
+
+    def test_heavy_modules_are_lazy(self):
+        code = ("import sys, gillespy; print(' '.join(m for m in {0!r} "
+                "if m in sys.modules))".format(LAZY))
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        output = subprocess.check_output([sys.executable, '-W', 'ignore',
+                                          '-c', code], env=env)
+        self.assertEqual(output.decode().split(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+MomentSolver: for networks of reactions of up to first order the moment
+equations are exact, so the LNA and the normal closure give the mean and
+variance of the chemical master equation.
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.moments import MomentSolver
+
+try:
+    import scipy
+except ImportError:
+    scipy = None
+
+TSPAN = numpy.linspace(0, 10, 21)
+
+
+def birth_death(initial_value, birth=10.0, death=0.5):
+    """ 0 -> A -> 0 """
+    model = gillespy.Model(name='birth_death')
+    k = gillespy.Parameter(name='k', expression=birth)
+    g = gillespy.Parameter(name='g', expression=death)
+    model.add_parameter([k, g])
+    A = gillespy.Species(name='A', initial_value=initial_value)
+    model.add_species([A])
+    model.add_reaction([
+        gillespy.Reaction(name='birth', reactants={}, products={A: 1},
+                          rate=k),
+        gillespy.Reaction(name='death', reactants={A: 1}, products={},
+                          rate=g)])
+    model.timespan(TSPAN)
+    return model
+
+
+def isomerization(total, forward=0.3, backward=0.1):
+    """ A <-> B, all molecules starting as A. """
+    model = gillespy.Model(name='isomerization')
+    kf = gillespy.Parameter(name='kf', expression=forward)
+    kb = gillespy.Parameter(name='kb', expression=backward)
+    model.add_parameter([kf, kb])
+    A = gillespy.Species(name='A', initial_value=total)
+    B = gillespy.Species(name='B', initial_value=0)
+    model.add_species([A, B])
+    model.add_reaction([
+        gillespy.Reaction(name='forward', reactants={A: 1}, products={B: 1},
+                          rate=kf),
+        gillespy.Reaction(name='backward', reactants={B: 1},
+                          products={A: 1}, rate=kb)])
+    model.timespan(TSPAN)
+    return model
+
+
+@unittest.skipIf(scipy is None, "scipy is not installed")
+class TestMomentSolver(unittest.TestCase):
+
+    def statistics(self, model, algorithm):
+        results = MomentSolver.run(model, tspan=model.tspan,
+                                   algorithm=algorithm)
+        self.assertEqual(results.metadata['algorithm'], algorithm)
+        return results.metadata['statistics']
+
+    def assertClose(self, actual, expected):
+        numpy.testing.assert_allclose(actual, expected, rtol=1e-4,
+                                      atol=1e-6)
+
+    def test_birth_death(self):
+        # A binomial thinning of the initial molecules plus a Poisson
+        # number of new ones
+        x0, k, g = 20, 10.0, 0.5
+        survival = numpy.exp(-g * TSPAN)
+        mean = x0 * survival + k / g * (1 - survival)
+        variance = x0 * survival * (1 - survival) + k / g * (1 - survival)
+        for algorithm in ('lna', 'normal'):
+            statistics = self.statistics(birth_death(x0, k, g), algorithm)
+            self.assertClose(statistics['A'][0], mean)
+            self.assertClose(statistics['A'][1], variance)
+
+    def test_isomerization(self):
+        # Each molecule is A with probability p, independently: binomial
+        n, kf, kb = 100, 0.3, 0.1
+        p = (kb + kf * numpy.exp(-(kf + kb) * TSPAN)) / (kf + kb)
+        for algorithm in ('lna', 'normal'):
+            model = isomerization(n, kf, kb)
+            results = MomentSolver.run(model, tspan=model.tspan,
+                                       algorithm=algorithm)
+            self.assertEqual(results.metadata['conserved'], ['B'])
+            statistics = results.metadata['statistics']
+            self.assertClose(statistics['A'][0], n * p)
+            self.assertClose(statistics['B'][0], n * (1 - p))
+            self.assertClose(statistics['A'][1], n * p * (1 - p))
+            self.assertClose(statistics['B'][1], n * p * (1 - p))
+            self.assertClose(statistics.covariance[:, 0, 1],
+                             -n * p * (1 - p))
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(gillespy.SimulationError):
+            MomentSolver.run(birth_death(0), algorithm='third')
+
+
+if __name__ == '__main__':
+    unittest.main()
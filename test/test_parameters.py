@@ -0,0 +1,210 @@
+"""
+Resolution of parameter expressions (gillespy.parameters): dependency
+order, errors, and batches of parameter sets.
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy import parameters as module
+from gillespy.parameters import compile_parameters
+
+
+def parameters(*expressions):
+    """ A model with the parameters (name, expression), in that order. """
+    model = gillespy.Model(name='parameters')
+    model.add_parameter([gillespy.Parameter(name=name, expression=expression)
+                         for name, expression in expressions])
+    return model
+
+
+class TestResolution(unittest.TestCase):
+
+    def test_dependency_order(self):
+        # a and c refer to parameters defined after them
+        model = parameters(('a', 'b * 2'), ('c', 'a + b'), ('b', 3))
+        evaluate = compile_parameters(model)
+        self.assertEqual(evaluate.names, ['a', 'c', 'b'])
+        self.assertEqual(evaluate.derived, ['a', 'c'])
+        self.assertEqual(dict(evaluate.constants), {'b': 3.0})
+        self.assertEqual(evaluate.dependencies, {'a': {'b'},
+                                                 'c': {'a', 'b'}})
+        self.assertEqual(list(evaluate().items()),
+                         [('a', 6.0), ('c', 9.0), ('b', 3.0)])
+        model.resolve_parameters()
+        self.assertEqual(model.listOfParameters['c'].value, 9.0)
+        model.set_parameter('b', '5')
+        self.assertEqual(model.listOfParameters['a'].value, 10.0)
+        self.assertEqual(model.listOfParameters['c'].value, 15.0)
+
+    def test_overrides(self):
+        evaluate = compile_parameters(parameters(('a', 'b * 2'),
+                                                 ('c', 'a + b'), ('b', 3)))
+        # A derived parameter can be overridden too
+        self.assertEqual(dict(evaluate({'a': 1})),
+                         {'a': 1.0, 'b': 3.0, 'c': 4.0})
+        with self.assertRaises(gillespy.ParameterError):
+            evaluate({'d': 1})
+
+    def test_cycles(self):
+        for expressions in ([('a', 'b'), ('b', 'a + 1')],
+                            [('a', 'c'), ('b', 'a'), ('c', 'b * 2'),
+                             ('d', 1)],
+                            [('a', 'a + 1')]):
+            with self.assertRaises(gillespy.ParameterError) as context:
+                compile_parameters(parameters(*expressions))
+            self.assertIn("depend on each other", str(context.exception))
+        # ParameterError is a ModelError
+        with self.assertRaises(gillespy.ModelError):
+            parameters(('a', 'b'), ('b', 'a')).resolve_parameters()
+
+    def test_errors(self):
+        with self.assertRaises(gillespy.ParameterError) as context:
+            compile_parameters(parameters(('a', 'x + 1')))
+        self.assertIn("unknown parameter(s) x", str(context.exception))
+        with self.assertRaises(gillespy.ParameterError):
+            compile_parameters(parameters(('a', '1 +')))
+        evaluate = compile_parameters(parameters(('a', 'b / c'), ('b', 1),
+                                                 ('c', 0)))
+        with self.assertRaises(gillespy.ParameterError) as context:
+            evaluate()
+        self.assertIn("expression a", str(context.exception))
+
+    def test_grammar(self):
+        # Only the expressions of propensity functions
+        for expression in ('int(2.5)', '[1, 2][0]', 'numpy.pi', 'k.real'):
+            with self.assertRaises(gillespy.ParameterError):
+                parameters(('k', 1), ('a', expression)).resolve_parameters()
+
+
+class TestUpdate(unittest.TestCase):
+
+    def model(self):
+        model = parameters(('a', 'b * 2'), ('c', 'd + 1'), ('e', 'a + d'),
+                           ('b', 3), ('d', 1))
+        model.resolve_parameters()
+        return model
+
+    def values(self, model):
+        return dict((name, p.value)
+                    for name, p in model.listOfParameters.items())
+
+    def test_affected(self):
+        evaluate = compile_parameters(self.model())
+        self.assertEqual(evaluate.affected('b'), ['a', 'e'])
+        self.assertEqual(evaluate.affected('d'), ['c', 'e'])
+        self.assertEqual(evaluate.affected('a'), ['a', 'e'])
+        self.assertEqual(evaluate.affected('e'), ['e'])
+
+    def test_only_dependents(self):
+        model = self.model()
+        # c does not depend on b, so it is not evaluated again
+        model.listOfParameters['c'].value = 99.0
+        model.set_parameter('b', '5')
+        self.assertEqual(self.values(model), {'a': 10.0, 'b': 5.0,
+                                              'c': 99.0, 'd': 1.0,
+                                              'e': 11.0})
+        self.assertEqual(model.namespace['e'], 11.0)
+        model.resolve_parameters()
+        self.assertEqual(model.listOfParameters['c'].value, 2.0)
+
+    def test_cached(self):
+        model = self.model()
+        evaluate = compile_parameters(model)
+        self.assertIs(compile_parameters(model), evaluate)
+        # New constants share the parsed dependency graph
+        misses = module._parse.cache_info().misses
+        for value in range(10):
+            model.set_parameter('b', str(value))
+            self.assertEqual(model.listOfParameters['e'].value,
+                             2.0 * value + 1)
+        self.assertIs(compile_parameters(model).dependencies,
+                      evaluate.dependencies)
+        self.assertEqual(module._parse.cache_info().misses, misses)
+        # The caches are bounded
+        self.assertIsNotNone(module._parse.cache_info().maxsize)
+        self.assertIsNotNone(module._compile.cache_info().maxsize)
+
+    def test_structure(self):
+        model = self.model()
+        model.set_parameter('a', 'b * 3')
+        self.assertEqual(self.values(model)['e'], 10.0)
+        # b now depends on d
+        model.set_parameter('b', 'd * 4')
+        self.assertEqual(self.values(model), {'a': 12.0, 'b': 4.0,
+                                              'c': 2.0, 'd': 1.0,
+                                              'e': 13.0})
+        model.set_parameter('d', '2')
+        self.assertEqual(self.values(model), {'a': 24.0, 'b': 8.0,
+                                              'c': 3.0, 'd': 2.0,
+                                              'e': 26.0})
+        with self.assertRaises(gillespy.ParameterError):
+            model.set_parameter('d', 'e')
+
+    def test_added_and_deleted(self):
+        model = self.model()
+        compile_parameters(model)
+        model.add_parameter(gillespy.Parameter(name='b', expression='d'))
+        model.set_parameter('d', '7')
+        self.assertEqual(self.values(model)['a'], 14.0)
+        model.delete_parameter('c')
+        self.assertEqual(compile_parameters(model).names,
+                         ['a', 'e', 'b', 'd'])
+        model.set_parameter('d', '1')
+        self.assertEqual(self.values(model)['e'], 3.0)
+
+    def test_changed_directly(self):
+        # Picked up by the next evaluation
+        model = self.model()
+        model.listOfParameters['b'].expression = '4'
+        self.assertEqual(model.evaluate_parameters()['a'], 8.0)
+        model.listOfParameters['c'].set_expression('a')
+        self.assertEqual(model.evaluate_parameters()['c'], 8.0)
+
+    def test_from_arrays(self):
+        model = gillespy.Model.from_arrays(['A'], [10], [[-1, 1]],
+                                           [0.5, 2.0])
+        model.set_parameter('k_1', '3')
+        self.assertFalse(model.listOfParameters.is_built('k_0'))
+        model.set_parameter('k_0', '1')
+        self.assertEqual(dict(model.evaluate_parameters()),
+                         {'k_0': 1.0, 'k_1': 3.0})
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_sweep(self):
+        model = parameters(('a', 'b * 2'), ('c', 'a + b + d'), ('b', 3),
+                           ('d', 1))
+        values = model.evaluate_parameters({'b': numpy.arange(4)})
+        numpy.testing.assert_array_equal(values['a'], [0, 2, 4, 6])
+        numpy.testing.assert_array_equal(values['c'], [1, 4, 7, 10])
+        # Constants are broadcast to the shape of the batch
+        numpy.testing.assert_array_equal(values['d'], [1, 1, 1, 1])
+        # The Parameter objects are left alone
+        self.assertIsNone(model.listOfParameters['a'].value)
+
+    def test_broadcasting(self):
+        evaluate = compile_parameters(parameters(('a', 'b * d'), ('b', 1),
+                                                 ('d', 1)))
+        values = evaluate({'b': [[1], [2]], 'd': [1, 10, 100]})
+        for name in ('a', 'b', 'd'):
+            self.assertEqual(values[name].shape, (2, 3))
+        numpy.testing.assert_array_equal(values['a'], [[1, 10, 100],
+                                                       [2, 20, 200]])
+        with self.assertRaises(gillespy.ParameterError):
+            evaluate({'b': [1, 2], 'd': [1, 2, 3]})
+
+    def test_from_arrays(self):
+        # Rate parameters are taken from the arrays
+        model = gillespy.Model.from_arrays(['A'], [10], [[-1, 1]],
+                                           [0.5, 2.0])
+        evaluate = compile_parameters(model)
+        self.assertEqual(dict(evaluate()), {'k_0': 0.5, 'k_1': 2.0})
+        numpy.testing.assert_array_equal(
+            evaluate({'k_0': [1, 2]})['k_1'], [2.0, 2.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+Runs to a precision (gillespy.Precision and ensemble.run_to_precision).
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.ensemble import run_to_precision
+from gillespy.native import NumPySSASolver
+
+
+def birth_death():
+    """ 0 -> A -> 0 """
+    model = gillespy.Model(name='birth_death')
+    k = gillespy.Parameter(name='k', expression=10.0)
+    g = gillespy.Parameter(name='g', expression=0.5)
+    model.add_parameter([k, g])
+    A = gillespy.Species(name='A', initial_value=0)
+    B = gillespy.Species(name='B', initial_value=5)
+    model.add_species([A, B])
+    model.add_reaction([
+        gillespy.Reaction(name='birth', reactants={}, products={A: 1},
+                          rate=k),
+        gillespy.Reaction(name='death', reactants={A: 1}, products={},
+                          rate=g)])
+    model.timespan(numpy.linspace(0, 5, 6))
+    return model
+
+
+def run(precision, seed=1, **kwargs):
+    return birth_death().run(solver=NumPySSASolver, seed=seed,
+                             precision=precision, show_labels=False, **kwargs)
+
+
+class TestPrecision(unittest.TestCase):
+
+    def test_arguments(self):
+        for kwargs in ({'width': 0}, {'width': 1, 'confidence': 1},
+                       {'width': 1, 'max_trajectories': 0},
+                       {'width': 1, 'batch_size': 0}):
+            with self.assertRaises(ValueError):
+                gillespy.Precision(**kwargs)
+
+    def test_interval_width(self):
+        precision = gillespy.Precision(1.0, confidence=0.95)
+        data = numpy.array([[[1.0]], [[3.0]]])
+        # 2 * 1.96 * std / sqrt(n)
+        self.assertAlmostEqual(precision.interval_width(data),
+                               2 * 1.959964 * numpy.sqrt(2) / numpy.sqrt(2),
+                               5)
+        self.assertEqual(precision.interval_width(data[:1]), numpy.inf)
+        relative = gillespy.Precision(1.0, relative=True)
+        self.assertAlmostEqual(relative.interval_width(data),
+                               precision.interval_width(data) / 2)
+
+
+class TestRunToPrecision(unittest.TestCase):
+
+    def test_converged(self):
+        precision = gillespy.Precision(1.0, batch_size=10, processes=1)
+        rounds = []
+        results = run(precision, progress=lambda p: rounds.append(
+            p.trajectories_completed))
+        metadata = results.metadata
+        self.assertTrue(metadata['converged'])
+        self.assertLessEqual(metadata['interval_width'], precision.width)
+        self.assertEqual(metadata['target_width'], 1.0)
+        self.assertEqual(metadata['number_of_trajectories'], len(results))
+        # The interval of the trajectories returned
+        data = numpy.array(list(results))[:, :, 1:]
+        self.assertAlmostEqual(precision.interval_width(data),
+                               metadata['interval_width'])
+        # The ensemble grows in whole batches, until it has converged
+        self.assertEqual(len(results) % 10, 0)
+        self.assertGreater(len(rounds), 0)
+        for n in rounds:
+            self.assertGreater(precision.interval_width(data[:n]), 1.0)
+
+    def test_max_trajectories(self):
+        precision = gillespy.Precision(1e-3, batch_size=4,
+                                       max_trajectories=10, processes=1)
+        results = run(precision)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results.metadata['number_of_trajectories'], 10)
+        self.assertFalse(results.metadata['converged'])
+        self.assertGreater(results.metadata['interval_width'], 1e-3)
+
+    def test_selection(self):
+        # B never changes, so a run checking only B converges at once
+        precision = gillespy.Precision(1e-3, species=['B'], batch_size=5,
+                                       processes=1)
+        results = run(precision)
+        self.assertTrue(results.metadata['converged'])
+        self.assertEqual(len(results), 5)
+        # Only at t = 0, where A is always 0
+        precision = gillespy.Precision(1e-3, species=['A'], times=[0.1],
+                                       batch_size=5, processes=1)
+        self.assertEqual(len(run(precision)), 5)
+        with self.assertRaises(gillespy.SimulationError):
+            run(gillespy.Precision(1.0, species=['C'], processes=1))
+
+    def test_same_trajectories(self):
+        # Trajectory i is the same whatever the batching and processes
+        first = run(gillespy.Precision(1e-3, batch_size=5,
+                                       max_trajectories=12, processes=1))
+        for batch_size, processes in ((5, 2), (3, 1), (12, 3)):
+            results = run(gillespy.Precision(1e-3, batch_size=batch_size,
+                                             max_trajectories=12,
+                                             processes=processes))
+            self.assertEqual(len(results), 12)
+            for a, b in zip(first, results):
+                numpy.testing.assert_array_equal(a, b)
+        self.assertEqual(run(gillespy.Precision(
+            1e-3, batch_size=5, max_trajectories=12, processes=2)).metadata[
+            'seed'], first.metadata['seed'])
+        # And differs with the seed
+        other = run(gillespy.Precision(1e-3, batch_size=5,
+                                       max_trajectories=12, processes=1),
+                    seed=2)
+        self.assertFalse(all(numpy.array_equal(a, b)
+                             for a, b in zip(first, other)))
+
+    def test_direct(self):
+        model = birth_death()
+        precision = gillespy.Precision(1e-3, batch_size=2,
+                                       max_trajectories=4, processes=1)
+        results = run_to_precision(model, NumPySSASolver, precision, seed=1,
+                                   show_labels=True, tspan=model.tspan,
+                                   t=model.tspan[-1])
+        self.assertEqual(len(results), 4)
+        self.assertEqual(sorted(results[0]), ['A', 'B', 'time'])
+
+
+if __name__ == '__main__':
+    unittest.main()
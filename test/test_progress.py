@@ -0,0 +1,101 @@
+"""
+Progress callbacks of the solvers, with statistics of the partial results.
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.ensemble import EnsembleStatistics, Progress
+from gillespy.native import NumPySSASolver, SciPyODESolver
+
+
+def conversion():
+    """ A -> B """
+    model = gillespy.Model(name='conversion')
+    k = gillespy.Parameter(name='k', expression=1.0)
+    model.add_parameter([k])
+    A = gillespy.Species(name='A', initial_value=1000)
+    B = gillespy.Species(name='B', initial_value=0)
+    model.add_species([A, B])
+    model.add_reaction([gillespy.Reaction(name='convert', reactants={A: 1},
+                                          products={B: 1}, rate=k)])
+    return model
+
+
+class TestProgress(unittest.TestCase):
+
+    def test_fraction(self):
+        progress = Progress(4, 1, 2.5, 10.0, 500, 2.0)
+        self.assertEqual(progress.fraction, 0.25)
+        self.assertEqual(progress.events_per_second, 250)
+        self.assertIsNone(progress.statistics())
+        self.assertIsNone(Progress(4, 0, 0, 10, None, 1).events_per_second)
+
+    def test_partial_statistics(self):
+        reports = []
+
+        def progress(p):
+            statistics = p.statistics()
+            reports.append((p.time, p.trajectories_completed, p.events,
+                            statistics.time.copy(), statistics.mean.copy(),
+                            statistics.number_of_trajectories))
+        results = NumPySSASolver.run(conversion(), t=10, increment=1,
+                                     number_of_trajectories=5, seed=1,
+                                     progress=progress, progress_interval=0)
+        self.assertFalse(results.metadata['aborted'])
+        self.assertGreater(len(reports), 1)
+        final = EnsembleStatistics.from_trajectories(results, ['A', 'B'])
+        times = [report[0] for report in reports]
+        self.assertEqual(times, sorted(times))
+        for time, completed, events, t, mean, n in reports:
+            self.assertEqual(n, 5)
+            # All trajectories, up to the time every one of them reached
+            self.assertEqual(t[-1], time)
+            numpy.testing.assert_array_equal(t, final.time[:len(t)])
+            numpy.testing.assert_array_equal(mean, final.mean[:len(t)])
+            numpy.testing.assert_array_equal(mean.sum(1), 1000)
+            self.assertLessEqual(events, 5000)
+        self.assertEqual(reports[-1][1], 5)
+        self.assertEqual(reports[-1][0], 10)
+
+    def test_abort(self):
+        results = NumPySSASolver.run(conversion(), t=10, increment=1,
+                                     number_of_trajectories=5, seed=1,
+                                     progress=lambda p: p.time < 2,
+                                     progress_interval=0)
+        self.assertTrue(results.metadata['aborted'])
+        stop_time = results.metadata['stop_time']
+        self.assertLess(stop_time, 10)
+        for trajectory in results:
+            self.assertEqual(trajectory[-1, 0], stop_time)
+
+    def test_ode(self):
+        reports = []
+        results = SciPyODESolver.run(conversion(), t=10, increment=1,
+                                     progress=reports.append)
+        statistics = reports[-1].statistics()
+        numpy.testing.assert_array_equal(statistics.mean,
+                                         results[0][:, 1:])
+
+    def test_precision(self):
+        # Reported after each round of batches that does not end the run
+        reports = []
+
+        def progress(p):
+            reports.append((p.trajectories_completed,
+                            p.statistics().number_of_trajectories))
+        precision = gillespy.Precision(1e-3, batch_size=5,
+                                       max_trajectories=15, processes=1)
+        results = conversion().run(solver=NumPySSASolver, seed=1,
+                                   precision=precision, progress=progress,
+                                   progress_interval=0)
+        self.assertEqual(results.metadata['number_of_trajectories'], 15)
+        self.assertGreater(len(reports), 0)
+        for completed, n in reports:
+            self.assertEqual(n, completed)
+            self.assertLess(completed, 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
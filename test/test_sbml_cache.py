@@ -0,0 +1,104 @@
+"""
+The SBML conversion cache (import_SBML with cache_dir).
+"""
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import gillespy
+
+try:
+    import libsbml
+except ImportError:
+    libsbml = None
+
+
+def write_sbml(filename):
+    """ An SBML model of the decay A -> 0. """
+    document = libsbml.SBMLDocument(3, 1)
+    model = document.createModel()
+    model.setId('decay')
+    compartment = model.createCompartment()
+    compartment.setId('cell')
+    compartment.setSize(1.0)
+    compartment.setConstant(True)
+    species = model.createSpecies()
+    species.setId('A')
+    species.setCompartment('cell')
+    species.setInitialAmount(100)
+    species.setHasOnlySubstanceUnits(True)
+    species.setBoundaryCondition(False)
+    species.setConstant(False)
+    parameter = model.createParameter()
+    parameter.setId('k')
+    parameter.setValue(0.1)
+    parameter.setConstant(True)
+    reaction = model.createReaction()
+    reaction.setId('decay')
+    reaction.setReversible(False)
+    reaction.setFast(False)
+    reactant = reaction.createReactant()
+    reactant.setSpecies('A')
+    reactant.setStoichiometry(1)
+    reactant.setConstant(True)
+    law = reaction.createKineticLaw()
+    law.setMath(libsbml.parseL3Formula('k * A'))
+    libsbml.writeSBMLToFile(document, filename)
+
+
+@unittest.skipIf(libsbml is None, "libsbml is not installed")
+class TestSBMLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = os.path.join(self.directory, 'cache')
+        self.filename = os.path.join(self.directory, 'decay.xml')
+        write_sbml(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert(self):
+        model, errors = gillespy.import_SBML(self.filename,
+                                             cache_dir=self.cache)
+        self.assertEqual(list(model.listOfSpecies), ['A'])
+        self.assertEqual(model.listOfParameters['k'].value, 0.1)
+        return model
+
+    def test_cached(self):
+        self.convert()
+        entries = glob.glob(os.path.join(self.cache, '*.pickle'))
+        self.assertEqual(len(entries), 1)
+        mtime = os.path.getmtime(entries[0])
+        self.convert()
+        self.assertEqual(os.path.getmtime(entries[0]), mtime)
+
+    def test_stale_entry_is_a_miss(self):
+        self.convert()
+        entry, = glob.glob(os.path.join(self.cache, '*.pickle'))
+        # A pickle of a class that no longer exists
+        with open(entry, 'wb') as f:
+            f.write(b'cgillespy.gillespy\n_Removed\n.')
+        self.convert()
+        self.convert()
+
+    def test_unwritable_cache(self):
+        # A file where the cache directory should be
+        with open(self.cache, 'w') as f:
+            f.write('')
+        self.convert()
+
+    def test_failed_write(self):
+        with mock.patch('pickle.dump', side_effect=OSError("disk full")):
+            self.convert()
+        self.assertEqual(os.listdir(self.cache), [])
+        self.convert()
+        self.assertEqual(len(glob.glob(os.path.join(self.cache,
+                                                    '*.pickle'))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+"""
+Translation of SBML kinetic laws from MathML: mass-action laws become
+native mass-action reactions, other laws customized propensities.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.compiled import compile_model
+from gillespy.native import NumPySSASolver
+
+try:
+    import libsbml
+    from gillespy.SBMLimport import MathTranslator, UntranslatableError
+except ImportError:
+    libsbml = None
+
+
+def write_sbml(filename, reactions, amounts=True):
+    """
+    An SBML model of the species A (100) and B (50) and the constants k
+    (0.1), Km (10) and Vmax (5), with reactions given as (id, reactants,
+    products, kinetic law formula). The species are amounts, or else
+    concentrations.
+    """
+    document = libsbml.SBMLDocument(3, 1)
+    model = document.createModel()
+    model.setId('laws')
+    compartment = model.createCompartment()
+    compartment.setId('cell')
+    compartment.setSize(1.0)
+    compartment.setConstant(True)
+    for name, value in (('A', 100), ('B', 50)):
+        species = model.createSpecies()
+        species.setId(name)
+        species.setCompartment('cell')
+        if amounts:
+            species.setInitialAmount(value)
+        else:
+            species.setInitialConcentration(value)
+        species.setHasOnlySubstanceUnits(amounts)
+        species.setBoundaryCondition(False)
+        species.setConstant(False)
+    for name, value in (('k', 0.1), ('Km', 10.0), ('Vmax', 5.0)):
+        parameter = model.createParameter()
+        parameter.setId(name)
+        parameter.setValue(value)
+        parameter.setConstant(True)
+    for name, reactants, products, formula in reactions:
+        reaction = model.createReaction()
+        reaction.setId(name)
+        reaction.setReversible(False)
+        reaction.setFast(False)
+        for species, create in ((reactants, reaction.createReactant),
+                                (products, reaction.createProduct)):
+            for s, n in species.items():
+                reference = create()
+                reference.setSpecies(s)
+                reference.setStoichiometry(n)
+                reference.setConstant(True)
+        law = reaction.createKineticLaw()
+        law.setMath(libsbml.parseL3Formula(formula))
+    libsbml.writeSBMLToFile(document, filename)
+
+
+@unittest.skipIf(libsbml is None, "libsbml is not installed")
+class TestTranslator(unittest.TestCase):
+
+    def translate(self, formula):
+        translator = MathTranslator(libsbml, ['A', 'B'], ['k', 'cell'])
+        return translator.expression(libsbml.parseL3Formula(formula))
+
+    def test_expressions(self):
+        for formula, expression in (
+                ('a - (b - c)', 'a - (b - c)'),
+                ('a - b - c', 'a - b - c'),
+                ('a / (b * c)', 'a/(b*c)'),
+                ('(a + b) * c', '(a + b)*c'),
+                ('a^2', 'pow(a, 2)'),
+                ('root(3, x)', 'pow(x, 1.0/3)'),
+                ('log(10, x)', 'log10(x)'),
+                ('ln(x)', 'log(x)'),
+                ('abs(x)', 'fabs(x)'),
+                ('exp(-k * time)', 'exp(-k*t)'),
+                ('piecewise(1, a > 2, 0)', 'piecewise(1, a > 2, 0)'),
+                ('not(a)', '(a == 0)'),
+                ('and(a > 1, b < 2)',
+                 '(((a > 1) != 0) & ((b < 2) != 0))')):
+            self.assertEqual(self.translate(formula), expression)
+
+    def test_untranslatable(self):
+        with self.assertRaises(UntranslatableError):
+            self.translate('factorial(a)')
+        with self.assertRaises(UntranslatableError):
+            self.translate('a > 1 > 2')
+
+    def test_mass_action_rate(self):
+        translator = MathTranslator(libsbml, ['A', 'B'], ['k', 'cell'])
+        for formula, reactants, rate in (
+                ('k', {}, 'k'),
+                ('k * A', {'A': 1}, 'k'),
+                ('A * k * B', {'A': 1, 'B': 1}, 'k'),
+                ('0.5 * k * A', {'A': 1}, '0.5*k'),
+                ('k * cell * A', {'A': 1}, 'k*cell'),
+                # Not reproduced by mass-action propensities
+                ('k * A * A', {'A': 2}, None),
+                ('k * A', {'A': 1, 'B': 1}, None),
+                ('k * A * time', {'A': 1}, None),
+                ('Vmax * A / (Km + A)', {'A': 1}, None)):
+            node = libsbml.parseL3Formula(formula)
+            self.assertEqual(translator.mass_action_rate(node, reactants),
+                             rate, formula)
+
+
+@unittest.skipIf(libsbml is None, "libsbml is not installed")
+class TestImport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def convert(self, reactions, amounts=True, gillespy_model=None):
+        filename = os.path.join(self.directory, 'laws.xml')
+        write_sbml(filename, reactions, amounts)
+        model, errors = gillespy.import_SBML(filename,
+                                             gillespy_model=gillespy_model)
+        return model
+
+    def test_units(self):
+        reactions = [('convert', {'A': 1}, {'B': 1}, 'k * A')]
+        self.assertEqual(self.convert(reactions).units, 'population')
+        self.assertEqual(self.convert(reactions, amounts=False).units,
+                         'concentration')
+
+    def test_volume(self):
+        # The rate constants make up for the volume of mass-action
+        # propensities, so the propensities are the kinetic laws
+        reactions = [('bind', {'A': 1, 'B': 1}, {}, 'k * A * B'),
+                     ('make', {}, {'A': 1}, 'Vmax'),
+                     ('decay', {'A': 1}, {}, 'k * A')]
+        model = self.convert(reactions,
+                             gillespy_model=gillespy.Model(volume=2.0))
+        for reaction in model.listOfReactions.values():
+            self.assertTrue(reaction.massaction, reaction.name)
+        X = numpy.array([[100.0, 50.0]])
+        numpy.testing.assert_allclose(compile_model(model).propensities(X),
+                                      [[0.1 * 100 * 50, 5.0, 0.1 * 100]])
+
+    def test_mass_action(self):
+        model = self.convert([
+            ('bind', {'A': 1, 'B': 1}, {}, 'k * A * B'),
+            ('make', {}, {'A': 1}, 'Vmax'),
+            ('decay', {'A': 1}, {}, '0.5 * k * A')])
+        bind, make, decay = [model.listOfReactions[name] for name in
+                             ('bind', 'make', 'decay')]
+        for reaction in (bind, make, decay):
+            self.assertTrue(reaction.massaction, reaction.name)
+        self.assertIs(bind.marate, model.listOfParameters['k'])
+        self.assertIs(make.marate, model.listOfParameters['Vmax'])
+        # A rate that is not a parameter gets one of its own
+        model.resolve_parameters()
+        self.assertEqual(decay.marate.name, 'decay_rate')
+        self.assertAlmostEqual(decay.marate.value, 0.05)
+
+    def test_customized(self):
+        model = self.convert([
+            ('dimerize', {'A': 2}, {'B': 1}, 'k * A * A'),
+            ('convert', {'A': 1}, {'B': 1}, 'Vmax * A / (Km + A)'),
+            ('switch', {'B': 1}, {}, 'piecewise(k * B, B > 10, 0)')])
+        for reaction in model.listOfReactions.values():
+            self.assertFalse(reaction.massaction, reaction.name)
+        self.assertEqual(model.listOfReactions['convert'].propensity_function,
+                         'Vmax*A/(Km + A)')
+        # The translated laws evaluate as the formulas do
+        compiled = compile_model(model)
+        X = numpy.array([[100.0, 50.0], [20.0, 5.0]])
+        expected = [[0.1 * 100 * 100, 5 * 100 / 110.0, 0.1 * 50],
+                    [0.1 * 20 * 20, 5 * 20 / 30.0, 0.0]]
+        numpy.testing.assert_allclose(compiled.propensities(X), expected)
+
+    def test_untranslatable_law(self):
+        filename = os.path.join(self.directory, 'laws.xml')
+        write_sbml(filename, [('grow', {}, {'A': 1}, 'factorial(B)')])
+        model, errors = gillespy.import_SBML(filename)
+        # The formula is kept as given, and the conversion is incomplete
+        self.assertEqual(model.listOfReactions['grow'].propensity_function,
+                         'factorial(B)')
+        self.assertTrue(any("'grow'" in message and code < 0
+                            for message, code in errors))
+
+    def test_same_trajectory(self):
+        # A -> B at rate k*A, as imported and as written by hand
+        model = self.convert([('convert', {'A': 1}, {'B': 1}, 'k * A')])
+        manual = gillespy.Model(name='manual')
+        k = gillespy.Parameter(name='k', expression=0.1)
+        manual.add_parameter([k])
+        A = gillespy.Species(name='A', initial_value=100)
+        B = gillespy.Species(name='B', initial_value=50)
+        manual.add_species([A, B])
+        manual.add_reaction([gillespy.Reaction(name='convert',
+                                               reactants={A: 1},
+                                               products={B: 1}, rate=k)])
+        first = NumPySSASolver.run(model, t=10, increment=1, seed=7)
+        second = NumPySSASolver.run(manual, t=10, increment=1, seed=7)
+        numpy.testing.assert_array_equal(first[0], second[0])
+        numpy.testing.assert_array_equal(first[0][:, 1] + first[0][:, 2],
+                                         150)
+
+
+if __name__ == '__main__':
+    unittest.main()
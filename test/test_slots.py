@@ -0,0 +1,139 @@
+"""
+Model objects with __slots__, and changes made through the table views of
+Model.from_arrays models.
+"""
+import copy
+import pickle
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.compiled import compile_model
+
+# A -> B, B -> A, B -> 0
+STOICHIOMETRY = numpy.array([[-1, 1, 0],
+                             [1, -1, -1]])
+
+
+def table_model():
+    return gillespy.Model.from_arrays(['A', 'B'], [10, 5], STOICHIOMETRY,
+                                      [1.0, 2.0, 3.0],
+                                      reaction_names=['f', 'b', 'd'])
+
+
+class TestSlots(unittest.TestCase):
+
+    def test_attributes(self):
+        A = gillespy.Species(name='A', initial_value=3)
+        k = gillespy.Parameter(name='k', expression='2')
+        r = gillespy.Reaction(name='r', reactants={A: 1}, products={},
+                              rate=k)
+        for obj in (A, k, r):
+            # The declared attributes are slots, others go to the __dict__
+            self.assertEqual(vars(obj), {})
+            obj.note = 'x'
+            self.assertEqual(vars(obj), {'note': 'x'})
+
+    def test_stochml(self):
+        model = gillespy.Model(name='decay')
+        A = gillespy.Species(name='A', initial_value=3)
+        A.description = 'a species'
+        k = gillespy.Parameter(name='k', expression='2')
+        model.add_species([A])
+        model.add_parameter([k])
+        model.add_reaction([gillespy.Reaction(name='r', reactants={A: 1},
+                                              products={}, rate=k)])
+        document = model.serialize()
+        if isinstance(document, bytes):
+            document = document.decode()
+        self.assertIn('<Description>a species</Description>', document)
+
+    def test_pickle(self):
+        A = gillespy.Species(name='A', initial_value=3)
+        k = gillespy.Parameter(name='k', expression='2')
+        r = gillespy.Reaction(name='r', reactants={A: 1}, products={},
+                              rate=k)
+        restored = pickle.loads(pickle.dumps(r))
+        self.assertEqual(restored.name, 'r')
+        self.assertEqual(restored.marate.expression, '2')
+        self.assertEqual(dict(restored.reactants), dict(r.reactants))
+        self.assertEqual(pickle.loads(pickle.dumps(A)).initial_value, 3)
+        A.description = 'a species'
+        self.assertEqual(pickle.loads(pickle.dumps(A)).description,
+                         'a species')
+
+
+class TestTableViews(unittest.TestCase):
+
+    def test_views(self):
+        model = table_model()
+        for view in (model.listOfReactions['f'],
+                     model.listOfParameters['k_0']):
+            self.assertEqual(vars(view), {})
+        # An attribute set on a view is kept with it
+        model.listOfReactions['f'].note = 'x'
+        self.assertTrue(model.listOfReactions.is_built('f'))
+        self.assertEqual(model.listOfReactions['f'].note, 'x')
+        self.assertFalse(model.listOfReactions.is_built('b'))
+        restored = pickle.loads(pickle.dumps(model))
+        self.assertEqual(restored.listOfReactions['f'].note, 'x')
+        self.assertEqual(restored.listOfReactions['f'].name, 'f')
+
+    def test_products(self):
+        model = table_model()
+        # b: B -> A becomes B -> 2 A
+        model.listOfReactions['b'].products = {'A': 2}
+        self.assertTrue(model.listOfReactions.is_built('b'))
+        self.assertEqual(dict(model.listOfReactions['b'].products),
+                         {'A': 2})
+        numpy.testing.assert_array_equal(compile_model(model).stoichiometry,
+                                         [[-1, 1], [2, -1], [0, -1]])
+
+    def test_copy_on_write(self):
+        model = table_model()
+        reactants = model.listOfReactions['d'].reactants
+        reactants['A'] = 1
+        self.assertEqual(dict(model.listOfReactions['d'].reactants),
+                         {'A': 1, 'B': 1})
+        # The other reactions and the arrays are unchanged
+        self.assertEqual(dict(model.listOfReactions['b'].reactants),
+                         {'B': 1})
+        self.assertFalse(model.listOfReactions.is_built('b'))
+        self.assertEqual(dict(table_model().listOfReactions['d'].reactants),
+                         {'B': 1})
+
+    def test_parameters(self):
+        model = table_model()
+        model.listOfParameters['k_2'].expression = '5'
+        self.assertTrue(model.listOfParameters.is_built('k_2'))
+        self.assertFalse(model.listOfParameters.is_built('k_1'))
+        model.resolve_parameters()
+        self.assertEqual(model.listOfParameters['k_2'].value, 5.0)
+        numpy.testing.assert_array_equal(compile_model(model).ma_rate,
+                                         [1, 2, 5])
+        # A reaction can take another rate parameter
+        model.listOfReactions['d'].marate = model.listOfParameters['k_0']
+        numpy.testing.assert_array_equal(compile_model(model).ma_rate,
+                                         [1, 2, 1])
+
+    def test_add_and_pickle(self):
+        model = table_model()
+        model.listOfReactions['b'].products = {'A': 2}
+        model.add_reaction([gillespy.Reaction(
+            name='make', reactants={}, products={model.listOfSpecies['A']: 1},
+            rate=model.listOfParameters['k_1'])])
+        for copied in (pickle.loads(pickle.dumps(model)),
+                       copy.deepcopy(model)):
+            self.assertEqual(list(copied.listOfReactions),
+                             ['f', 'b', 'd', 'make'])
+            self.assertTrue(copied.listOfReactions.is_built('b'))
+            self.assertEqual(dict(copied.listOfReactions['b'].products),
+                             {'A': 2})
+            numpy.testing.assert_array_equal(
+                compile_model(copied).stoichiometry,
+                compile_model(model).stoichiometry)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Stopping native runs once the ensemble statistics settle (SteadyState).
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.native import NumPySSASolver, SciPyODESolver
+
+
+def conversion():
+    """ A -> B """
+    model = gillespy.Model(name='conversion')
+    k = gillespy.Parameter(name='k', expression=1.0)
+    model.add_parameter([k])
+    A = gillespy.Species(name='A', initial_value=100)
+    B = gillespy.Species(name='B', initial_value=0)
+    model.add_species([A, B])
+    model.add_reaction([gillespy.Reaction(name='convert', reactants={A: 1},
+                                          products={B: 1}, rate=k)])
+    return model
+
+
+class TestCriterion(unittest.TestCase):
+
+    def test_reached(self):
+        criterion = gillespy.SteadyState(window=3, rtol=0.01, atol=0)
+        constant = numpy.full((4, 5, 2), 10.0)
+        self.assertTrue(criterion.reached(constant, [0, 1]))
+        self.assertFalse(criterion.reached(constant[:, :2], [0, 1]))
+        ramp = constant + numpy.arange(5)[None, :, None]
+        self.assertFalse(criterion.reached(ramp, [0, 1]))
+        # Only the given columns are checked
+        ramp[:, :, 1] = 10.0
+        self.assertFalse(criterion.reached(ramp, [0]))
+        self.assertTrue(criterion.reached(ramp, [1]))
+
+    def test_spread(self):
+        # A constant mean with a growing spread has not settled
+        criterion = gillespy.SteadyState(window=3, rtol=0.01, atol=0)
+        data = numpy.full((2, 5, 1), 10.0)
+        data[0, :, 0] += numpy.arange(5)
+        data[1, :, 0] -= numpy.arange(5)
+        self.assertFalse(criterion.reached(data, [0]))
+        data[:, :, 0] = [[8.0], [12.0]]
+        self.assertTrue(criterion.reached(data, [0]))
+
+    def test_window(self):
+        with self.assertRaises(ValueError):
+            gillespy.SteadyState(window=1)
+
+
+class TestStop(unittest.TestCase):
+
+    def test_ssa(self):
+        steady_state = gillespy.SteadyState(window=5, rtol=1e-3)
+        results = NumPySSASolver.run(conversion(), t=100, increment=1,
+                                     number_of_trajectories=4, seed=1,
+                                     steady_state=steady_state)
+        self.assertTrue(results.metadata['steady_state'])
+        stop_time = results.metadata['stop_time']
+        self.assertLess(stop_time, 100)
+        for trajectory in results:
+            # Truncated at the stop time, once every A is converted
+            self.assertEqual(trajectory[-1, 0], stop_time)
+            numpy.testing.assert_array_equal(trajectory[-5:, 1:],
+                                             [[0, 100]] * 5)
+
+    def test_ode(self):
+        steady_state = gillespy.SteadyState(window=5, rtol=1e-3)
+        results = SciPyODESolver.run(conversion(), t=100, increment=1,
+                                     steady_state=steady_state)
+        self.assertTrue(results.metadata['steady_state'])
+        stop_time = results.metadata['stop_time']
+        self.assertLess(stop_time, 100)
+        t, A, B = results[0].T
+        self.assertEqual(t[-1], stop_time)
+        # Settled to within rtol of B over the window
+        self.assertLess(A[-5] - A[-1], 1e-3 * 100)
+
+    def test_species(self):
+        # Only B is checked
+        steady_state = gillespy.SteadyState(window=5, rtol=1e-3,
+                                            species=['B'])
+        results = NumPySSASolver.run(conversion(), t=100, increment=1,
+                                     seed=1, steady_state=steady_state)
+        self.assertTrue(results.metadata['steady_state'])
+        self.assertEqual(results[0][-1, 2], 100)
+
+    def test_not_reached(self):
+        steady_state = gillespy.SteadyState(window=5, rtol=1e-3)
+        results = NumPySSASolver.run(conversion(), t=3, increment=1, seed=1,
+                                     steady_state=steady_state)
+        self.assertFalse(results.metadata['steady_state'])
+        self.assertEqual(results.metadata['stop_time'], 3)
+        self.assertEqual(results[0].shape, (4, 3))
+
+    def test_stochkit(self):
+        with self.assertRaises(gillespy.SimulationError):
+            gillespy.StochKitSolver.run(conversion(), t=10,
+                                        steady_state=gillespy.SteadyState())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+"""
+Running StochKit (GillesPySolver.run), with stub executables in place of
+the StochKit ones: shell scripts that write output like StochKit.
+"""
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy
+
+import gillespy
+from gillespy import backends
+
+
+def decay():
+    """ A -> 0 """
+    model = gillespy.Model(name='decay')
+    k = gillespy.Parameter(name='k', expression=0.5)
+    model.add_parameter([k])
+    A = gillespy.Species(name='A', initial_value=100)
+    model.add_species([A])
+    model.add_reaction([gillespy.Reaction(name='decay', reactants={A: 1},
+                                          products={}, rate=k)])
+    model.timespan(numpy.linspace(0, 5, 6))
+    return model
+
+
+# Reads the StochKit arguments: the output directory into $out and the
+# number of trajectories into $n, after saving them one per line to
+# $0.argv
+ARGUMENTS = """
+printf '%s\\n' "$@" > "$0.argv"
+n=1
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --out-dir) out="$2"; shift;;
+        --realizations) n="$2"; shift;;
+    esac
+    shift
+done
+"""
+
+# Writes $n trajectories of the decay model, as StochKit does with --label
+TRAJECTORIES = """
+mkdir -p "$out/trajectories" "$out/stats"
+i=0
+while [ $i -lt $n ]; do
+    {
+        echo "time A"
+        for t in 0 1 2 3 4 5; do echo "$t $((100 - 10 * t - i))"; done
+    } > "$out/trajectories/trajectory$i.txt"
+    i=$((i + 1))
+done
+"""
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    # A killed process whose parent is gone is a zombie until init reaps it
+    try:
+        with open('/proc/{0}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return True
+
+
+@unittest.skipIf(os.name != 'posix', "the stub executables are shell scripts")
+class TestStochKit(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.home = os.path.join(self.directory, 'home')
+        self.work = os.path.join(self.directory, 'work')
+        os.mkdir(self.home)
+        os.mkdir(self.work)
+        # Work directories go to self.work rather than /dev/shm
+        patches = [mock.patch.dict(os.environ, {'TMPDIR': self.work}),
+                   mock.patch('tempfile.tempdir', self.work)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        backends.clear_cache()
+
+    def tearDown(self):
+        backends.clear_cache()
+        shutil.rmtree(self.directory)
+
+    def stub(self, body, name='ssa'):
+        """ Installs a stub executable that runs body after ARGUMENTS. """
+        path = os.path.join(self.home, name)
+        with open(path, 'w') as f:
+            f.write("#!/bin/sh\n" + ARGUMENTS + body)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        return path
+
+    def run_stub(self, **options):
+        return gillespy.StochKitSolver.run(decay(), t=5, increment=1,
+                                           stochkit_home=self.home,
+                                           **options)
+
+    def argv(self, path):
+        with open(path + '.argv') as f:
+            return f.read().splitlines()
+
+    def test_arguments(self):
+        path = self.stub(TRAJECTORIES)
+        results = self.run_stub(number_of_trajectories=3, seed=5,
+                                job_id='a job')
+        argv = self.argv(path)
+        options = dict(zip(argv[::2], argv[1::2]))
+        self.assertTrue(options['--model'].endswith('temp_input_a job.xml'))
+        # Arguments are passed as they are, without a shell
+        self.assertEqual(os.path.basename(options['--out-dir']), 'a job')
+        self.assertEqual(argv[argv.index('-t') + 1], '5')
+        self.assertEqual(argv[argv.index('-i') + 1], '5')
+        self.assertEqual(argv[argv.index('-p') + 1], '1')
+        self.assertEqual(argv[argv.index('--realizations') + 1], '3')
+        int(argv[argv.index('--seed') + 1])
+        for flag in ('--keep-trajectories', '--label'):
+            self.assertIn(flag, argv)
+        self.assertEqual(len(results), 3)
+        for i, trajectory in enumerate(results):
+            numpy.testing.assert_array_equal(trajectory[:, 0], range(6))
+            numpy.testing.assert_array_equal(trajectory[:, 1],
+                                             100 - 10 * numpy.arange(6) - i)
+        self.assertEqual(os.listdir(self.work), [])
+
+    def test_get_trajectories(self):
+        # Only the trajectories are read, there need not be statistics
+        out = os.path.join(self.directory, 'out')
+        os.makedirs(os.path.join(out, 'trajectories'))
+        with open(os.path.join(out, 'trajectories', 'trajectory0.txt'),
+                  'w') as f:
+            f.write("time A\n0 100\n1 90\n")
+        labels, trajectories = gillespy.StochKitSolver().get_trajectories(
+            out, show_labels=True)
+        self.assertEqual(list(labels), ['time', 'A'])
+        numpy.testing.assert_array_equal(trajectories[0],
+                                         [[0, 100], [1, 90]])
+
+    def test_chatty_output(self):
+        # More output than a pipe holds does not block StochKit
+        self.stub("""
+i=0
+while [ $i -lt 20000 ]; do echo "line $i"; echo "error $i" >&2; i=$((i + 1)); done
+""" + TRAJECTORIES)
+        results = self.run_stub()
+        self.assertEqual(len(results), 1)
+
+    def test_failure(self):
+        self.stub("""
+echo "bad model" >&2
+exit 1
+""")
+        with self.assertRaises(gillespy.SimuliationError) as context:
+            self.run_stub()
+        self.assertIn("bad model", str(context.exception))
+        self.assertEqual(os.listdir(self.work), [])
+
+    def test_timeout(self):
+        # StochKit and the processes it started are killed
+        pidfile = os.path.join(self.directory, 'pid')
+        self.stub("""
+sleep 30 &
+echo $! > {0}
+exec sleep 30
+""".format(pidfile))
+        start = time.time()
+        with self.assertRaises(gillespy.SimulationError) as context:
+            self.run_stub(timeout=0.5)
+        self.assertLess(time.time() - start, 10)
+        self.assertIn("timed out", str(context.exception))
+        with open(pidfile) as f:
+            child = int(f.read())
+        for _ in range(50):
+            if not alive(child):
+                break
+            time.sleep(0.1)
+        self.assertFalse(alive(child))
+        self.assertEqual(os.listdir(self.work), [])
+
+    def test_unexpected_output(self):
+        # The run fails while StochKit is still running: it is killed and
+        # its work directory removed
+        pidfile = os.path.join(self.directory, 'pid')
+        self.stub("""
+echo $$ > {0}
+mkdir -p "$out/trajectories"
+touch "$out/trajectories/unexpected.txt"
+exec sleep 30
+""".format(pidfile))
+        start = time.time()
+        with self.assertRaises(ValueError):
+            self.run_stub()
+        self.assertLess(time.time() - start, 10)
+        with open(pidfile) as f:
+            self.assertFalse(alive(int(f.read())))
+        self.assertEqual(os.listdir(self.work), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
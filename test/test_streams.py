@@ -0,0 +1,81 @@
+"""
+Reproducible random streams: a trajectory gets the same numbers however the
+ensemble is split among batches (the trajectories option of the native
+solvers).
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.native import NumPySSASolver
+from gillespy.streams import RandomStreams
+
+
+def dimerization():
+    """ 2 A <-> B, with a birth of A. """
+    model = gillespy.Model(name='dimerization')
+    k1 = gillespy.Parameter(name='k1', expression=0.005)
+    k2 = gillespy.Parameter(name='k2', expression=0.1)
+    k3 = gillespy.Parameter(name='k3', expression=2.0)
+    model.add_parameter([k1, k2, k3])
+    A = gillespy.Species(name='A', initial_value=50)
+    B = gillespy.Species(name='B', initial_value=0)
+    model.add_species([A, B])
+    model.add_reaction([
+        gillespy.Reaction(name='dimerize', reactants={A: 2}, products={B: 1},
+                          rate=k1),
+        gillespy.Reaction(name='split', reactants={B: 1}, products={A: 2},
+                          rate=k2),
+        gillespy.Reaction(name='birth', reactants={}, products={A: 1},
+                          rate=k3)])
+    model.timespan(numpy.linspace(0, 20, 41))
+    return model
+
+
+class TestRandomStreams(unittest.TestCase):
+
+    def test_uniform_range(self):
+        rng = RandomStreams(1, range(3), block=8)
+        rows = numpy.arange(3)
+        r = numpy.concatenate([rng.uniform(rows) for _ in range(20)])
+        self.assertTrue(((r >= 0) & (r < 1)).all())
+
+    def test_state(self):
+        rng = RandomStreams(1, range(2), block=8)
+        rows = numpy.arange(2)
+        for _ in range(11):
+            rng.uniform(rows)
+        refills, position = rng.get_state()
+        expected = rng.uniform(rows)
+        other = RandomStreams(1, range(2), block=8)
+        other.set_state(refills, position)
+        numpy.testing.assert_array_equal(other.uniform(rows), expected)
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_shards_match_whole_run(self):
+        model = dimerization()
+        whole = NumPySSASolver.run(model, seed=2016, trajectories=range(6))
+        shards = NumPySSASolver.run(model, seed=2016,
+                                    trajectories=[4, 5]) + \
+            NumPySSASolver.run(model, seed=2016, trajectories=[0, 1, 2, 3])
+        for i, shard in zip([4, 5, 0, 1, 2, 3], shards):
+            numpy.testing.assert_array_equal(shard, whole[i])
+
+    def test_single_trajectory(self):
+        model = dimerization()
+        whole = NumPySSASolver.run(model, seed=7, number_of_trajectories=4)
+        single = NumPySSASolver.run(model, seed=7, trajectories=[3])
+        numpy.testing.assert_array_equal(single[0], whole[3])
+
+    def test_seeds_differ(self):
+        model = dimerization()
+        first = NumPySSASolver.run(model, seed=1)
+        second = NumPySSASolver.run(model, seed=2)
+        self.assertFalse(numpy.array_equal(first[0], second[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
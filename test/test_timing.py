@@ -0,0 +1,129 @@
+"""
+Per-phase timings of solver runs (phase_callback and
+results.metadata['phases']), and profiling them.
+"""
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.native import NumPySSASolver
+from gillespy.timing import PhaseTimer
+
+
+def decay():
+    """ A -> 0 """
+    model = gillespy.Model(name='decay')
+    k = gillespy.Parameter(name='k', expression=0.5)
+    model.add_parameter([k])
+    A = gillespy.Species(name='A', initial_value=100)
+    model.add_species([A])
+    model.add_reaction([gillespy.Reaction(name='decay', reactants={A: 1},
+                                          products={}, rate=k)])
+    model.timespan(numpy.linspace(0, 5, 11))
+    return model
+
+
+class TestPhaseTimer(unittest.TestCase):
+
+    def test_entered_again(self):
+        # The callback gets each stretch of a phase, the phases their sums
+        calls = []
+        timer = PhaseTimer(lambda *call: calls.append(call))
+        timer.begin('setup')
+        timer.count(10)
+        timer.begin('serialize')
+        timer.count(100)
+        timer.begin('setup')
+        timer.count(5)
+        timer.end()
+        self.assertEqual([(name, nbytes) for name, _, nbytes in calls],
+                         [('setup', 10), ('serialize', 100), ('setup', 5)])
+        self.assertEqual(list(timer.phases), ['setup', 'serialize'])
+        self.assertEqual(timer.phases['setup']['bytes'], 15)
+        self.assertAlmostEqual(timer.phases['setup']['time'],
+                               calls[0][1] + calls[2][1])
+        # Ending again does nothing
+        timer.end()
+        self.assertEqual(len(calls), 3)
+
+
+class TestPhases(unittest.TestCase):
+
+    def test_native_phases(self):
+        calls = []
+        results = NumPySSASolver.run(decay(), seed=1,
+                                     number_of_trajectories=3,
+                                     phase_callback=lambda *call:
+                                     calls.append(call))
+        phases = results.metadata['phases']
+        self.assertEqual([name for name, _, _ in calls], list(phases))
+        self.assertIn('simulate', phases)
+        self.assertGreater(phases['simulate']['bytes'], 0)
+        for name, seconds, nbytes in calls:
+            self.assertGreaterEqual(seconds, 0)
+            self.assertEqual(nbytes, phases[name]['bytes'])
+
+    def test_precision_phases(self):
+        for processes in (1, 2):
+            calls = []
+            precision = gillespy.Precision(1e-3, batch_size=5,
+                                           max_trajectories=10,
+                                           processes=processes)
+            results = decay().run(solver=NumPySSASolver, seed=1,
+                                  precision=precision,
+                                  phase_callback=lambda *call:
+                                  calls.append(call))
+            self.assertEqual(results.metadata['number_of_trajectories'], 10)
+            phases = results.metadata['phases']
+            # Every phase of both batches is reported here
+            simulate = [call for call in calls if call[0] == 'simulate']
+            self.assertEqual(len(simulate), 2)
+            self.assertAlmostEqual(sum(call[1] for call in simulate),
+                                   phases['simulate']['time'])
+            self.assertEqual(sum(call[2] for call in simulate),
+                             phases['simulate']['bytes'])
+            # The calls of each phase add up to its total
+            for name, phase in phases.items():
+                self.assertEqual(sum(call[2] for call in calls
+                                     if call[0] == name), phase['bytes'])
+
+
+class TestProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def functions(self, path):
+        return set(name for _, _, name in pstats.Stats(path).stats)
+
+    def test_file(self):
+        path = os.path.join(self.directory, 'run.prof')
+        results = decay().run(solver=NumPySSASolver, seed=1, profile=path,
+                              show_labels=False)
+        self.assertEqual(results.metadata['profile'], path)
+        self.assertIn('ssa', self.functions(path))
+        # The results are those of a run without profiling
+        numpy.testing.assert_array_equal(
+            results[0], decay().run(solver=NumPySSASolver, seed=1,
+                                    show_labels=False)[0])
+
+    def test_temporary_file(self):
+        results = decay().run(solver=NumPySSASolver, seed=1, profile=True)
+        path = results.metadata['profile']
+        try:
+            self.assertTrue(path.endswith('.prof'))
+            self.assertIn('run', self.functions(path))
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
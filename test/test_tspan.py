@@ -0,0 +1,66 @@
+"""
+Non-uniform output timespans: the native solvers record the state at any
+increasing list of times.
+"""
+import unittest
+
+import numpy
+
+import gillespy
+from gillespy.native import NumPySSASolver, SciPyODESolver
+
+TSPAN = [0, 0.1, 0.2, 0.5, 1, 2, 5, 10]
+
+
+def decay():
+    """ A -> 0 """
+    model = gillespy.Model(name='decay')
+    k = gillespy.Parameter(name='k', expression=0.5)
+    model.add_parameter([k])
+    A = gillespy.Species(name='A', initial_value=100)
+    model.add_species([A])
+    model.add_reaction([gillespy.Reaction(name='decay', reactants={A: 1},
+                                          products={}, rate=k)])
+    model.timespan(TSPAN)
+    return model
+
+
+class TestTimespan(unittest.TestCase):
+
+    def test_timespan(self):
+        model = decay()
+        self.assertEqual(list(model.tspan), TSPAN)
+        for tspan in ([], [[0, 1]], [0, 2, 1], [0, 0, 1], [-1, 0]):
+            with self.assertRaises(gillespy.InvalidModelError):
+                model.timespan(tspan)
+
+    def test_ssa(self):
+        results = decay().run(solver=NumPySSASolver, seed=1,
+                              number_of_trajectories=5)
+        for trajectory in results:
+            numpy.testing.assert_array_equal(trajectory['time'], TSPAN)
+            self.assertEqual(trajectory['A'][0], 100)
+            self.assertTrue(numpy.all(numpy.diff(trajectory['A']) <= 0))
+
+    def test_ode(self):
+        results = SciPyODESolver.run(decay(), tspan=TSPAN)
+        t, A = results[0].T
+        numpy.testing.assert_array_equal(t, TSPAN)
+        numpy.testing.assert_allclose(A, 100 * numpy.exp(-0.5 * t),
+                                      rtol=1e-4)
+
+    def test_late_start(self):
+        # The state is still simulated from time 0
+        for solver in (NumPySSASolver, SciPyODESolver):
+            results = solver.run(decay(), tspan=[2, 3, 7], seed=1)
+            numpy.testing.assert_array_equal(results[0][:, 0], [2, 3, 7])
+            self.assertLess(results[0][0, 1], 100)
+        self.assertAlmostEqual(results[0][0, 1], 100 * numpy.exp(-1), 3)
+
+    def test_stochkit_uniform_only(self):
+        with self.assertRaises(gillespy.InvalidModelError):
+            gillespy.StochKitSolver.run(decay(), tspan=TSPAN)
+
+
+if __name__ == '__main__':
+    unittest.main()